@@ -8,51 +8,26 @@ import numpy as np
 import numpy.linalg as la
 from leap.multistep.multirate import TwoRateAdamsBashforthMethodBuilder
 import matplotlib.pyplot as pt
-from functools import partial
-
-
-def process_eigval(evaluate_mat, speed_factor, prec, major_eigval):
-    major_mag = abs(major_eigval)
-    smat = evaluate_mat({
-                "<dt>": 1,
-                "f2f": major_eigval,
-                "s2f": -1/speed_factor*major_mag,
-                "f2s": -1/speed_factor*major_mag,
-                "s2s": major_eigval*1/speed_factor,
-                })
-
-    eigvals = la.eigvals(smat)
-
-    return np.max(np.abs(eigvals))
 
 
 def main():
-    from leap.step_matrix import StepMatrixFinder
-
-    from pymbolic import var
+    from leap.step_matrix import make_multirate_step_matrix_evaluator
 
     speed_factor = 10
     method_name = "Fq"
     order = 3
     step_ratio = 3
-    prec = 1e-5
 
     method = TwoRateAdamsBashforthMethodBuilder(
             method=method_name, order=order, step_ratio=step_ratio,
             static_dt=True)
 
-    code = method.generate()
-
-    finder = StepMatrixFinder(code,
-            function_map={
-                "<func>f2f": lambda t, f, s: var("f2f") * f,
-                "<func>s2f": lambda t, f, s: var("s2f") * s,
-                "<func>f2s": lambda t, f, s: var("f2s") * f,
-                "<func>s2s": lambda t, f, s: var("s2s") * s,
-                },
-            exclude_variables=["<p>bootstrap_step"])
-
-    mat = finder.get_phase_step_matrix("primary")
+    evaluate_mat = make_multirate_step_matrix_evaluator(method, couplings={
+        "<func>f2f": ["fast"],
+        "<func>s2f": ["slow"],
+        "<func>f2s": ["fast"],
+        "<func>s2s": ["slow"],
+        })
 
     left = -3
     right = 1
@@ -62,19 +37,17 @@ def main():
 
     points = np.mgrid[left:right:res*1j, bottom:top:res*1j]
     eigvals = points[0] + 1j*points[1]
-    eigvals_flat = eigvals.reshape(-1)
-
-    from multiprocessing import Pool
-    pool = Pool()
-
-    from leap.step_matrix import fast_evaluator
-    evaluate_mat = fast_evaluator(mat)
+    major_mag = abs(eigvals)
 
-    stable_dts_list = pool.map(
-            partial(process_eigval, evaluate_mat, speed_factor, prec), eigvals_flat)
+    step_matrices = evaluate_mat({
+                "<dt>": 1,
+                "f2f": eigvals,
+                "s2f": -1/speed_factor*major_mag,
+                "f2s": -1/speed_factor*major_mag,
+                "s2s": eigvals*1/speed_factor,
+                })
 
-    max_eigvals = np.zeros(eigvals.shape)
-    max_eigvals.reshape(-1)[:] = stable_dts_list
+    max_eigvals = np.max(np.abs(la.eigvals(step_matrices)), axis=-1)
 
     pt.title("speed factor: %g - step ratio: %g - method: %s "
             "- order: %d"
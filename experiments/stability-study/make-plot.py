@@ -73,7 +73,7 @@ def main():
                     (method, angle, mat_type, substep_count, np.pi))
             x, y, z = auto_xy_reshape(qry)
 
-            import mrab_stability
+            import leap.stability.multirate as mrab_stability
             factory = getattr(mrab_stability, mat_type)
             print "------------------------------"
             print mat_type, method, substep_count, angle/np.pi
@@ -1,2 +1,3 @@
 #! /bin/sh
-mpirun -n 12 `which python` mrab_stability.py
+mkdir -p direct-data
+python mrab_stability.py direct-data/lores.dat
@@ -86,13 +86,30 @@ class MethodBuilder(object):
 class TwoOrderAdaptiveMethodBuilderMixin(MethodBuilder):
     """
     This class expected the following members to be defined: state, t, dt.
+
+    If *ensemble* is *True*, the state carries a leading axis of independent
+    ensemble members, each of which is advanced with its own time step. See
+    :mod:`leap.ensemble` for the functions the generated code relies on.
     """
 
-    def __init__(self, atol=0, rtol=0, max_dt_growth=None, min_dt_shrinkage=None):
+    def __init__(self, atol=0, rtol=0, max_dt_growth=None, min_dt_shrinkage=None,
+            ensemble=False):
         self.adaptive = bool(atol or rtol)
         self.atol = atol
         self.rtol = rtol
 
+        if ensemble and not self.adaptive:
+            raise ValueError("ensemble mode requires atol or rtol to be set")
+
+        self.ensemble = ensemble
+
+        if ensemble:
+            from pymbolic import var
+            self.ensemble_t = var("<p>ensemble_t")
+            self.ensemble_dt = var("<p>ensemble_dt")
+            self.ensemble_step = var("ensemble_step")
+            self.ensemble_accept = var("ensemble_accept")
+
         if max_dt_growth is None:
             max_dt_growth = 5
 
@@ -153,6 +170,119 @@ class TwoOrderAdaptiveMethodBuilderMixin(MethodBuilder):
                Min((0.9 * self.dt * rel_error ** (-1 / self.high_order),
                     self.max_dt_growth * self.dt)))
 
+    # {{{ ensemble mode
+
+    # In ensemble mode, <t> and <dt> describe the synchronization interval.
+    # Each member keeps its own time and proposed time step, and steps that
+    # would go past <t> + <dt> are shortened so that all members meet there.
+
+    def emit_ensemble_initialization(self, cb):
+        from pymbolic import var
+        full = var("<func>ensemble_full")
+
+        cb(self.ensemble_t, full(self.state, var("<t>")))
+        cb(self.ensemble_dt, full(self.state, var("<dt>")))
+
+    def emit_ensemble_step_size(self, cb):
+        from pymbolic import var
+        from pymbolic.primitives import Comparison
+
+        where = var("<func>ensemble_where")
+        sync_t = var("<t>") + var("<dt>")
+
+        cb(self.ensemble_step, where(
+            Comparison(self.ensemble_t + self.ensemble_dt, ">=", sync_t),
+            sync_t - self.ensemble_t,
+            self.ensemble_dt))
+
+    def ensemble_select(self, new_value, old_value):
+        """Return an expression that takes *new_value* for members whose step
+        was accepted and *old_value* for all others.
+        """
+        from pymbolic import var
+        return var("<func>ensemble_where")(
+                self.ensemble_accept, new_value, old_value)
+
+    def finish_adaptive_ensemble(self, cb, high_order_estimate,
+            low_order_estimate):
+        from pymbolic import var
+        from pymbolic.primitives import Comparison
+
+        where = var("<func>ensemble_where")
+        norm = var("<func>ensemble_norm_2")
+        ensemble_min = var("<func>ensemble_min")
+        isnan = var("<builtin>isnan")
+        length = var("<builtin>len")
+
+        def maximum(a, b):
+            return where(Comparison(a, ">", b), a, b)
+
+        def minimum(a, b):
+            return where(Comparison(a, "<", b), a, b)
+
+        sync_t = var("<t>") + var("<dt>")
+        h = self.ensemble_step
+
+        norm_start_state = var('norm_start_state')
+        norm_end_state = var('norm_end_state')
+        rel_error_raw = var('rel_error_raw')
+        rel_error = var('rel_error')
+        active = var('ensemble_active')
+        lands = var('ensemble_lands')
+        new_dt = var('ensemble_new_dt')
+
+        cb(norm_start_state, norm(self.state))
+        cb(norm_end_state, norm(low_order_estimate))
+        cb(rel_error_raw, norm(high_order_estimate - low_order_estimate)
+                / ((length(self.state) / length(self.ensemble_t)) ** 0.5
+                    * (
+                        self.atol + self.rtol
+                        * maximum(norm_start_state, norm_end_state)
+                        )))
+
+        cb(rel_error, where(Comparison(rel_error_raw, "==", 0),
+                                 1.0e-14, rel_error_raw))
+
+        # NaN errors compare false and are therefore rejected.
+        cb(self.ensemble_accept, Comparison(rel_error, "<=", 1))
+        cb(active, Comparison(self.ensemble_t, "<", sync_t))
+        cb(lands, where(self.ensemble_accept,
+            Comparison(self.ensemble_t + self.ensemble_dt, ">=", sync_t),
+            False))
+
+        cb(new_dt, where(self.ensemble_accept,
+            minimum(0.9 * h * rel_error ** (-1 / self.high_order),
+                self.max_dt_growth * h),
+            where(isnan(rel_error),
+                self.min_dt_shrinkage * h,
+                maximum(0.9 * h * rel_error ** (-1 / self.low_order),
+                    self.min_dt_shrinkage * h))))
+
+        with cb.if_(ensemble_min(where(
+                Comparison(self.ensemble_t + new_dt, "==", self.ensemble_t),
+                where(self.ensemble_accept, 1, 0), 1)), "==", 0):
+            cb.raise_(TimeStepUnderflow)
+
+        cb(self.ensemble_dt, where(active, new_dt, self.ensemble_dt))
+
+        # Rejected members take a step of size zero.
+        cb(h, where(self.ensemble_accept, h, 0))
+
+        # This updates the member times.
+        self.finish_nonadaptive(cb,
+                self.ensemble_select(high_order_estimate, self.state),
+                self.ensemble_select(low_order_estimate, self.state))
+
+        # Avoid round-off in reaching the synchronization time.
+        cb(self.ensemble_t, where(lands, sync_t, self.ensemble_t))
+
+        with cb.if_(ensemble_min(self.ensemble_t), ">=", sync_t):
+            cb.yield_state(self.state, self.component_id, sync_t,
+                    "ensemble_sync")
+            cb(var("<t>"), sync_t)
+
+    # }}}
+
 # }}}
 
 
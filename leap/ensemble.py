@@ -0,0 +1,96 @@
+"""Support for integrating ensembles of independent initial conditions."""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import numpy as np
+
+
+__doc__ = """
+Methods generated with ``ensemble=True`` (e.g.
+:class:`leap.rk.ODE45MethodBuilder`) integrate many independent copies
+of an ODE system at once. Every state component carries a leading axis
+indexing the ensemble members, and the right-hand side is called once per
+stage for all members. Each member has its own time and adaptively chosen
+time step, so rejected members are retried while accepted members advance.
+
+Per-member quantities (times, time steps, error norms) are stored as arrays
+of shape ``(nmembers, 1, ..., 1)`` so that they broadcast against the state.
+In particular, the right-hand side receives its *t* argument in this shape.
+
+*<dt>* is the interval at which all members are synchronized. Once every
+member has reached *<t>* + *<dt>*, the state is yielded with time identifier
+``"ensemble_sync"`` and *<t>* is advanced. Intermediate states are yielded
+after every step with the array of member times.
+
+The generated code relies on the following user-supplied functions, for which
+:func:`make_ensemble_function_map` supplies :mod:`numpy` implementations:
+
+* ``<func>ensemble_full(state, value)``: a per-member array filled with
+  *value*.
+* ``<func>ensemble_where(mask, a, b)``: member-wise selection.
+* ``<func>ensemble_norm_2(x)``: the per-member 2-norm.
+* ``<func>ensemble_min(x)``: the minimum over all members.
+
+.. autofunction:: make_ensemble_function_map
+"""
+
+
+def _member_shape(x):
+    x = np.asarray(x)
+    return (x.shape[0],) + (1,)*(x.ndim - 1)
+
+
+def ensemble_full(state, value):
+    return np.full(_member_shape(state), value, dtype=np.float64)
+
+
+def ensemble_where(mask, a, b):
+    return np.where(mask, a, b)
+
+
+def ensemble_norm_2(x):
+    x = np.asarray(x)
+    return np.sqrt(
+            np.sum(np.abs(x.reshape(x.shape[0], -1))**2, axis=1)
+            ).reshape(_member_shape(x))
+
+
+def ensemble_min(x):
+    return np.min(x)
+
+
+def make_ensemble_function_map():
+    """Return a function map with :mod:`numpy` implementations of the
+    functions required by ensemble methods. It can be merged with the
+    right-hand sides before passing it to the method implementation.
+    """
+    return {
+            "<func>ensemble_full": ensemble_full,
+            "<func>ensemble_where": ensemble_where,
+            "<func>ensemble_norm_2": ensemble_norm_2,
+            "<func>ensemble_min": ensemble_min,
+            }
+
+# vim: foldmethod=marker
@@ -0,0 +1,418 @@
+"""Exponential integrators."""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import six
+import numpy as np
+from pymbolic import var
+
+from dagrt.language import CodeBuilder, DAGCode
+from leap import MethodBuilder
+
+
+__doc__ = """
+Exponential integrators for semilinear problems :math:`y' = Ly + N(t, y)`,
+where the stiff linear part :math:`L` is only accessed through applications
+of the matrix functions
+
+.. math::
+
+    \\varphi_0(z) = e^z, \\quad
+    \\varphi_{k+1}(z) = \\frac{\\varphi_k(z) - 1/k!}{z}.
+
+The generated code calls ``<func>phi_<component_id>(k, h, v)``, which is
+expected to return :math:`\\varphi_k(hL) v`. These calls may be rewritten with
+:func:`replace_phi_calls`, and :class:`PhiFunctionEvaluator` supplies a
+reference implementation.
+
+.. autoclass:: ExponentialMethodBuilder
+.. autoclass:: ExponentialEulerMethodBuilder
+.. autoclass:: LawsonRK4MethodBuilder
+.. autoclass:: ETDRK4MethodBuilder
+
+.. autofunction:: replace_phi_calls
+.. autoclass:: PhiFunctionEvaluator
+"""
+
+
+# {{{ method builders
+
+class ExponentialMethodBuilder(MethodBuilder):
+    """
+    User-supplied context:
+        <state> + component_id: The value that is integrated
+        <func> + component_id: The nonlinear part :math:`N(t, y)`
+        <func>phi_ + component_id: Applies :math:`\\varphi_k(hL)`
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    def __init__(self, component_id, rhs_func_name=None, phi_func_name=None):
+        self.component_id = component_id
+
+        if rhs_func_name is None:
+            rhs_func_name = "<func>" + component_id
+        self.rhs_func_name = rhs_func_name
+
+        if phi_func_name is None:
+            phi_func_name = "<func>phi_" + component_id
+        self.phi_func_name = phi_func_name
+
+        self.dt = var("<dt>")
+        self.t = var("<t>")
+        self.state = var("<state>" + component_id)
+
+    def eval_rhs(self, t, y):
+        return var(self.rhs_func_name)(t=t, **{self.component_id: y})
+
+    def phi(self, k, h, v):
+        """Return an expression for :math:`\\varphi_k(hL) v`."""
+        return var(self.phi_func_name)(k, h, v)
+
+    def emit_step(self, cb):
+        """Emit the update of :attr:`state` by one step."""
+        raise NotImplementedError
+
+    def generate(self):
+        """
+        :returns: :class:`dagrt.language.DAGCode`
+        """
+        with CodeBuilder(name="primary") as cb:
+            self.emit_step(cb)
+            cb.yield_state(self.state, self.component_id,
+                    self.t + self.dt, "final")
+            cb(self.t, self.t + self.dt)
+
+        return DAGCode(
+                phases={
+                    "primary": cb.as_execution_phase(next_phase="primary")
+                    },
+                initial_phase="primary")
+
+
+class ExponentialEulerMethodBuilder(ExponentialMethodBuilder):
+    """First-order exponential Euler method,
+
+    .. math::
+
+        y_{n+1} = \\varphi_0(hL) y_n + h \\varphi_1(hL) N(t_n, y_n).
+    """
+
+    def emit_step(self, cb):
+        h = self.dt
+
+        cb(self.state,
+                self.phi(0, h, self.state)
+                + h * self.phi(1, h, self.eval_rhs(self.t, self.state)))
+
+
+class LawsonRK4MethodBuilder(ExponentialMethodBuilder):
+    """Fourth-order Lawson method, i.e. the classical fourth-order Runge-Kutta
+    method applied to :math:`e^{-tL} y`. Only :math:`\\varphi_0` is needed.
+
+    See J. D. Lawson, Generalized Runge-Kutta processes for stable systems
+    with large Lipschitz constants, SIAM J. Numer. Anal. 4 (1967).
+    """
+
+    def emit_step(self, cb):
+        h = self.dt
+        t = self.t
+        y = self.state
+
+        rhs_1 = cb.fresh_var("rhs_1")
+        cb(rhs_1, self.eval_rhs(t, y))
+
+        y_half = cb.fresh_var("y_half")
+        cb(y_half, self.phi(0, h/2, y))
+
+        rhs_1_half = cb.fresh_var("rhs_1_half")
+        cb(rhs_1_half, self.phi(0, h/2, rhs_1))
+
+        rhs_2 = cb.fresh_var("rhs_2")
+        cb(rhs_2, self.eval_rhs(t + h/2, y_half + h/2 * rhs_1_half))
+
+        rhs_3 = cb.fresh_var("rhs_3")
+        cb(rhs_3, self.eval_rhs(t + h/2, y_half + h/2 * rhs_2))
+
+        rhs_4 = cb.fresh_var("rhs_4")
+        cb(rhs_4, self.eval_rhs(t + h, self.phi(0, h/2, y_half + h * rhs_3)))
+
+        # All exponentials are phi_0(h/2 L), so only one matrix function
+        # is needed for a fixed step size.
+        cb(self.state,
+                self.phi(0, h/2,
+                    y_half + h/6 * (rhs_1_half + 2 * rhs_2 + 2 * rhs_3))
+                + h/6 * rhs_4)
+
+
+class ETDRK4MethodBuilder(ExponentialMethodBuilder):
+    """Fourth-order exponential time differencing Runge-Kutta method of Cox
+    and Matthews, in the form given by Krogstad,
+
+    .. math::
+
+        y_{n+1} = \\varphi_0(hL) y_n
+        + h [(\\varphi_1 - 3\\varphi_2 + 4\\varphi_3)(hL) N_1
+        + (2\\varphi_2 - 4\\varphi_3)(hL) (N_a + N_b)
+        + (4\\varphi_3 - \\varphi_2)(hL) N_c].
+
+    See S. M. Cox, P. C. Matthews, Exponential time differencing for stiff
+    systems, J. Comput. Phys. 176 (2002).
+    """
+
+    def emit_step(self, cb):
+        h = self.dt
+        t = self.t
+        y = self.state
+
+        rhs_1 = cb.fresh_var("rhs_1")
+        cb(rhs_1, self.eval_rhs(t, y))
+
+        y_half = cb.fresh_var("y_half")
+        cb(y_half, self.phi(0, h/2, y))
+
+        stage_a = cb.fresh_var("stage_a")
+        cb(stage_a, y_half + h/2 * self.phi(1, h/2, rhs_1))
+        rhs_a = cb.fresh_var("rhs_a")
+        cb(rhs_a, self.eval_rhs(t + h/2, stage_a))
+
+        stage_b = cb.fresh_var("stage_b")
+        cb(stage_b, y_half + h/2 * self.phi(1, h/2, rhs_a))
+        rhs_b = cb.fresh_var("rhs_b")
+        cb(rhs_b, self.eval_rhs(t + h/2, stage_b))
+
+        stage_c = cb.fresh_var("stage_c")
+        cb(stage_c, self.phi(0, h/2, stage_a)
+                + h/2 * self.phi(1, h/2, 2 * rhs_b - rhs_1))
+        rhs_c = cb.fresh_var("rhs_c")
+        cb(rhs_c, self.eval_rhs(t + h, stage_c))
+
+        cb(self.state,
+                self.phi(0, h, y)
+                + h * (
+                    self.phi(1, h, rhs_1)
+                    + self.phi(2, h, -3 * rhs_1 + 2 * (rhs_a + rhs_b) - rhs_c)
+                    + self.phi(3, h, 4 * (rhs_1 - rhs_a - rhs_b + rhs_c))))
+
+# }}}
+
+
+# {{{ phi call lowering
+
+def replace_phi_calls(dag, phi_hooks):
+    """Rewrite the calls to :math:`\\varphi_k` emitted by an
+    :class:`ExponentialMethodBuilder`.
+
+    :arg dag: The :class:`dagrt.language.DAGCode` instance
+    :arg phi_hooks: Either a callable, which is applied to all functions
+        whose names start with ``<func>phi_``, or a map from names of phi
+        functions (such as ``"<func>phi_y"``) to functions that generate
+        their replacements.
+
+        A phi hook should have the signature::
+
+            def phi_hook(k, h, v, func_name):
+
+        where *k* is the (integer) index of the phi function, *h* and *v*
+        are the expressions for the time step and the vector it is applied
+        to, and *func_name* is the name of the called phi function. It returns
+        an expression for :math:`\\varphi_k(hL) v`.
+    """
+
+    if six.callable(phi_hooks):
+        hook = phi_hooks
+
+        def get_hook(func_name):
+            return hook if func_name.startswith("<func>phi_") else None
+    else:
+        get_hook = phi_hooks.get
+
+    from pymbolic.mapper import IdentityMapper
+    from pymbolic.primitives import Call, Variable
+
+    class PhiCallReplacer(IdentityMapper):
+        def map_call(self, expr):
+            if (isinstance(expr.function, Variable)
+                    and get_hook(expr.function.name) is not None):
+                k, h, v = [self.rec(par) for par in expr.parameters]
+                return get_hook(expr.function.name)(
+                        k, h, v, expr.function.name)
+
+            return super(PhiCallReplacer, self).map_call(expr)
+
+        def map_call_with_kwargs(self, expr):
+            if (isinstance(expr.function, Variable)
+                    and get_hook(expr.function.name) is not None
+                    and not expr.kw_parameters):
+                return self.map_call(Call(expr.function, expr.parameters))
+
+            return super(PhiCallReplacer, self).map_call_with_kwargs(expr)
+
+    mapper = PhiCallReplacer()
+
+    from dagrt.language import Assign, AssignFunctionCall
+
+    def replace(stmt):
+        if (isinstance(stmt, AssignFunctionCall)
+                and get_hook(stmt.function_id) is not None):
+            # The call is the entire right-hand side, so it becomes an
+            # ordinary assignment of the hook's expression.
+            return Assign(
+                    assignee=stmt.assignees[0],
+                    assignee_subscript=(),
+                    expression=mapper(stmt.as_expression()),
+                    id=stmt.id,
+                    condition=stmt.condition,
+                    depends_on=stmt.depends_on)
+
+        return stmt.map_expressions(mapper)
+
+    new_phases = {}
+    for phase_name, phase in dag.phases.items():
+        new_phases[phase_name] = phase.copy(statements=[
+            replace(stmt) for stmt in phase.statements])
+
+    return dag.copy(phases=new_phases)
+
+# }}}
+
+
+# {{{ reference phi function evaluation
+
+def _phi_matrices(a, kmax):
+    """Return :math:`\\varphi_0(a), \\dots, \\varphi_{k_\\text{max}}(a)` for
+    a dense matrix *a*, read off the exponential of the augmented block
+    matrix with *a* in the top left and shifted identities above the
+    diagonal.
+    """
+    from scipy.linalg import expm
+
+    n = a.shape[0]
+    nblocks = kmax + 1
+
+    augmented = np.zeros((n*nblocks, n*nblocks), dtype=a.dtype)
+    augmented[:n, :n] = a
+    for i in range(kmax):
+        augmented[i*n:(i+1)*n, (i+1)*n:(i+2)*n] = np.eye(n)
+
+    exp_augmented = expm(augmented)
+    return [exp_augmented[:n, i*n:(i+1)*n] for i in range(nblocks)]
+
+
+class PhiFunctionEvaluator(object):
+    """A reference implementation of ``<func>phi_<component_id>`` for a
+    fixed linear operator *L*.
+
+    For dense *L*, the matrices :math:`\\varphi_k(hL)` are formed by a
+    single matrix exponential and cached for each *h*, so that methods with
+    fixed time steps only compute them once. For sparse *L* (any
+    :mod:`scipy.sparse` matrix or :class:`scipy.sparse.linalg.LinearOperator`),
+    :math:`\\varphi_k(hL) v` is approximated in a Krylov subspace of
+    dimension *krylov_dim* built from *v*.
+
+    .. automethod:: __init__
+    .. automethod:: __call__
+    """
+
+    def __init__(self, linear_op, kmax=3, krylov_dim=30, krylov_tol=1e-12,
+            use_krylov=None):
+        """
+        :arg linear_op: the linear operator *L*
+        :arg kmax: the largest *k* for which :math:`\\varphi_k` is used
+        :arg use_krylov: if *None*, use Krylov approximations if *linear_op*
+            is not a :class:`numpy.ndarray`.
+        """
+        if use_krylov is None:
+            use_krylov = not isinstance(linear_op, np.ndarray)
+
+        if not use_krylov:
+            linear_op = np.asarray(linear_op)
+
+        self.linear_op = linear_op
+        self.kmax = kmax
+        self.krylov_dim = krylov_dim
+        self.krylov_tol = krylov_tol
+        self.use_krylov = use_krylov
+
+        self._matrix_cache = {}
+
+    def phi_matrices(self, h):
+        """Return the (cached) list of :math:`\\varphi_k(hL)` for all
+        *k* up to *kmax*.
+        """
+        try:
+            return self._matrix_cache[h]
+        except KeyError:
+            result = _phi_matrices(h*self.linear_op, self.kmax)
+            self._matrix_cache[h] = result
+            return result
+
+    def _krylov_apply(self, k, h, v):
+        v = np.asarray(v)
+        beta = np.linalg.norm(v)
+        if beta == 0:
+            return np.zeros_like(v)
+
+        n = v.shape[0]
+        m = min(self.krylov_dim, n)
+
+        dtype = np.result_type(v.dtype, np.float64)
+        basis = np.zeros((m+1, n), dtype=dtype)
+        hessenberg = np.zeros((m+1, m), dtype=dtype)
+
+        # Arnoldi
+        basis[0] = v / beta
+        for j in range(m):
+            w = h * (self.linear_op @ basis[j])
+            for i in range(j+1):
+                hessenberg[i, j] = np.vdot(basis[i], w)
+                w = w - hessenberg[i, j] * basis[i]
+
+            hessenberg[j+1, j] = np.linalg.norm(w)
+            if hessenberg[j+1, j] <= self.krylov_tol * beta:
+                # happy breakdown: the subspace is invariant
+                m = j + 1
+                break
+
+            basis[j+1] = w / hessenberg[j+1, j]
+
+        small_phi = _phi_matrices(hessenberg[:m, :m], k)[k]
+        return beta * (small_phi[:, 0] @ basis[:m])
+
+    def __call__(self, k, h, v):
+        """Return :math:`\\varphi_k(hL) v`."""
+        if k > self.kmax:
+            raise ValueError("phi_%d requested, but only up to phi_%d "
+                    "supported" % (k, self.kmax))
+
+        if self.use_krylov:
+            return self._krylov_apply(k, h, v)
+
+        return self.phi_matrices(h)[k] @ v
+
+# }}}
+
+# vim: foldmethod=marker
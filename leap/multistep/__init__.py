@@ -1,4 +1,4 @@
-"""Adams-Bashforth ODE solvers."""
+"""Adams ODE solvers."""
 
 from __future__ import division
 
@@ -29,9 +29,10 @@ THE SOFTWARE.
 """
 
 import six.moves
+from functools import lru_cache
 import numpy as np
 import numpy.linalg as la
-from leap import MethodBuilder
+from leap import MethodBuilder, TwoOrderAdaptiveMethodBuilderMixin
 from pymbolic import var
 
 
@@ -39,6 +40,9 @@ __doc__ = """
 .. autoclass:: AdamsIntegrationFunctionFamily
 .. autoclass:: AdamsMonomialIntegrationFunctionFamily
 .. autoclass:: AdamsBashforthMethodBuilder
+.. autoclass:: AdamsMoultonMethodBuilder
+.. autoclass:: VariableOrderAdamsBashforthMethodBuilder
+.. autoclass:: NordsieckAdamsBashforthMethodBuilder
 """
 
 
@@ -77,6 +81,15 @@ class AdamsMonomialIntegrationFunctionFamily(AdamsIntegrationFunctionFamily):
     def __init__(self, order):
         self.order = order
 
+    def __eq__(self, other):
+        return type(self) is type(other) and self.order == other.order
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((type(self), self.order))
+
     def __len__(self):
         return self.order
 
@@ -84,23 +97,126 @@ class AdamsMonomialIntegrationFunctionFamily(AdamsIntegrationFunctionFamily):
         return x**func_idx
 
     def antiderivative(self, func_idx, x):
-        return 1/(func_idx+1) * x**(func_idx+1)
+        # keeps rational arguments rational
+        return x**(func_idx+1) / (func_idx+1)
 
 
-def _emit_func_family_operation(cb, name_gen,
-        function_family, time_values, hist_vars, rhs_func):
-    if isinstance(time_values, var):
+def _emit_elementary_symmetric_polynomials(cb, name_gen, values):
+    """Return the elementary symmetric polynomials :math:`e_0, \\dots, e_n`
+    of *values*. Those that are not constants are assigned to variables.
+    """
+    from numbers import Number
+
+    esp = [1]
+    for value in values:
+        new_esp = [1]
+        for k in range(1, len(esp) + 1):
+            if k < len(esp):
+                new_value = esp[k] + value * esp[k-1]
+            else:
+                new_value = value * esp[k-1]
+
+            if not isinstance(new_value, Number):
+                esp_var = var(name_gen("elem_sym_poly"))
+                cb(esp_var, new_value)
+                new_value = esp_var
+
+            new_esp.append(new_value)
+
+        esp = new_esp
+
+    return esp
+
+
+def _emit_lagrange_coefficients(cb, name_gen, time_values, rhs_func):
+    """Emit the coefficients that apply the linear functional given by its
+    values *rhs_func(i)* on the monomials to the polynomial interpolating
+    at *time_values*, in closed form.
+
+    The coefficient of the *j*-th value is the functional applied to the
+    Lagrange basis polynomial
+
+    .. math::
+
+        \\ell_j(s) = \\prod_{m\\neq j} \\frac{s - t_m}{t_j - t_m}
+        = \\frac{\\sum_k (-1)^{n-1-k} e_{n-1-k} s^k}
+            {\\prod_{m\\neq j} (t_j - t_m)},
+
+    where the :math:`e_i` are the elementary symmetric polynomials of
+    the nodes other than :math:`t_j`.
+    """
+    n = len(time_values)
+
+    coeffs = []
+    for j in range(n):
+        esp = _emit_elementary_symmetric_polynomials(cb, name_gen,
+                [tv for m, tv in enumerate(time_values) if m != j])
+
+        denominator = 1
+        for m in range(n):
+            if m != j:
+                denominator = denominator * (time_values[j] - time_values[m])
+
+        coeff = var(name_gen("lagrange_coeff"))
+        cb(coeff, sum(
+                (-1)**(n-1-k) * esp[n-1-k] * rhs_func(k)
+                for k in range(n))
+            / denominator)
+        coeffs.append(coeff)
+
+    return coeffs
+
+
+def _emit_node_polynomial_integral(cb, name_gen, time_values, t_start, t_end):
+    """Return the integral of :math:`\\prod_m (s - t_m)` over
+    :math:`[t_\\text{start}, t_\\text{end}]`, where the :math:`t_m` are
+    *time_values*. Up to a factor depending only on the solution, this is
+    the local truncation error of an Adams formula using these nodes.
+    """
+    n = len(time_values)
+    esp = _emit_elementary_symmetric_polynomials(cb, name_gen, time_values)
+
+    return sum(
+            (-1)**(n-k) * esp[n-k]
+            * (t_end**(k+1) - t_start**(k+1)) / (k+1)
+            for k in range(n+1))
+
+
+def _emit_func_family_coefficients(cb, name_gen,
+        function_family, time_values, hist_len, rhs_func, closed_form=True,
+        exact=False):
+    from numbers import Number
+    if (isinstance(time_values, var)
+            or not all(isinstance(tv, Number) for tv in time_values)
+            or not all(isinstance(rhs_func(i), Number)
+                for i in range(len(function_family)))):
         # {{{ variable time step
-        hist_len = len(hist_vars)
 
         nfunctions = len(function_family)
 
+        if (closed_form
+                and isinstance(function_family,
+                    AdamsMonomialIntegrationFunctionFamily)
+                and hist_len == nfunctions):
+            if isinstance(time_values, var):
+                time_values = [time_values[i] for i in range(hist_len)]
+
+            return _emit_lagrange_coefficients(
+                    cb, name_gen, time_values, rhs_func)
+
         array = var("<builtin>array")
         linear_solve = var("<builtin>linear_solve")
         svd = var("<builtin>svd")
         matmul = var("<builtin>matmul")
         transpose = var("<builtin>transpose")
 
+        if not isinstance(time_values, var):
+            time_values_expr = time_values
+            time_values = var(name_gen("time_values"))
+            cb(time_values, array(hist_len))
+            for i in range(hist_len):
+                cb(time_values[i], time_values_expr[i])
+
         # use:
         # Vandermonde^T * a_coeffs = integrate(t_start, t_end, monomials)
 
@@ -155,55 +271,315 @@ def _emit_func_family_operation(cb, name_gen,
             cb(ainv, matmul(intermed, ut, nfunctions, nfunctions))
             cb(a_coeffs, matmul(ainv, coeff_rhs, nfunctions, 1))
 
-        return _linear_comb(
-                    [a_coeffs[ii] for ii in range(hist_len)],
-                    hist_vars)
+        return [a_coeffs[ii] for ii in range(hist_len)]
 
         # }}}
 
     else:
         # {{{ static time step
 
-        hist_len = len(hist_vars)
-        nfunctions = len(function_family)
+        args = (
+                function_family,
+                tuple(time_values[j] for j in range(hist_len)),
+                tuple(rhs_func(i) for i in range(len(function_family))),
+                exact)
+
+        try:
+            hash(args)
+        except TypeError:
+            # e.g. a function family that defines __eq__ but not __hash__
+            return list(_compute_static_func_family_coefficients(*args))
+
+        return list(_static_func_family_coefficients(*args))
+
+        # }}}
+
+
+def _exact_solve(matrix, rhs):
+    """Solve the linear system *matrix* x = *rhs*, given as nested lists of
+    :class:`fractions.Fraction`, by Gaussian elimination.
+    """
+    n = len(matrix)
+    aug = [list(row) + [rhs_i] for row, rhs_i in zip(matrix, rhs)]
+
+    for icol in range(n):
+        ipivot = next(irow for irow in range(icol, n) if aug[irow][icol] != 0)
+        aug[icol], aug[ipivot] = aug[ipivot], aug[icol]
 
-        vdm_t = np.zeros((nfunctions, hist_len))
-        coeff_rhs = np.zeros((nfunctions))
+        for irow in range(n):
+            if irow != icol and aug[irow][icol] != 0:
+                factor = aug[irow][icol] / aug[icol][icol]
+                aug[irow] = [
+                        a - factor * b for a, b in zip(aug[irow], aug[icol])]
 
-        for i in range(nfunctions):
-            for j in range(hist_len):
-                vdm_t[i, j] = function_family.evaluate(i, time_values[j])
+    return [aug[i][n] / aug[i][i] for i in range(n)]
 
-            coeff_rhs[i] = rhs_func(i)
+
+@lru_cache(maxsize=1024)
+def _static_func_family_coefficients(function_family, time_values, rhs_values,
+        exact):
+    """Like :func:`_compute_static_func_family_coefficients`, with cached
+    results, so that generating code for many substeps or regenerating a
+    method does not repeat the same solves. All arguments must be hashable.
+    """
+    return _compute_static_func_family_coefficients(
+            function_family, time_values, rhs_values, exact)
+
+
+def _compute_static_func_family_coefficients(function_family, time_values,
+        rhs_values, exact):
+    """Return a tuple of the coefficients applying the functional with values
+    *rhs_values* on *function_family* to the interpolant at the constant
+    *time_values*. If there are more time values than functions, the
+    minimum-norm coefficients are returned.
+
+    :arg exact: If *True*, the coefficients are computed in rational
+        arithmetic from the (exactly converted) arguments and rounded once.
+    """
+    nfunctions = len(function_family)
+    hist_len = len(time_values)
+
+    if exact:
+        from fractions import Fraction
+        time_values = [Fraction(tv) for tv in time_values]
+
+        vdm_t = [
+                [Fraction(function_family.evaluate(i, tv)) for tv in time_values]
+                for i in range(nfunctions)]
+        coeff_rhs = [Fraction(rv) for rv in rhs_values]
 
         if hist_len == nfunctions:
-            a_coeffs = la.solve(vdm_t, coeff_rhs)
+            a_coeffs = _exact_solve(vdm_t, coeff_rhs)
         else:
-            # SVD-based least squares solve
-            u, sigma, v = la.svd(vdm_t, full_matrices=False)
-            ainv = np.dot(v.transpose(), np.dot(la.inv(np.diag(sigma)),
-                u.transpose()))
-            a_coeffs = np.dot(ainv, coeff_rhs)
+            # a = V^T (V V^T)^{-1} rhs is the minimum-norm solution
+            gram = [
+                    [sum(a*b for a, b in zip(row_i, row_j)) for row_j in vdm_t]
+                    for row_i in vdm_t]
+            y = _exact_solve(gram, coeff_rhs)
+            a_coeffs = [
+                    sum(vdm_t[i][j] * y[i] for i in range(nfunctions))
+                    for j in range(hist_len)]
 
-        return _linear_comb(a_coeffs, hist_vars)
+        return tuple(float(a) for a in a_coeffs)
 
-        # }}}
+    vdm_t = np.zeros((nfunctions, hist_len))
+    coeff_rhs = np.zeros((nfunctions))
+
+    for i in range(nfunctions):
+        for j in range(hist_len):
+            vdm_t[i, j] = function_family.evaluate(i, time_values[j])
+
+        coeff_rhs[i] = rhs_values[i]
+
+    if hist_len == nfunctions:
+        a_coeffs = la.solve(vdm_t, coeff_rhs)
+    else:
+        # SVD-based least squares solve
+        u, sigma, v = la.svd(vdm_t, full_matrices=False)
+        ainv = np.dot(v.transpose(), np.dot(la.inv(np.diag(sigma)),
+            u.transpose()))
+        a_coeffs = np.dot(ainv, coeff_rhs)
+
+    return tuple(a_coeffs)
+
+
+def _emit_func_family_operation(cb, name_gen,
+        function_family, time_values, hist_vars, rhs_func, closed_form=True,
+        ring_buffers=(), exact=False):
+    coeffs = _emit_func_family_coefficients(cb, name_gen,
+            function_family, time_values, len(hist_vars), rhs_func,
+            closed_form=closed_form, exact=exact)
+
+    # {{{ gather the coefficients of values held in ring buffers
+
+    ring_coeffs = {}
+    plain_coeffs = []
+    plain_vars = []
+
+    for coeff, hist_var in zip(coeffs, hist_vars):
+        for ring in ring_buffers:
+            ilogical = ring.logical_index(hist_var)
+            if ilogical is not None:
+                ring_coeffs.setdefault(ring, {})[ilogical] = coeff
+                break
+        else:
+            plain_coeffs.append(coeff)
+            plain_vars.append(hist_var)
+
+    # }}}
+
+    terms = [
+            ring.emit_combination(cb, name_gen, ring_coeffs[ring])
+            for ring in ring_buffers
+            if ring in ring_coeffs]
+    if plain_vars:
+        terms.append(_linear_comb(plain_coeffs, plain_vars))
+
+    return sum(terms[1:], terms[0])
 
 
 def emit_adams_integration(cb, name_gen,
-        function_family, time_values, hist_vars, t_start, t_end):
+        function_family, time_values, hist_vars, t_start, t_end,
+        closed_form=True, ring_buffers=(), exact=False):
     return _emit_func_family_operation(
             cb, name_gen, function_family, time_values, hist_vars,
             lambda i: (
                 function_family.antiderivative(i, t_end)
-                - function_family.antiderivative(i, t_start)))
+                - function_family.antiderivative(i, t_start)),
+            closed_form=closed_form, ring_buffers=ring_buffers, exact=exact)
 
 
 def emit_adams_extrapolation(cb, name_gen,
-        function_family, time_values, hist_vars, t_eval):
+        function_family, time_values, hist_vars, t_eval,
+        closed_form=True, ring_buffers=(), exact=False):
     return _emit_func_family_operation(
             cb, name_gen, function_family, time_values, hist_vars,
-            lambda i: function_family.evaluate(i, t_eval))
+            lambda i: function_family.evaluate(i, t_eval),
+            closed_form=closed_form, ring_buffers=ring_buffers, exact=exact)
+
+# }}}
+
+
+# {{{ runge-kutta bootstrap
+
+def _emit_rk_step(cb, order, state, t, dt, eval_rhs, rhs_var,
+        state_filter=None):
+    """Emit a step of the explicit Runge-Kutta method of *order* from
+    :data:`leap.rk.ORDER_TO_RK_METHOD_BUILDER` that updates *state*, given
+    the right-hand side *rhs_var* at the start of the step.
+    """
+    from leap.rk import ORDER_TO_RK_METHOD_BUILDER
+    rk_method = ORDER_TO_RK_METHOD_BUILDER[order]
+    rk_tableau = tuple(zip(rk_method.c, rk_method.a_explicit))
+    rk_coeffs = rk_method.output_coeffs
+
+    # Stage loop (taken from EmbeddedButcherTableauMethodBuilder)
+    rhss = [var("rk_rhs_" + str(i)) for i in range(len(rk_tableau))]
+    for stage_num, (c, coeffs) in enumerate(rk_tableau):
+        if len(coeffs) == 0:
+            assert c == 0
+            cb(rhss[stage_num], rhs_var)
+        else:
+            stage = state + sum(dt * coeff * rhss[j]
+                                for (j, coeff)
+                                in enumerate(coeffs))
+
+            if state_filter is not None:
+                stage = state_filter(stage)
+
+            cb(rhss[stage_num], eval_rhs(t + c * dt, stage))
+
+    # Merge the values of the RHSs.
+    rk_comb = sum(coeff * rhss[j] for j, coeff in enumerate(rk_coeffs))
+
+    state_est = state + dt * rk_comb
+    if state_filter is not None:
+        state_est = state_filter(state_est)
+
+    # Assign the value of the new state.
+    cb(state, state_est)
+
+# }}}
+
+
+# {{{ ring buffer history
+
+class _HistoryRingBuffer(object):
+    """Persistent history values held in a fixed set of *slots*. The
+    integer variable *head* gives the slot of the oldest value, and the
+    values follow in cyclic order. Adding values overwrites the oldest slots
+    and advances *head*, instead of shifting every value down by one slot.
+
+    Since *head* is only known at run time, the slots are referred to by
+    *entries*, placeholder variables in logical (oldest-first) order, and
+    the coefficients applied to them are permuted at run time.
+    """
+
+    def __init__(self, name, slots, head, time_slots=None):
+        self.slots = list(slots)
+        self.head = head
+        self.time_slots = time_slots
+
+        self.entries = [
+                var("<ring>%s_%d" % (name, i)) for i in range(len(self.slots))]
+        self._entry_to_index = dict(
+                (entry.name, i) for i, entry in enumerate(self.entries))
+
+    def __len__(self):
+        return len(self.slots)
+
+    def logical_index(self, expr):
+        """Return the logical index of *expr* if it is one of
+        :attr:`entries`, or *None*.
+        """
+        from pymbolic.primitives import Variable
+        if isinstance(expr, Variable):
+            return self._entry_to_index.get(expr.name)
+        return None
+
+    def slot_index(self, ihead, ilogical):
+        return (ihead + ilogical) % len(self)
+
+    def emit_initialization(self, cb):
+        cb(self.head, 0)
+
+    def emit_for_each_head(self, cb, body):
+        """Emit *body(ihead)* conditionally on *head* being *ihead*."""
+        if len(self) == 1:
+            body(0)
+            return
+
+        for ihead in range(len(self)):
+            with cb.if_(self.head, "==", ihead):
+                body(ihead)
+
+    def emit_logical_times(self, cb, name_gen):
+        """Return variables holding the times of the history values in
+        logical order.
+        """
+        times = [var(name_gen("ring_time")) for i in range(len(self))]
+
+        def body(ihead):
+            for ilogical, time in enumerate(times):
+                cb(time, self.time_slots[self.slot_index(ihead, ilogical)])
+
+        self.emit_for_each_head(cb, body)
+        return times
+
+    def emit_combination(self, cb, name_gen, coeffs):
+        """Return an expression for the linear combination of the history
+        values with *coeffs*, a mapping from logical indices to coefficients.
+        """
+        weights = [var(name_gen("ring_weight")) for i in range(len(self))]
+
+        def body(ihead):
+            for islot, weight in enumerate(weights):
+                cb(weight, coeffs.get((islot - ihead) % len(self), 0))
+
+        self.emit_for_each_head(cb, body)
+        return _linear_comb(weights, self.slots)
+
+    def emit_push(self, cb, name_gen, values, times=None):
+        """Append *values* (with *times*, if applicable) as the newest
+        entries, dropping as many of the oldest ones.
+        """
+        nvalues = len(values)
+        nkept = min(nvalues, len(self))
+
+        def body(ihead):
+            for i in range(nvalues - nkept, nvalues):
+                islot = self.slot_index(ihead, i)
+                cb(self.slots[islot], values[i])
+                if times is not None:
+                    cb(self.time_slots[islot], times[i])
+
+        self.emit_for_each_head(cb, body)
+
+        if nvalues % len(self):
+            new_head = var(name_gen("ring_new_head"))
+            self.emit_for_each_head(cb,
+                    lambda ihead: cb(new_head, self.slot_index(ihead, nvalues)))
+            cb(self.head, new_head)
 
 # }}}
 
@@ -218,10 +594,14 @@ class AdamsBashforthMethodBuilder(MethodBuilder):
 
     .. automethod:: __init__
     .. automethod:: generate
+    .. automethod:: adams_bootstrap
     """
 
     def __init__(self, component_id, function_family=None, state_filter_name=None,
-            hist_length=None, static_dt=False, order=None):
+            hist_length=None, static_dt=False, order=None,
+            closed_form_coefficients=True, ring_buffer_history=False,
+            bootstrap_method="rk", bootstrap_substeps=1,
+            bootstrap_time_scale=1):
         """
         :arg function_family: Accepts an instance of
             :class:`AdamsIntegrationFunctionFamily`
@@ -229,6 +609,33 @@ class AdamsBashforthMethodBuilder(MethodBuilder):
             with the order given by the integer is used.
         :arg static_dt: If *True*, changing the timestep during time integration
             is not allowed.
+        :arg closed_form_coefficients: If *True*, variable time step
+            coefficients for the monomial function family are computed from
+            closed-form Lagrange integrals, instead of a Vandermonde solve on
+            every step. Only applies if *hist_length* equals the order.
+        :arg ring_buffer_history: If *True*, the right-hand side history is
+            kept in a ring buffer with a rotating head index, so that each
+            step writes one history value instead of shifting all of them.
+        :arg bootstrap_method: How the history is started. With ``"rk"``,
+            each bootstrap step is taken with the explicit Runge-Kutta
+            method of the same order. With ``"adams"``, the method starts
+            itself from order one, see :meth:`adams_bootstrap`. This
+            only evaluates the right-hand side of the method, but it is not
+            cheaper in general: the bootstrap takes about
+            :math:`(k-1)/2 \\log_2(\\tau/h) + k` right-hand side
+            evaluations for a method of order *k*. This exceeds the
+            :math:`(k-1) s` evaluations of the ``"rk"`` bootstrap, with *s*
+            stages, unless the step size *h* is comparable to the time scale
+            :math:`\\tau` of *bootstrap_time_scale*.
+        :arg bootstrap_substeps: With ``"rk"`` bootstrapping, the number of
+            equal substeps taken in each bootstrap step, to make the startup
+            error small compared to that of the method.
+        :arg bootstrap_time_scale: With ``"adams"`` bootstrapping, the time
+            scale :math:`\\tau` relative to which the initial steps are
+            reduced. It is given in the units of the time variable, and
+            should be the time over which the solution changes
+            appreciably, so the default of one is only suitable if the
+            problem is scaled accordingly.
         """
 
         if function_family is not None and order is not None:
@@ -249,20 +656,64 @@ class AdamsBashforthMethodBuilder(MethodBuilder):
 
         self.hist_length = hist_length
         self.static_dt = static_dt
+        self.closed_form_coefficients = closed_form_coefficients
+        self.ring_buffer_history = ring_buffer_history and hist_length > 1
+
+        if bootstrap_method not in ["rk", "adams"]:
+            raise ValueError("unknown bootstrap method: %s" % bootstrap_method)
+        if bootstrap_method != "rk" and bootstrap_substeps != 1:
+            raise ValueError("bootstrap substeps require RK bootstrapping")
+
+        self.bootstrap_method = bootstrap_method
+        self.bootstrap_substeps = bootstrap_substeps
+        self.bootstrap_time_scale = bootstrap_time_scale
+
+        if bootstrap_method == "adams":
+            # the right-hand sides of the latest substeps of the bootstrap
+            self.boot_history = [
+                    var('<p>boot_f_n_minus_' + str(i))
+                    for i in range(len(function_family) - 1, 0, -1)]
+            self.boot_time_history = [
+                    var('<p>boot_t_n_minus_' + str(i))
+                    for i in range(len(function_family) - 1, 0, -1)]
+            self.boot_nhist = var('<p>boot_nhist')
+            self.boot_elapsed = var('<p>boot_elapsed')
 
         self.component_id = component_id
 
         # Declare variables
         self.step = var('<p>step')
         self.function = var('<func>' + component_id)
-        self.history = \
-            [var('<p>f_n_minus_' + str(i)) for i in range(hist_length - 1, 0, -1)]
 
-        if not self.static_dt:
+        if self.ring_buffer_history:
+            # These are slots, in logical order only while the head is 0.
+            self.history = [
+                    var('<p>f_hist_slot_' + str(i))
+                    for i in range(hist_length - 1)]
+        else:
+            self.history = [
+                    var('<p>f_n_minus_' + str(i))
+                    for i in range(hist_length - 1, 0, -1)]
+
+        if self.static_dt:
+            self.time_history = None
+        elif self.ring_buffer_history:
+            self.time_history = [
+                    var('<p>t_hist_slot_' + str(i))
+                    for i in range(hist_length - 1)]
+        else:
             self.time_history = [
                     var('<p>t_n_minus_' + str(i))
                     for i in range(hist_length - 1, 0, -1)]
 
+        if self.ring_buffer_history:
+            self.history_ring = _HistoryRingBuffer("f_hist",
+                    self.history, var("<p>hist_head"), self.time_history)
+            ring_buffers = (self.history_ring,)
+        else:
+            ring_buffers = ()
+        self.ring_buffers = ring_buffers
+
         self.state = var('<state>' + component_id)
         self.t = var('<t>')
         self.dt = var('<dt>')
@@ -281,24 +732,35 @@ class AdamsBashforthMethodBuilder(MethodBuilder):
 
         from dagrt.language import DAGCode, CodeBuilder
 
-        array = var("<builtin>array")
         rhs_var = var("rhs_var")
 
         # Initialization
         with CodeBuilder(name="initialization") as cb_init:
             cb_init(self.step, 1)
+            if self.ring_buffer_history:
+                self.history_ring.emit_initialization(cb_init)
+            if self.bootstrap_method == "adams":
+                cb_init(self.boot_elapsed, 0)
+                cb_init(self.boot_nhist, 0)
 
         # Primary
         with CodeBuilder(name="primary") as cb_primary:
+            if self.ring_buffer_history:
+                history = self.history_ring.entries
+            else:
+                history = self.history
 
             if not self.static_dt:
-                time_history_data = self.time_history + [self.t]
-                time_hist_var = var(name_gen("time_history"))
-                cb_primary(time_hist_var, array(self.hist_length))
-                for i in range(self.hist_length):
-                    cb_primary(time_hist_var[i], time_history_data[i] - self.t)
-
-                time_hist = time_hist_var
+                if self.ring_buffer_history:
+                    time_history_data = self.history_ring.emit_logical_times(
+                            cb_primary, name_gen)
+                else:
+                    time_history_data = self.time_history[:]
+
+                time_history_data.append(self.t)
+                time_hist = [
+                        time_history_data[i] - self.t
+                        for i in range(self.hist_length)]
                 t_end = self.dt
                 dt_factor = 1
 
@@ -308,25 +770,33 @@ class AdamsBashforthMethodBuilder(MethodBuilder):
                 t_end = 1
 
             cb_primary(rhs_var, self.eval_rhs(self.t, self.state))
-            history = self.history + [rhs_var]
+            history = history + [rhs_var]
 
             ab_sum = emit_adams_integration(
                             cb_primary, name_gen,
                             self.function_family,
                             time_hist, history,
-                            0, t_end)
+                            0, t_end,
+                            closed_form=self.closed_form_coefficients,
+                            ring_buffers=self.ring_buffers)
 
             state_est = self.state + dt_factor * ab_sum
             if self.state_filter is not None:
                 state_est = self.state_filter(state_est)
             cb_primary(self.state, state_est)
 
-            # Rotate history and time history.
-            for i in range(self.hist_length - 1):
-                cb_primary(self.history[i], history[i + 1])
+            if self.ring_buffer_history:
+                # Overwrite the oldest value.
+                self.history_ring.emit_push(cb_primary, name_gen,
+                        [rhs_var], None if self.static_dt else [self.t])
 
-                if not self.static_dt:
-                    cb_primary(self.time_history[i], time_history_data[i + 1])
+            else:
+                # Rotate history and time history.
+                for i in range(self.hist_length - 1):
+                    cb_primary(self.history[i], history[i + 1])
+
+                    if not self.static_dt:
+                        cb_primary(self.time_history[i], time_history_data[i + 1])
 
             cb_primary(self.t, self.t + self.dt)
             cb_primary.yield_state(expression=self.state,
@@ -344,12 +814,15 @@ class AdamsBashforthMethodBuilder(MethodBuilder):
 
         # Bootstrap
         with CodeBuilder(name="bootstrap") as cb_bootstrap:
-            self.rk_bootstrap(cb_bootstrap)
-            cb_bootstrap(self.t, self.t + self.dt)
-            cb_bootstrap.yield_state(expression=self.state,
-                                     component_id=self.component_id,
-                                     time_id='', time=self.t)
-            cb_bootstrap(self.step, self.step + 1)
+            if self.bootstrap_method == "adams":
+                self.adams_bootstrap(cb_bootstrap, name_gen)
+            else:
+                self.rk_bootstrap(cb_bootstrap)
+                cb_bootstrap(self.t, self.t + self.dt)
+                cb_bootstrap.yield_state(expression=self.state,
+                                         component_id=self.component_id,
+                                         time_id='', time=self.t)
+                cb_bootstrap(self.step, self.step + 1)
             with cb_bootstrap.if_(self.step, "==", self.hist_length):
                 cb_bootstrap.switch_phase("primary")
 
@@ -378,43 +851,816 @@ class AdamsBashforthMethodBuilder(MethodBuilder):
 
         # Save the current RHS to the AB history
 
-        for i in range(len(self.history)):
+        for i in range(self.hist_length - 1):
             with cb.if_(self.step, "==", i + 1):
                 cb(self.history[i], rhs_var)
 
                 if not self.static_dt:
                     cb(self.time_history[i], self.t)
 
-        from leap.rk import ORDER_TO_RK_METHOD_BUILDER
-        rk_method = ORDER_TO_RK_METHOD_BUILDER[self.function_family.order]
-        rk_tableau = tuple(zip(rk_method.c, rk_method.a_explicit))
-        rk_coeffs = rk_method.output_coeffs
-
-        # Stage loop (taken from EmbeddedButcherTableauMethodBuilder)
-        rhss = [var("rk_rhs_" + str(i)) for i in range(len(rk_tableau))]
-        for stage_num, (c, coeffs) in enumerate(rk_tableau):
-            if len(coeffs) == 0:
-                assert c == 0
-                cb(rhss[stage_num], rhs_var)
+        # The first stage of the first substep reuses the saved RHS.
+        substep_dt = self.dt / self.bootstrap_substeps
+
+        for isubstep in range(self.bootstrap_substeps):
+            if isubstep > 0:
+                cb(rhs_var, self.eval_rhs(
+                    self.t + isubstep * substep_dt, self.state))
+
+            _emit_rk_step(cb, self.function_family.order, self.state,
+                    self.t + isubstep * substep_dt, substep_dt,
+                    self.eval_rhs, rhs_var,
+                    state_filter=self.state_filter)
+
+    def adams_bootstrap(self, cb, name_gen):
+        """Initialize the timestepper with Adams-Bashforth methods of
+        increasing order, from order one. Each execution of the bootstrap
+        phase takes one substep, whose order is one more than that of the
+        previous substep, up to the order *k* of the method.
+
+        The first step *h* is divided into substeps of sizes
+        :math:`h 2^{-J}, h 2^{-J}, h 2^{1-J}, \\dots, h / 2`, each of which
+        doubles the time elapsed since the start. *J* is the smallest
+        integer such that :math:`2^{-J} \\le (h / \\tau)^{(k-1)/2}`, so
+        that the local error of the first substep, of order one, does not
+        exceed that of a step of order *k*. Since the step sizes grow
+        by at most a factor of two, the variable step Adams-Bashforth
+        methods do not amplify the error of the short substeps.
+        The remaining bootstrap steps are taken with the full step size
+        and order.
+        """
+
+        order = len(self.function_family)
+
+        rhs_var = var("rhs_var")
+        cb(rhs_var, self.eval_rhs(self.t, self.state))
+
+        # Save the RHS to the AB history if at the end of a step.
+        at_step_start = var(name_gen("boot_at_step_start"))
+        cb(at_step_start, 0)
+        with cb.if_(self.boot_elapsed, "==", 0):
+            cb(at_step_start, 1)
+        with cb.if_(self.step, ">", 1):
+            cb(at_step_start, 1)
+
+        with cb.if_(at_step_start, "==", 1):
+            for i in range(self.hist_length - 1):
+                with cb.if_(self.step, "==", i + 1):
+                    cb(self.history[i], rhs_var)
+
+                    if not self.static_dt:
+                        cb(self.time_history[i], self.t)
+
+        substep_dt = var(name_gen("boot_substep_dt"))
+
+        with cb.if_(self.step, ">", 1):
+            cb(substep_dt, self.dt)
+
+        with cb.if_(self.step, "==", 1):
+            cb(substep_dt, self.boot_elapsed)
+
+            with cb.if_(self.boot_elapsed, "==", 0):
+                # Find 2^(-J) by bisection on J < 64.
+                dt_ratio = var(name_gen("boot_dt_ratio"))
+                cb(dt_ratio, (self.dt / self.bootstrap_time_scale)
+                        ** ((order - 1) / 2))
+                with cb.if_(dt_ratio, ">", 1):
+                    cb(dt_ratio, 1)
+
+                dt_fraction = var(name_gen("boot_dt_fraction"))
+                cb(dt_fraction, 1)
+                for log_factor in [32, 16, 8, 4, 2, 1]:
+                    with cb.if_(dt_fraction * 2**(-log_factor), ">", dt_ratio):
+                        cb(dt_fraction, dt_fraction * 2**(-log_factor))
+
+                cb(substep_dt, self.dt * dt_fraction / 2)
+
+                # Not yet used, but keeps the history well-defined.
+                for i in range(order - 1):
+                    cb(self.boot_history[i], rhs_var)
+                    cb(self.boot_time_history[i], self.t)
+
+        rhss = self.boot_history + [rhs_var]
+        times = self.boot_time_history + [self.t]
+
+        for substep_order in range(1, order + 1):
+            with cb.if_(self.boot_nhist, "==", substep_order - 1):
+                state_est = self.state + emit_adams_integration(
+                        cb, name_gen,
+                        AdamsMonomialIntegrationFunctionFamily(substep_order),
+                        [t - self.t for t in times[-substep_order:]],
+                        rhss[-substep_order:],
+                        0, substep_dt,
+                        closed_form=self.closed_form_coefficients)
+                if self.state_filter is not None:
+                    state_est = self.state_filter(state_est)
+                cb(self.state, state_est)
+
+        with cb.if_(self.boot_nhist, "<", order - 1):
+            cb(self.boot_nhist, self.boot_nhist + 1)
+
+        # Rotate the substep history.
+        for i in range(order - 1):
+            cb(self.boot_history[i], rhss[i + 1])
+            cb(self.boot_time_history[i], times[i + 1])
+
+        cb(self.t, self.t + substep_dt)
+        cb.yield_state(expression=self.state,
+                       component_id=self.component_id,
+                       time_id='', time=self.t)
+
+        with cb.if_(self.step, ">", 1):
+            cb(self.step, self.step + 1)
+
+        with cb.if_(self.step, "==", 1):
+            cb(self.boot_elapsed, self.boot_elapsed + substep_dt)
+            with cb.if_(self.boot_elapsed, ">=", self.dt):
+                cb(self.step, self.step + 1)
+
+# }}}
+
+
+# {{{ am method
+
+class AdamsMoultonMethodBuilder(TwoOrderAdaptiveMethodBuilderMixin,
+        AdamsBashforthMethodBuilder):
+    """Adams-Moulton methods in predictor-corrector form. Each step predicts
+    the new state with an Adams-Bashforth formula (P), evaluates the
+    right-hand side there (E), and corrects with the Adams-Moulton formula
+    of the same order, whose history includes the new right-hand side (C).
+    In PECE mode, the right-hand side is evaluated once more at the
+    corrected state (E). The right-hand side at the end of a step is kept
+    in the history, so that a step takes two (PECE) or one (PEC) right-hand
+    side evaluations.
+
+    The difference between the predicted and the corrected state yields
+    an estimate of the local truncation error of the corrector (Milne's
+    device), which is used to adapt the time step if *atol* or *rtol*
+    is given.
+
+    User-supplied context:
+        <state> + component_id: The value that is integrated
+        <func> + component_id: The right hand side
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    def __init__(self, component_id, function_family=None, state_filter_name=None,
+            hist_length=None, static_dt=False, order=None,
+            closed_form_coefficients=True, evaluate_corrected=True,
+            atol=0, rtol=0, max_dt_growth=None, min_dt_shrinkage=None):
+        """
+        :arg function_family: Accepts an instance of
+            :class:`AdamsIntegrationFunctionFamily`
+            or an integer, in which case the classical monomial function family
+            with the order given by the integer is used.
+        :arg hist_length: The number of right-hand side values used by the
+            predictor. The corrector always uses as many values as there are
+            functions in *function_family*.
+        :arg static_dt: If *True*, changing the timestep during time integration
+            is not allowed.
+        :arg evaluate_corrected: If *True* (PECE mode), the right-hand side is
+            evaluated at the corrected state to enter the history. If *False*
+            (PEC mode), the right-hand side at the predicted state is kept
+            instead, saving one evaluation per step.
+        """
+        AdamsBashforthMethodBuilder.__init__(
+                self, component_id,
+                function_family=function_family,
+                state_filter_name=state_filter_name,
+                hist_length=hist_length,
+                static_dt=static_dt,
+                order=order,
+                closed_form_coefficients=closed_form_coefficients)
+
+        TwoOrderAdaptiveMethodBuilderMixin.__init__(
+                self,
+                atol=atol,
+                rtol=rtol,
+                max_dt_growth=max_dt_growth,
+                min_dt_shrinkage=min_dt_shrinkage)
+
+        if self.adaptive:
+            if self.static_dt:
+                raise ValueError("adaptivity requires static_dt=False")
+            if not (isinstance(self.function_family,
+                        AdamsMonomialIntegrationFunctionFamily)
+                    and self.hist_length == len(self.function_family)):
+                raise ValueError("adaptivity requires the monomial function "
+                        "family and hist_length equal to the order")
+
+        self.evaluate_corrected = evaluate_corrected
+
+        order = len(self.function_family)
+        self.low_order = order
+        self.high_order = order + 1
+
+        # The history ends with the right-hand side at the current state.
+        self.history = [
+                var('<p>f_n_minus_' + str(i))
+                for i in range(self.hist_length - 1, -1, -1)]
+
+        if not self.static_dt:
+            self.time_history = [
+                    var('<p>t_n_minus_' + str(i))
+                    for i in range(self.hist_length - 1, -1, -1)]
+
+    def generate(self):
+        """
+        :returns: :class:`dagrt.language.DAGCode`
+        """
+        from pytools import UniqueNameGenerator
+        name_gen = UniqueNameGenerator()
+
+        from dagrt.language import DAGCode, CodeBuilder
+
+        # Initialization
+        with CodeBuilder(name="initialization") as cb_init:
+            cb_init(self.step, 1)
+            if self.hist_length == 1:
+                self.emit_current_rhs(cb_init)
+
+        # Primary
+        with CodeBuilder(name="primary") as cb_primary:
+            if not self.static_dt:
+                time_hist = [
+                        self.time_history[i] - self.t
+                        for i in range(self.hist_length)]
+                t_end = self.dt
+                dt_factor = 1
+
+            else:
+                time_hist = list(range(-self.hist_length+1, 0+1))  # noqa pylint:disable=invalid-unary-operand-type
+                dt_factor = self.dt
+                t_end = 1
+
+            # {{{ predict
+
+            state_pred = var("state_pred")
+            est = self.state + dt_factor * emit_adams_integration(
+                    cb_primary, name_gen,
+                    self.function_family,
+                    time_hist, self.history,
+                    0, t_end,
+                    closed_form=self.closed_form_coefficients)
+            if self.state_filter is not None:
+                est = self.state_filter(est)
+            cb_primary(state_pred, est)
+
+            rhs_pred = var("rhs_pred")
+            cb_primary(rhs_pred, self.eval_rhs(self.t + self.dt, state_pred))
+
+            # }}}
+
+            # {{{ correct
+
+            ncorrector = len(self.function_family)
+            corrector_time_hist = (
+                    time_hist[self.hist_length - ncorrector + 1:] + [t_end])
+
+            state_corr = var("state_corr")
+            est = self.state + dt_factor * emit_adams_integration(
+                    cb_primary, name_gen,
+                    self.function_family,
+                    corrector_time_hist,
+                    self.history[self.hist_length - ncorrector + 1:]
+                    + [rhs_pred],
+                    0, t_end,
+                    closed_form=self.closed_form_coefficients)
+            if self.state_filter is not None:
+                est = self.state_filter(est)
+            cb_primary(state_corr, est)
+
+            # }}}
+
+            if self.adaptive:
+                # Milne's device: the error constants of both formulas
+                # relate the local truncation error of the corrector to
+                # the difference between predictor and corrector.
+                pred_error_const = _emit_node_polynomial_integral(
+                        cb_primary, name_gen, time_hist, 0, t_end)
+                corr_error_const = _emit_node_polynomial_integral(
+                        cb_primary, name_gen, corrector_time_hist, 0, t_end)
+
+                error_est = var("milne_error_est")
+                cb_primary(error_est,
+                        corr_error_const / (pred_error_const - corr_error_const)
+                        * (state_corr - state_pred))
+
+                self.finish_adaptive(cb_primary,
+                        state_corr, state_corr - error_est)
             else:
-                stage = self.state + sum(self.dt * coeff * rhss[j]
-                                         for (j, coeff)
-                                         in enumerate(coeffs))
+                self.finish_nonadaptive(cb_primary, state_corr, state_pred)
+
+        if self.hist_length == 1:
+            # The first order method requires no bootstrapping.
+            return DAGCode(
+                phases={
+                    "initial": cb_init.as_execution_phase(next_phase="primary"),
+                    "primary": cb_primary.as_execution_phase(next_phase="primary")
+                    },
+                initial_phase="initial")
 
+        # Bootstrap
+        with CodeBuilder(name="bootstrap") as cb_bootstrap:
+            self.rk_bootstrap(cb_bootstrap)
+            cb_bootstrap(self.t, self.t + self.dt)
+            cb_bootstrap.yield_state(expression=self.state,
+                                     component_id=self.component_id,
+                                     time_id='', time=self.t)
+            cb_bootstrap(self.step, self.step + 1)
+            with cb_bootstrap.if_(self.step, "==", self.hist_length):
+                self.emit_current_rhs(cb_bootstrap)
+                cb_bootstrap.switch_phase("primary")
+
+        return DAGCode(
+                phases={
+                    "initialization": cb_init.as_execution_phase("bootstrap"),
+                    "bootstrap": cb_bootstrap.as_execution_phase("bootstrap"),
+                    "primary": cb_primary.as_execution_phase("primary"),
+                    },
+                initial_phase="initialization")
+
+    def emit_current_rhs(self, cb):
+        """Evaluate the right-hand side at the current state into the end of
+        the history."""
+        cb(self.history[-1], self.eval_rhs(self.t, self.state))
+        if not self.static_dt:
+            cb(self.time_history[-1], self.t)
+
+    def finish_nonadaptive(self, cb, high_order_estimate, low_order_estimate):
+        rhs_new = var("rhs_new")
+
+        cb(self.state, high_order_estimate)
+        if self.evaluate_corrected:
+            cb(rhs_new, self.eval_rhs(self.t + self.dt, self.state))
+        else:
+            cb(rhs_new, var("rhs_pred"))
+
+        # Rotate history and time history.
+        for i in range(self.hist_length - 1):
+            cb(self.history[i], self.history[i + 1])
+
+            if not self.static_dt:
+                cb(self.time_history[i], self.time_history[i + 1])
+
+        cb(self.history[-1], rhs_new)
+        if not self.static_dt:
+            cb(self.time_history[-1], self.t + self.dt)
+
+        cb(self.t, self.t + self.dt)
+        cb.yield_state(expression=self.state,
+                       component_id=self.component_id,
+                       time_id='', time=self.t)
+
+# }}}
+
+
+# {{{ variable-order ab method
+
+class VariableOrderAdamsBashforthMethodBuilder(
+        TwoOrderAdaptiveMethodBuilderMixin, MethodBuilder):
+    """Adams-Bashforth methods with adaptive step size and order, which
+    take one right-hand side evaluation per step.
+
+    With the current order *k*, the difference between the predictions
+    of order *k* and *k* + 1 estimates the local error of the order *k*
+    solution, which is kept. The time step is chosen from this estimate by
+    :class:`leap.TwoOrderAdaptiveMethodBuilderMixin`. After an accepted
+    step, the estimates of orders *k* - 1 and *k* + 1, obtained from the
+    predictions of orders *k* - 1 and *k* + 2, are compared with that of
+    order *k*. The order for the next step is the one that would permit
+    the largest step, as in LSODE.
+
+    The method starts at order 1 and raises the order as history values
+    become available, so that it requires no bootstrap phase. The first
+    step is a forward Euler step of the initial time step, which is taken
+    without error control.
+
+    User-supplied context:
+        <state> + component_id: The value that is integrated
+        <func> + component_id: The right hand side
+
+    .. attribute:: order_change_bias
+
+        The factor by which the step permitted by another order must exceed
+        that of the current order for the order to change.
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    order_change_bias = 1.2
+
+    def __init__(self, component_id, max_order=5, state_filter_name=None,
+            atol=0, rtol=0, max_dt_growth=None, min_dt_shrinkage=None):
+        """
+        :arg max_order: The largest order that is used.
+        """
+        super(VariableOrderAdamsBashforthMethodBuilder, self).__init__(
+                atol=atol,
+                rtol=rtol,
+                max_dt_growth=max_dt_growth,
+                min_dt_shrinkage=min_dt_shrinkage)
+
+        if not self.adaptive:
+            raise ValueError("must specify atol or rtol")
+
+        self.component_id = component_id
+        self.max_order = max_order
+
+        # Declare variables
+        self.order = var('<p>vsvo_order')
+        self.hist_count = var('<p>vsvo_hist_count')
+        self.function = var('<func>' + component_id)
+
+        self.history = [
+                var('<p>f_n_minus_' + str(i))
+                for i in range(max_order, 0, -1)]
+        self.time_history = [
+                var('<p>t_n_minus_' + str(i))
+                for i in range(max_order, 0, -1)]
+
+        self.state = var('<state>' + component_id)
+        self.t = var('<t>')
+        self.dt = var('<dt>')
+
+        # predictions of the orders k-1, k, k+1 and k+2
+        self.estimates = dict(
+                (offset, var("vsvo_est_%s" % name))
+                for offset, name in [
+                    (-1, "km1"), (0, "k"), (1, "kp1"), (2, "kp2")])
+
+        # The order may change in the course of the step.
+        self.step_order = var('vsvo_step_order')
+        self.low_order = self.step_order
+        self.high_order = self.step_order + 1
+
+        if state_filter_name is not None:
+            self.state_filter = var("<func>" + state_filter_name)
+        else:
+            self.state_filter = None
+
+    def generate(self):
+        """
+        :returns: :class:`dagrt.language.DAGCode`
+        """
+        from pytools import UniqueNameGenerator
+        name_gen = UniqueNameGenerator()
+
+        from dagrt.language import DAGCode, CodeBuilder
+
+        rhs_var = var("rhs_var")
+        nvalid = var("vsvo_nvalid")
+
+        # Initialization
+        with CodeBuilder(name="initialization") as cb_init:
+            cb_init(self.order, 1)
+            cb_init(self.hist_count, 0)
+
+        # Primary
+        with CodeBuilder(name="primary") as cb:
+            cb(self.step_order, self.order)
+            cb(rhs_var, self.eval_rhs(self.t, self.state))
+
+            with cb.if_(self.hist_count, "==", 0):
+                # Only the values whose history is valid are used. These
+                # assignments make the history rotation well-defined.
+                for i in range(self.max_order):
+                    cb(self.history[i], rhs_var)
+                    cb(self.time_history[i], self.t)
+
+            cb(nvalid, self.hist_count + 1)
+
+            history = self.history + [rhs_var]
+            time_hist = [t - self.t for t in self.time_history] + [0]
+
+            def emit_estimate(estimate, order):
+                est = self.state + emit_adams_integration(
+                        cb, name_gen,
+                        AdamsMonomialIntegrationFunctionFamily(order),
+                        time_hist[-order:], history[-order:],
+                        0, self.dt)
                 if self.state_filter is not None:
-                    stage = self.state_filter(stage)
+                    est = self.state_filter(est)
+                cb(estimate, est)
+
+            for order in range(1, self.max_order + 1):
+                with cb.if_(self.step_order, "==", order):
+                    if order > 1:
+                        emit_estimate(self.estimates[-1], order - 1)
+
+                    emit_estimate(self.estimates[0], order)
+
+                    with cb.if_(nvalid, ">=", order + 1):
+                        emit_estimate(self.estimates[1], order + 1)
+
+                    if order < self.max_order:
+                        with cb.if_(nvalid, ">=", order + 2):
+                            emit_estimate(self.estimates[2], order + 2)
+
+            with cb.if_(nvalid, "==", 1):
+                self.finish_nonadaptive(cb,
+                        self.estimates[0], self.estimates[0])
+            with cb.else_():
+                self.finish_adaptive(cb,
+                        self.estimates[1], self.estimates[0])
+
+        return DAGCode(
+                phases={
+                    "initialization": cb_init.as_execution_phase("primary"),
+                    "primary": cb.as_execution_phase("primary"),
+                    },
+                initial_phase="initialization")
+
+    def eval_rhs(self, t, y):
+        """Return a node that evaluates the RHS at the given time and
+        component value."""
+        from pymbolic.primitives import CallWithKwargs
+        return CallWithKwargs(function=self.function,
+                              parameters=(),
+                              kw_parameters={"t": t, self.component_id: y})
+
+    def emit_order_selection(self, cb):
+        from pymbolic.primitives import Max
+
+        nvalid = var("vsvo_nvalid")
+        new_order = var("vsvo_new_order")
+        best_ratio = var("vsvo_best_ratio")
+
+        scale = var("vsvo_error_scale")
+        cb(scale, var("<builtin>len")(self.state) ** 0.5 * (
+            self.atol + self.rtol * var("<builtin>norm_2")(self.state)))
+
+        def step_ratio(offset, order):
+            # the step size ratio permitted by the error estimate of *order*
+            error = var("<builtin>norm_2")(
+                    self.estimates[offset + 1] - self.estimates[offset]) / scale
+            return Max((error, 1e-14)) ** (-1 / (order + 1))
+
+        cb(new_order, self.step_order)
+
+        for order in range(1, self.max_order + 1):
+            with cb.if_(self.step_order, "==", order):
+                cb(best_ratio, self.order_change_bias * step_ratio(0, order))
+
+                if order > 1:
+                    ratio = cb.fresh_var("vsvo_ratio_lower")
+                    cb(ratio, step_ratio(-1, order - 1))
+                    with cb.if_(ratio, ">", best_ratio):
+                        cb(new_order, order - 1)
+                        cb(best_ratio, ratio)
+
+                if order < self.max_order:
+                    with cb.if_(nvalid, ">=", order + 2):
+                        ratio = cb.fresh_var("vsvo_ratio_higher")
+                        cb(ratio, step_ratio(1, order + 1))
+                        with cb.if_(ratio, ">", best_ratio):
+                            cb(new_order, order + 1)
+
+        cb(self.order, new_order)
+
+    def finish_nonadaptive(self, cb, high_order_estimate, low_order_estimate):
+        from pymbolic.primitives import Min
+
+        cb(self.state, low_order_estimate)
+
+        if self.adaptive:
+            with cb.if_(var("vsvo_nvalid"), ">=", 2):
+                self.emit_order_selection(cb)
+
+        # Rotate history and time history.
+        history = self.history + [var("rhs_var")]
+        time_history = self.time_history + [self.t]
+        for i in range(self.max_order):
+            cb(self.history[i], history[i + 1])
+            cb(self.time_history[i], time_history[i + 1])
+
+        cb(self.hist_count, Min((self.hist_count + 1, self.max_order)))
+
+        cb(self.t, self.t + self.dt)
+        cb.yield_state(expression=self.state,
+                       component_id=self.component_id,
+                       time_id='', time=self.t)
+
+# }}}
 
-                cb(rhss[stage_num], self.eval_rhs(self.t + c * self.dt, stage))
 
-        # Merge the values of the RHSs.
-        rk_comb = sum(coeff * rhss[j] for j, coeff in enumerate(rk_coeffs))
+# {{{ nordsieck ab method
+
+class NordsieckAdamsBashforthMethodBuilder(MethodBuilder):
+    """Adams-Bashforth methods in Nordsieck form. Instead of a history of
+    right-hand side values, the method stores the scaled derivatives
+
+    .. math::
+
+        z_k = \\frac{h^k}{k!} y^{(k)}(t_n), \\qquad k = 1, \\dots, p,
+
+    of the polynomial that interpolates the last *p* right-hand side
+    values. A step evaluates the Taylor expansion of this polynomial at
+    :math:`t_{n+1}`, which gives the Adams-Bashforth solution, and then
+    corrects the derivatives to interpolate the new right-hand side value.
+    For a constant time step, the method is equivalent to
+    :class:`AdamsBashforthMethodBuilder`.
+
+    If the time step changes, the derivatives are rescaled by powers of the
+    ratio of the step sizes, instead of recomputing the coefficients from
+    the time history. The correction then assumes equidistant history, as
+    in LSODE.
+
+    The method is bootstrapped like :class:`AdamsBashforthMethodBuilder`.
+    The time step must stay constant during the bootstrap.
+
+    User-supplied context:
+        <state> + component_id: The value that is integrated
+        <func> + component_id: The right hand side
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    def __init__(self, component_id, order, state_filter_name=None,
+            static_dt=False, bootstrap_substeps=1):
+        """
+        :arg static_dt: If *True*, changing the timestep during time integration
+            is not allowed, and the rescaling is omitted.
+        :arg bootstrap_substeps: The number of equal substeps taken in each
+            Runge-Kutta bootstrap step.
+        """
+        super(NordsieckAdamsBashforthMethodBuilder, self).__init__()
+
+        self.order = order
+        self.static_dt = static_dt
+        self.bootstrap_substeps = bootstrap_substeps
+        self.component_id = component_id
+
+        # Declare variables
+        self.step = var('<p>step')
+        self.function = var('<func>' + component_id)
+
+        # right-hand side values gathered during the bootstrap
+        self.history = [
+                var('<p>f_n_minus_' + str(i))
+                for i in range(order - 1, 0, -1)]
+
+        self.nordsieck = [
+                var('<p>nordsieck_' + str(k))
+                for k in range(1, order + 1)]
+        self.nordsieck_dt = var('<p>nordsieck_dt')
+
+        self.state = var('<state>' + component_id)
+        self.t = var('<t>')
+        self.dt = var('<dt>')
+
+        if state_filter_name is not None:
+            self.state_filter = var("<func>" + state_filter_name)
+        else:
+            self.state_filter = None
+
+    def initialization_matrix(self):
+        """Return the matrix that maps the right-hand side values at
+        :math:`t_n - jh`, oldest first, to the Nordsieck vector divided by
+        *h*.
+        """
+        nodes = np.arange(-self.order + 1, 0 + 1)
+        vdm = np.array([nodes**k for k in range(self.order)]).T
+
+        # monomial coefficients of the interpolant in units of h
+        coeffs = la.inv(vdm)
+        return coeffs / np.arange(1, self.order + 1)[:, np.newaxis]
+
+    def correction_vector(self):
+        """Return the multiples of the difference between the new scaled
+        right-hand side and its prediction that are added to the Nordsieck
+        vector.
+        """
+        # The correction of the right-hand side interpolant is 1 at the new
+        # point and 0 at the other points it keeps.
+        from numpy.polynomial import Polynomial
+        correction = Polynomial([1])
+        for j in range(1, self.order):
+            correction = correction * Polynomial([1, 1/j])
+
+        coeffs = np.zeros(self.order)
+        coeffs[:len(correction.coef)] = correction.coef
+        return coeffs / np.arange(1, self.order + 1)
+
+    def generate(self):
+        """
+        :returns: :class:`dagrt.language.DAGCode`
+        """
+        from dagrt.language import DAGCode, CodeBuilder
+        from math import factorial
+
+        def binomial(n, k):
+            return factorial(n) // (factorial(k) * factorial(n - k))
+
+        rhs_var = var("rhs_var")
+
+        # Initialization
+        with CodeBuilder(name="initialization") as cb_init:
+            cb_init(self.step, 1)
+
+        # Primary
+        with CodeBuilder(name="primary") as cb_primary:
+            nordsieck = self.nordsieck
+
+            if not self.static_dt:
+                ratio = var("nordsieck_dt_ratio")
+                cb_primary(ratio, self.dt / self.nordsieck_dt)
+                nordsieck = [
+                        ratio**(k + 1) * z for k, z in enumerate(nordsieck)]
+                cb_primary(self.nordsieck_dt, self.dt)
+
+            # Multiply by the Pascal matrix.
+            state_est = self.state + sum(nordsieck)
+            if self.state_filter is not None:
+                state_est = self.state_filter(state_est)
+
+            predicted = [
+                    var("nordsieck_pred_" + str(k))
+                    for k in range(1, self.order + 1)]
+            for k in range(1, self.order + 1):
+                cb_primary(predicted[k - 1], sum(
+                    binomial(m, k) * nordsieck[m - 1]
+                    for m in range(k, self.order + 1)))
+
+            cb_primary(self.state, state_est)
+            cb_primary(rhs_var, self.eval_rhs(self.t + self.dt, self.state))
+
+            correction = var("nordsieck_correction")
+            cb_primary(correction, self.dt * rhs_var - predicted[0])
+
+            for k, l_k in enumerate(self.correction_vector()):
+                cb_primary(self.nordsieck[k], predicted[k] + l_k * correction)
+
+            cb_primary(self.t, self.t + self.dt)
+            cb_primary.yield_state(expression=self.state,
+                                   component_id=self.component_id,
+                                   time_id='', time=self.t)
+
+        # Bootstrap
+        with CodeBuilder(name="bootstrap") as cb_bootstrap:
+            if self.order > 1:
+                self.rk_bootstrap(cb_bootstrap)
+                cb_bootstrap(self.t, self.t + self.dt)
+                cb_bootstrap.yield_state(expression=self.state,
+                                         component_id=self.component_id,
+                                         time_id='', time=self.t)
+                cb_bootstrap(self.step, self.step + 1)
+
+            with cb_bootstrap.if_(self.step, "==", self.order):
+                cb_bootstrap(rhs_var, self.eval_rhs(self.t, self.state))
+
+                history = self.history + [rhs_var]
+                for k, row in enumerate(self.initialization_matrix()):
+                    cb_bootstrap(self.nordsieck[k],
+                            self.dt * _linear_comb(row, history))
+
+                if not self.static_dt:
+                    cb_bootstrap(self.nordsieck_dt, self.dt)
+
+                cb_bootstrap.switch_phase("primary")
+
+        return DAGCode(
+                phases={
+                    "initialization": cb_init.as_execution_phase("bootstrap"),
+                    "bootstrap": cb_bootstrap.as_execution_phase("bootstrap"),
+                    "primary": cb_primary.as_execution_phase("primary"),
+                    },
+                initial_phase="initialization")
+
+    def eval_rhs(self, t, y):
+        """Return a node that evaluates the RHS at the given time and
+        component value."""
+        from pymbolic.primitives import CallWithKwargs
+        return CallWithKwargs(function=self.function,
+                              parameters=(),
+                              kw_parameters={"t": t, self.component_id: y})
+
+    def rk_bootstrap(self, cb):
+        """Initialize the timestepper with an RK method."""
+
+        rhs_var = var("rhs_var")
+
+        cb(rhs_var, self.eval_rhs(self.t, self.state))
+
+        # Save the current RHS to the history
+        for i in range(self.order - 1):
+            with cb.if_(self.step, "==", i + 1):
+                cb(self.history[i], rhs_var)
+
+        substep_dt = self.dt / self.bootstrap_substeps
 
-        state_est = self.state + self.dt * rk_comb
-        if self.state_filter is not None:
-            state_est = self.state_filter(state_est)
+        for isubstep in range(self.bootstrap_substeps):
+            if isubstep > 0:
+                cb(rhs_var, self.eval_rhs(
+                    self.t + isubstep * substep_dt, self.state))
 
-        # Assign the value of the new state.
-        cb(self.state, state_est)
+            _emit_rk_step(cb, self.order, self.state,
+                    self.t + isubstep * substep_dt, substep_dt,
+                    self.eval_rhs, rhs_var,
+                    state_filter=self.state_filter)
 
 # }}}
 
@@ -0,0 +1,356 @@
+"""Backward differentiation formulas."""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from pymbolic import var
+
+from leap import MethodBuilder
+from leap.multistep import (
+        AdamsMonomialIntegrationFunctionFamily,
+        emit_adams_extrapolation,
+        _emit_func_family_coefficients,
+        _linear_comb)
+
+
+__doc__ = """
+.. autoclass:: BDFMethodBuilder
+.. autoclass:: NDFMethodBuilder
+"""
+
+
+# {{{ bdf method
+
+class BDFMethodBuilder(MethodBuilder):
+    """Backward differentiation formulas of orders 1 to 5. The step
+
+    .. math::
+
+        y_{n+1} = \\sum_{j=1}^k a_j y_{n+1-j} + \\beta h f(t_{n+1}, y_{n+1})
+
+    requires one implicit solve, which is emitted as an
+    :class:`dagrt.language.AssignImplicit` statement with solver id
+    ``"solve"`` and lowered by :func:`leap.implicit.replace_AssignImplicit`.
+    The unknown is the new state, see :meth:`implicit_expression`. The
+    solver receives the extrapolation of the state history to
+    :math:`t_{n+1}` as its initial guess.
+
+    If the time step changes, the method is used in fixed leading
+    coefficient form: the interpolating polynomial of the last *k* + 1
+    states is evaluated at the equispaced points :math:`t_{n+1} - jh`, to
+    which the constant coefficients above are applied. The same polynomial
+    yields the initial guess.
+
+    The history is started with the L-stable, stiffly accurate ESDIRK
+    method of fourth order that forms the implicit part of the
+    ARK4(3)6L[2]SA method of Kennedy and Carpenter, see
+    :class:`leap.rk.imex.KennedyCarpenterIMEXRungeKuttaMethodBuilderBase`.
+    Its stages are solved by the same ``"solve"`` hook, so the first *k*
+    steps need not resolve the fastest time scale of the problem either.
+    Since only *k* steps are taken with it, its local error does not limit
+    the order of the method.
+
+    User-supplied context:
+        <state> + component_id: The value that is integrated
+        <func> + component_id: The right hand side
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    .. automethod:: implicit_expression
+    """
+
+    # (a_1, ..., a_k), beta
+    coefficients = {
+            1: ([1], 1),
+            2: ([4/3, -1/3], 2/3),
+            3: ([18/11, -9/11, 2/11], 6/11),
+            4: ([48/25, -36/25, 16/25, -3/25], 12/25),
+            5: ([300/137, -300/137, 200/137, -75/137, 12/137], 60/137),
+            }
+
+    def __init__(self, component_id, order, state_filter_name=None,
+            static_dt=False):
+        """
+        :arg order: An integer between 1 and 5.
+        :arg static_dt: If *True*, changing the timestep during time integration
+            is not allowed.
+        """
+        if order not in self.coefficients:
+            raise ValueError("unsupported order: %d" % order)
+
+        super(BDFMethodBuilder, self).__init__()
+
+        self.order = order
+        self.static_dt = static_dt
+        self.component_id = component_id
+
+        # Keeping one state beyond the order makes the interpolation
+        # and the initial guess accurate to the order of the method.
+        self.hist_length = order + 1
+        self.function_family = AdamsMonomialIntegrationFunctionFamily(
+                self.hist_length)
+
+        # Declare variables
+        self.step = var('<p>step')
+        self.function = var('<func>' + component_id)
+
+        self.history = [
+                var('<p>y_n_minus_' + str(i))
+                for i in range(self.hist_length - 1, 0, -1)]
+
+        if not self.static_dt:
+            self.time_history = [
+                    var('<p>t_n_minus_' + str(i))
+                    for i in range(self.hist_length - 1, 0, -1)]
+
+        self.state = var('<state>' + component_id)
+        self.t = var('<t>')
+        self.dt = var('<dt>')
+
+        if state_filter_name is not None:
+            self.state_filter = var("<func>" + state_filter_name)
+        else:
+            self.state_filter = None
+
+    def implicit_expression(self, expression_tag=None):
+        """The implicit solve sets *unk* to zero in
+
+        .. code::
+
+            unk - sub_y - coeff*<func>rhs(t=t, <component_id>=unk)
+
+        where the right-hand side function symbol matches any function.
+        """
+        from dagrt.expression import parse
+        return (parse("unk - sub_y - coeff*<func>rhs(t=t, {comp}=unk)"
+                .format(comp=self.component_id)),
+                ("unk", "sub_y", "coeff", "t", "<func>rhs"))
+
+    def generate(self):
+        """
+        :returns: :class:`dagrt.language.DAGCode`
+        """
+        from pytools import UniqueNameGenerator
+        name_gen = UniqueNameGenerator()
+
+        from dagrt.language import DAGCode, CodeBuilder
+
+        # Initialization
+        with CodeBuilder(name="initialization") as cb_init:
+            cb_init(self.step, 1)
+
+        # Primary
+        with CodeBuilder(name="primary") as cb_primary:
+            history = self.history + [self.state]
+
+            if not self.static_dt:
+                time_history_data = self.time_history + [self.t]
+                time_hist = [
+                        time_history_data[i] - self.t
+                        for i in range(self.hist_length)]
+                t_end = self.dt
+
+            else:
+                time_hist = list(range(-self.hist_length+1, 0+1))  # noqa pylint:disable=invalid-unary-operand-type
+                t_end = 1
+
+            state_pred = var("bdf_state_pred")
+            cb_primary(state_pred, emit_adams_extrapolation(
+                cb_primary, name_gen,
+                self.function_family,
+                time_hist, history,
+                t_end))
+
+            a_coeffs, beta = self.coefficients[self.order]
+
+            # Apply the formula to the interpolant at t_{n+1} - j*h.
+            coeffs = _emit_func_family_coefficients(
+                    cb_primary, name_gen,
+                    self.function_family, time_hist, self.hist_length,
+                    lambda i: sum(
+                        a_j * self.function_family.evaluate(
+                            i, t_end - (j + 1) * t_end)
+                        for j, a_j in enumerate(a_coeffs)))
+
+            sub_y = var("bdf_sub_y")
+            coeff = var("bdf_coeff")
+            self.emit_formula(cb_primary,
+                    sub_y, _linear_comb(coeffs, history), coeff, beta,
+                    state_pred)
+
+            state_new = var("bdf_state_new")
+            cb_primary.assign_implicit_1(
+                    state_new, state_new,
+                    state_new - sub_y - coeff * self.eval_rhs(
+                        self.t + self.dt, state_new),
+                    guess=state_pred,
+                    solver_id="solve")
+
+            if self.state_filter is not None:
+                cb_primary(state_new, self.state_filter(state_new))
+
+            # Rotate history and time history.
+            for i in range(self.hist_length - 1):
+                cb_primary(self.history[i], history[i + 1])
+
+                if not self.static_dt:
+                    cb_primary(self.time_history[i], time_history_data[i + 1])
+
+            cb_primary(self.state, state_new)
+            cb_primary(self.t, self.t + self.dt)
+            cb_primary.yield_state(expression=self.state,
+                                   component_id=self.component_id,
+                                   time_id='', time=self.t)
+
+        # Bootstrap
+        with CodeBuilder(name="bootstrap") as cb_bootstrap:
+            self.rk_bootstrap(cb_bootstrap)
+            cb_bootstrap(self.t, self.t + self.dt)
+            cb_bootstrap.yield_state(expression=self.state,
+                                     component_id=self.component_id,
+                                     time_id='', time=self.t)
+            cb_bootstrap(self.step, self.step + 1)
+            with cb_bootstrap.if_(self.step, "==", self.hist_length):
+                cb_bootstrap.switch_phase("primary")
+
+        return DAGCode(
+                phases={
+                    "initialization": cb_init.as_execution_phase("bootstrap"),
+                    "bootstrap": cb_bootstrap.as_execution_phase("bootstrap"),
+                    "primary": cb_primary.as_execution_phase("primary"),
+                    },
+                initial_phase="initialization")
+
+    def emit_formula(self, cb, sub_y, history_sum, coeff, beta, state_pred):
+        """Emit the explicit part *sub_y* and the factor *coeff* of the
+        right-hand side in the implicit equation, given the combination
+        *history_sum* of the history and the predicted state *state_pred*.
+        """
+        cb(sub_y, history_sum)
+        cb(coeff, beta * self.dt)
+
+    def eval_rhs(self, t, y):
+        """Return a node that evaluates the RHS at the given time and
+        component value."""
+        from pymbolic.primitives import CallWithKwargs
+        return CallWithKwargs(function=self.function,
+                              parameters=(),
+                              kw_parameters={"t": t, self.component_id: y})
+
+    def rk_bootstrap(self, cb):
+        """Initialize the timestepper with an implicit RK method."""
+
+        # Save the current state to the history
+        for i in range(self.hist_length - 1):
+            with cb.if_(self.step, "==", i + 1):
+                cb(self.history[i], self.state)
+
+                if not self.static_dt:
+                    cb(self.time_history[i], self.t)
+
+        from leap.rk.imex import KennedyCarpenterIMEXARK4MethodBuilder
+        rk_method = KennedyCarpenterIMEXARK4MethodBuilder
+        gamma = rk_method.gamma
+
+        # The first stage is explicit.
+        rhss = [var("rk_rhs_" + str(i)) for i in range(len(rk_method.c))]
+        cb(rhss[0], self.eval_rhs(self.t, self.state))
+
+        stage = self.state
+        for stage_num in range(1, len(rk_method.c)):
+            coeffs = rk_method.a_implicit[stage_num]
+            assert coeffs[-1] == gamma
+
+            sub_y = var("rk_sub_y_" + str(stage_num))
+            coeff = var("rk_coeff_" + str(stage_num))
+            cb(sub_y, self.state + sum(
+                self.dt * a_j * rhss[j]
+                for j, a_j in enumerate(coeffs[:-1])
+                if a_j))
+            cb(coeff, gamma * self.dt)
+
+            prev_stage = stage
+            stage = var("rk_stage_" + str(stage_num))
+            cb.assign_implicit_1(
+                    stage, stage,
+                    stage - sub_y - coeff * self.eval_rhs(
+                        self.t + rk_method.c[stage_num] * self.dt, stage),
+                    guess=prev_stage,
+                    solver_id="solve")
+
+            # Recover the RHS from the stage equation instead of
+            # evaluating it, which would amplify the solver error by the
+            # stiffness of the problem.
+            cb(rhss[stage_num], (stage - sub_y) / coeff)
+
+        # The method is stiffly accurate: the last stage is the new state.
+        if self.state_filter is not None:
+            stage = self.state_filter(stage)
+
+        cb(self.state, stage)
+
+# }}}
+
+
+# {{{ ndf method
+
+class NDFMethodBuilder(BDFMethodBuilder):
+    """The numerical differentiation formulas of Klopfenstein and Shampine,
+    which modify the backward differentiation formula of the same order by
+    a multiple :math:`\\kappa` of the difference between the new state and
+    the extrapolated state :math:`y^{(0)}_{n+1}`:
+
+    .. math::
+
+        (1 - \\kappa) y_{n+1} = \\sum_{j=1}^k a_j y_{n+1-j}
+        - \\kappa y^{(0)}_{n+1} + \\beta h f(t_{n+1}, y_{n+1}).
+
+    At orders 1 to 4, this reduces the error constant at the expense of
+    a slightly smaller stability angle. At order 5, the method coincides
+    with :class:`BDFMethodBuilder`.
+
+    See L. F. Shampine, M. W. Reichelt, The MATLAB ODE suite, SIAM J. Sci.
+    Comput. 18 (1997).
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    kappa = {
+            1: -0.1850,
+            2: -1/9,
+            3: -0.0823,
+            4: -0.0415,
+            5: 0,
+            }
+
+    def emit_formula(self, cb, sub_y, history_sum, coeff, beta, state_pred):
+        kappa = self.kappa[self.order]
+
+        cb(sub_y, (history_sum - kappa * state_pred) / (1 - kappa))
+        cb(coeff, beta * self.dt / (1 - kappa))
+
+# }}}
+
+# vim: fdm=marker
@@ -114,44 +114,91 @@ class RHS(MultiRateHistory):
 # {{{ topological sort of rhss
 
 def _topologically_sort_comp_names_and_rhss(component_names, rhss):
-    # This routine is O(n^2) in a few spots, assuming the input is small.
-    # Acceleration to amortized O(n) using sets/dicts should be easy if needed.
-
-    result_component_names = []
+    comp_name_to_rhss = dict(zip(component_names, rhss))
 
     deps = dict(
             (cname,
-                frozenset(dep_cname
+                [dep_cname
                     for mrh in rhs
                     for dep_cname in mrh.arguments
-                    if mrh in component_names))
+                    if dep_cname in comp_name_to_rhss])
             for cname, rhs in zip(component_names, rhss))
 
+    result_component_names = []
+
+    # depth-first search, with components on the current path marked as
+    # "visiting"
+    visiting = object()
+    done = object()
+    marks = {}
+
     def add(cname):
-        if cname in result_component_names:
+        mark = marks.get(cname)
+        if mark is done:
             return
 
-        for dep in deps[cname]:
-            add(dep)
-
-        if cname in result_component_names:
+        if mark is visiting:
             raise ValueError("Component '%s' (directly or indirectly) "
                     "depends on itself "
                     "in system description. This is not allowed."
                     % cname)
 
+        marks[cname] = visiting
+
+        for dep in deps[cname]:
+            add(dep)
+
+        marks[cname] = done
         result_component_names.append(cname)
 
     for cname in component_names:
         add(cname)
 
     return result_component_names, [
-            rhss[component_names.index(cname)] for cname in result_component_names]
+            comp_name_to_rhss[cname] for cname in result_component_names]
+
+# }}}
+
+
+# {{{ computed state bookkeeping
+
+class _ComputedStates(object):
+    """The states of a component that were computed during a step, indexed
+    by the substep they belong to. States are added in order of increasing
+    substep.
+    """
+
+    def __init__(self, isubstep, state_var):
+        self.substeps = [isubstep]
+        self.substep_to_state = {isubstep: state_var}
+
+    def get(self, isubstep):
+        return self.substep_to_state.get(isubstep)
+
+    def latest(self):
+        isubstep = self.substeps[-1]
+        return isubstep, self.substep_to_state[isubstep]
+
+    def append(self, isubstep, state_var):
+        assert isubstep > self.substeps[-1]
+
+        self.substeps.append(isubstep)
+        self.substep_to_state[isubstep] = state_var
+
+    def remove_from(self, isubstep):
+        """Forget the states at *isubstep* and later."""
+        from bisect import bisect_left
+        istart = bisect_left(self.substeps, isubstep)
+
+        for removed_substep in self.substeps[istart:]:
+            del self.substep_to_state[removed_substep]
+
+        del self.substeps[istart:]
 
 # }}}
 
 
-class InconsistentHistoryError:
+class InconsistentHistoryError(Exception):
     pass
 
 
@@ -177,7 +224,14 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
             component_arg_names=None,
             static_dt=False,
             hist_consistency_threshold=None,
-            early_hist_consistency_threshold=None):
+            early_hist_consistency_threshold=None,
+            ring_buffer_history=False,
+            exact_coefficients=False,
+            rolled_substeps=False,
+            hist_consistency_check="rhs",
+            hist_consistency_interval=1,
+            atol=0, rtol=0, max_dt_growth=None, min_dt_shrinkage=None,
+            multirate_bootstrap=False, parallel_rhs_calls=False):
 
         """
         :arg default_order: The order to be used for right-hand sides
@@ -222,6 +276,84 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
             hand sides in *rhss*.
         :arg static_dt: If *True*, changing the timestep in between steps
             during time integration is not allowed.
+        :arg ring_buffer_history: If *True*, the history of each right-hand
+            side is kept in a ring buffer with a rotating head index, so that
+            committing the history at the end of a step only writes the new
+            values instead of shifting all of them.
+        :arg exact_coefficients: If *True* and *static_dt* is *True*, the
+            integration coefficients are computed in rational arithmetic and
+            rounded once, instead of by a floating point linear solve.
+        :arg rolled_substeps: If *True*, the primary phase carries out a
+            single substep and is repeated until the step is complete,
+            instead of containing all substeps of a step, and likewise for
+            the bootstrap phase. The history is then shifted as it is
+            updated, so that the size of the generated code does not depend
+            on the step ratio. Only ODE components whose right-hand sides
+            use :attr:`rhs_policy.late` are supported.
+
+            Each execution of a phase is a step of the time integrator, so
+            that there are as many :class:`dagrt.exec_numpy.StepCompleted`
+            events, and as many steps counted towards the *max_steps* of
+            :meth:`dagrt.exec_numpy.NumpyInterpreter.run`, per step of size
+            *<dt>* as there are substeps. In the primary phase, the states
+            are only yielded, and *<t>* is only advanced, at the end of the
+            step of size *<dt>*. The integration coefficients are computed
+            from the time history at run time on every substep, even with
+            *static_dt*, so that *exact_coefficients* has no effect.
+        :arg hist_consistency_check: How the history is checked against the
+            state at the start of a step, if *hist_consistency_threshold* is
+            given. One of
+
+            - ``"rhs"``: Each right-hand side is evaluated and compared with
+              the top of its history.
+            - ``"checksum"``: The norms of each ODE component and of the
+              component shifted by one (which adds the sum of its entries to
+              the fingerprint) are compared with the values stored when the
+              history was last updated. This detects changes to the state in
+              between steps without evaluating the right-hand sides, except
+              for changes that preserve both the norm and the sum of the
+              entries, such as permutations. Right-hand sides with
+              :attr:`rhs_policy.early` are still checked by evaluation, since
+              their history is computed from extrapolated state.
+            - *None*: The check is not generated, regardless of the
+              thresholds.
+        :arg hist_consistency_interval: Check the history at the start of
+            every *hist_consistency_interval*-th step only.
+        :arg atol: Absolute tolerance for the local error. If *atol* or
+            *rtol* is given, the step size is chosen adaptively, see below.
+        :arg rtol: Relative tolerance for the local error.
+        :arg max_dt_growth: The largest factor by which the step size
+            may grow from one step to the next, 5 by default.
+        :arg min_dt_shrinkage: The smallest factor by which a rejected
+            step size is shrunk, 0.1 by default.
+
+        In adaptive mode, the local error of each ODE component is
+        estimated from the difference between its state at the end of
+        the step and the state obtained by integrating its last
+        (sub)step with Adams methods of one order less. The step is
+        rejected if any component exceeds the tolerances, and the next
+        step size is the largest one permitted by all components. The
+        ratios of the substep intervals are fixed by *system_description*,
+        since the substeps are laid out in the generated code. The history
+        is kept at variable times, so *static_dt* must be *False* and
+        *rolled_substeps* is not supported. The bootstrap takes steps of
+        the initial size without error control.
+
+        :arg multirate_bootstrap: If *True*, the right-hand sides of ODE
+            components with the largest interval are evaluated only at the
+            starts of the first *k* substeps of each RK bootstrap step,
+            where *k* is the largest order, and at the stages of the first
+            *k* - 1 substeps. At the stages of the remaining substeps, they
+            are extrapolated by the polynomial through their values at the
+            *k* substep starts. Since the step ratio is fixed, this retains
+            the order of the method. The other right-hand sides are
+            evaluated as without this option. The bootstrap takes a single
+            pass, and the option has no effect unless the step ratio is at
+            least *k*.
+        :arg parallel_rhs_calls: If *True*, the right-hand side evaluations
+            that may be carried out concurrently are marked by
+            :func:`leap.transform.annotate_parallel_calls`, for use with
+            :class:`leap.parallel.ThreadedNumpyInterpreter`.
         """
         super(MultiRateMultiStepMethodBuilder, self).__init__()
 
@@ -381,24 +513,88 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                     early_hist_consistency_threshold)
         self.early_hist_consistency_threshold = early_hist_consistency_threshold
 
-        if not self.static_dt:
+        if hist_consistency_check not in ["rhs", "checksum", None]:
+            raise ValueError("unknown hist_consistency_check: '%s'"
+                    % hist_consistency_check)
+        if hist_consistency_interval < 1:
+            raise ValueError("hist_consistency_interval must be positive")
+
+        self.hist_consistency_check = hist_consistency_check
+        self.hist_consistency_interval = hist_consistency_interval
+
+        self.adaptive = bool(atol or rtol)
+        self.atol = atol
+        self.rtol = rtol
+
+        if max_dt_growth is None:
+            max_dt_growth = 5
+
+        if min_dt_shrinkage is None:
+            min_dt_shrinkage = 0.1
+
+        self.max_dt_growth = max_dt_growth
+        self.min_dt_shrinkage = min_dt_shrinkage
+
+        self.ring_buffer_history = ring_buffer_history
+        self.exact_coefficients = exact_coefficients
+        self.rolled_substeps = rolled_substeps
+
+        if self.rolled_substeps:
+            self._check_rolled_substeps()
+
+        if self.adaptive:
+            self._check_adaptive()
+
+        self.multirate_bootstrap = multirate_bootstrap
+        self.parallel_rhs_calls = parallel_rhs_calls
+        if self.multirate_bootstrap and self.rolled_substeps:
+            raise ValueError("rolled_substeps does not support "
+                    "multirate_bootstrap")
+
+        # A rolled substep needs the time history even for static_dt.
+        self.keep_time_history = not self.static_dt or self.rolled_substeps
+
+        if self.keep_time_history:
             self.time_vars = {}
         self.history_vars = {}
+        self.history_rings = {}
+
+        from leap.multistep import _HistoryRingBuffer
 
         for comp_name, component_rhss in zip(self.component_names, self.rhss):
             for irhs, rhs in enumerate(component_rhss):
                 key = comp_name, irhs
 
-                # These are organized latest-last.
-                t_vars = []
-                hist_vars = []
-                for past in range(rhs.history_length):
-                    t_vars.insert(0, var(
-                        '<p>t_%s_rhs%d_hist_%d_ago' % (comp_name, irhs, past)))
-                    hist_vars.insert(0, var(
-                        '<p>hist_%s_rhs%d_hist_%d_ago' % (comp_name, irhs, past)))
+                if self.ring_buffer_history:
+                    # These are slots, organized latest-last only while
+                    # the head is 0, e.g. during bootstrap.
+                    t_vars = [
+                            var('<p>t_%s_rhs%d_hist_slot_%d'
+                                % (comp_name, irhs, i))
+                            for i in range(rhs.history_length)]
+                    hist_vars = [
+                            var('<p>hist_%s_rhs%d_hist_slot_%d'
+                                % (comp_name, irhs, i))
+                            for i in range(rhs.history_length)]
+
+                    self.history_rings[key] = _HistoryRingBuffer(
+                            "hist_%s_rhs%d" % key,
+                            hist_vars,
+                            var('<p>hist_head_%s_rhs%d' % key),
+                            None if not self.keep_time_history else t_vars)
 
-                if not self.static_dt:
+                else:
+                    # These are organized latest-last.
+                    t_vars = []
+                    hist_vars = []
+                    for past in range(rhs.history_length):
+                        t_vars.insert(0, var(
+                            '<p>t_%s_rhs%d_hist_%d_ago' % (comp_name, irhs, past)))
+                        hist_vars.insert(0, var(
+                            '<p>hist_%s_rhs%d_hist_%d_ago'
+                            % (comp_name, irhs, past)))
+
+                if self.keep_time_history:
                     self.time_vars[key] = t_vars
 
                 self.history_vars[key] = hist_vars
@@ -406,6 +602,63 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
         self.state_vars = tuple(
                 var("<state>" + comp_name) for comp_name in self.component_names)
 
+        # {{{ multirate bootstrap
+
+        # The right-hand sides that are extrapolated from their values at
+        # the first substeps of each bootstrap step
+        self.bootstrap_slow_keys = set()
+
+        if (self.multirate_bootstrap and self.nsubsteps > 1
+                and self.nsubsteps >= self.max_order):
+            for comp_name, component_rhss in zip(
+                    self.component_names, self.rhss):
+                if not self.is_ode_component[comp_name]:
+                    continue
+
+                for irhs, rhs in enumerate(component_rhss):
+                    if rhs.interval == self.nsubsteps:
+                        self.bootstrap_slow_keys.add((comp_name, irhs))
+
+        # }}}
+
+    def _check_rolled_substeps(self):
+        if self.ring_buffer_history:
+            raise ValueError("rolled_substeps and ring_buffer_history "
+                    "may not be used together")
+
+        if (self.hist_consistency_threshold is not None
+                or self.early_hist_consistency_threshold is not None):
+            raise ValueError("rolled_substeps does not support "
+                    "history consistency checks")
+
+        for comp_name, component_rhss in zip(self.component_names, self.rhss):
+            if not self.is_ode_component[comp_name]:
+                raise ValueError("rolled_substeps does not support "
+                        "non-ODE component '%s'" % comp_name)
+
+            for rhs in component_rhss:
+                if rhs.rhs_policy != rhs_policy.late:
+                    raise ValueError("rolled_substeps only supports "
+                            "rhs_policy.late, found a different policy "
+                            "for '%s'" % rhs.func_name)
+
+    def _check_adaptive(self):
+        if self.static_dt:
+            raise ValueError("adaptivity requires static_dt=False")
+
+        if self.rolled_substeps:
+            raise ValueError("rolled_substeps does not support adaptivity")
+
+        for comp_name, component_rhss in zip(self.component_names, self.rhss):
+            if not self.is_ode_component[comp_name]:
+                continue
+
+            for rhs in component_rhss:
+                if rhs.order < 2:
+                    raise ValueError("adaptivity requires an order of at "
+                            "least 2, found order %d for '%s'"
+                            % (rhs.order, rhs.func_name))
+
     # }}}
 
     def emit_initialization(self, cb):
@@ -413,10 +666,55 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
 
         cb(self.bootstrap_step, 0)
 
+        for ring in self.history_rings.values():
+            ring.emit_initialization(cb)
+
+        if self.rolled_substeps:
+            cb(var("<p>substep"), 0)
+
+        if self.hist_consistency_interval > 1:
+            cb(var("<p>hist_consistency_step"), 0)
+
+    @property
+    def checks_history_consistency(self):
+        return (self.hist_consistency_threshold is not None
+                and self.hist_consistency_check is not None)
+
+    def get_hist_checksums(self, comp_name, state):
+        """Return a list of tuples *(checksum_var, expr)* that fingerprint
+        *state* of *comp_name*.
+        """
+        norm = var("<builtin>norm_2")
+
+        # ||x + 1||^2 = ||x||^2 + 2 sum(x) + n, so that the second norm
+        # also detects changes that preserve the norm, such as sign flips.
+        return [
+                (var("<p>hist_checksum_" + comp_name), norm(state)),
+                (var("<p>hist_checksum_shifted_" + comp_name), norm(state + 1)),
+                ]
+
+    def emit_hist_checksum(self, cb, comp_name, state):
+        """Store the checksums of the state of *comp_name* to which the
+        history corresponds, if the history is checked by checksum.
+        """
+        if (self.checks_history_consistency
+                and self.hist_consistency_check == "checksum"
+                and self.is_ode_component[comp_name]):
+            for checksum, expr in self.get_hist_checksums(comp_name, state):
+                cb(checksum, expr)
+
     # {{{ rk bootstrap: step
 
-    def emit_small_rk_step(self, cb, name_prefix, name_gen, rhss_on_entry):
-        """Emit a single step of an RK method."""
+    def emit_small_rk_step(self, cb, name_prefix, name_gen, rhss_on_entry,
+            rhs_stage_values=None):
+        """Emit a single step of an RK method.
+
+        :arg rhs_stage_values: A mapping from *(comp_name, irhs)* to functions
+            that return the value of the right-hand side at the stage time
+            *c*, relative to the step, instead of evaluating it.
+        """
+        if rhs_stage_values is None:
+            rhs_stage_values = {}
 
         from leap.rk import ORDER_TO_RK_METHOD_BUILDER
         rk_method = ORDER_TO_RK_METHOD_BUILDER[self.max_order]
@@ -528,6 +826,12 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                         continue
 
                     for irhs, rhs in enumerate(component_rhss):
+                        stage_value = rhs_stage_values.get((comp_name, irhs))
+                        if stage_value is not None:
+                            cb(stage_rhss[comp_name, irhs][istage],
+                                    stage_value(c))
+                            continue
+
                         kwargs = dict(
                                 (self.comp_name_to_kwarg_name[arg_comp_name],
                                     component_state_ests[arg_comp_name])
@@ -583,6 +887,7 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                         "bootstrap")
 
             cb(var("<state>"+component_name), state)
+            self.emit_hist_checksum(cb, component_name, state)
 
         cb(self.t, self.t + self.dt/self.nsubsteps)
 
@@ -601,6 +906,16 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
         from pytools import UniqueNameGenerator
         name_gen = UniqueNameGenerator()
 
+        def get_start_state(comp_name):
+            if self.is_ode_component[comp_name]:
+                return var("<state>" + comp_name)
+            else:
+                return non_ode_states[comp_name]
+
+        # the values of the right-hand sides in bootstrap_slow_keys at the
+        # starts of the first substeps
+        slow_nodes = {}
+
         for isubstep in range(self.nsubsteps):
             name_prefix = 'substep' + str(isubstep)
 
@@ -645,6 +960,8 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
 
             # {{{ compute ODE current_rhss
 
+            rhs_stage_values = {}
+
             for comp_name, component_rhss in zip(
                     self.component_names, self.rhss):
                 if not self.is_ode_component[comp_name]:
@@ -657,20 +974,32 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                             .format(name_prefix=name_prefix, comp_name=comp_name,
                                 irhs=irhs)))
 
-                    def get_state(comp_name):
-                        if self.is_ode_component[comp_name]:
-                            return var("<state>" + comp_name)
-                        else:
-                            return non_ode_states[comp_name]
+                    key = (comp_name, irhs)
+                    is_extrapolated = (key in self.bootstrap_slow_keys
+                            and isubstep >= self.max_order - 1)
 
-                    kwargs = dict(
-                            (self.comp_name_to_kwarg_name[arg_comp_name],
-                                get_state(arg_comp_name))
-                            for arg_comp_name in rhs.arguments)
+                    if is_extrapolated:
+                        def stage_value(c, key=key, isubstep=isubstep):
+                            return self.bootstrap_slow_value(
+                                    slow_nodes[key], isubstep + c)
 
-                    cb(rhs_var, var(rhs.func_name)(t=self.t, **kwargs))
+                        rhs_stage_values[key] = stage_value
 
-                    current_rhss[comp_name, irhs] = rhs_var
+                    if is_extrapolated and isubstep >= self.max_order:
+                        cb(rhs_var, stage_value(0))
+
+                    else:
+                        kwargs = dict(
+                                (self.comp_name_to_kwarg_name[arg_comp_name],
+                                    get_start_state(arg_comp_name))
+                                for arg_comp_name in rhs.arguments)
+
+                        cb(rhs_var, var(rhs.func_name)(t=self.t, **kwargs))
+
+                        if key in self.bootstrap_slow_keys:
+                            slow_nodes.setdefault(key, []).append(rhs_var)
+
+                    current_rhss[key] = rhs_var
 
             # }}}
 
@@ -698,7 +1027,7 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                             assert i >= 0
 
                             with cb.if_(self.bootstrap_step, "==", test_step):
-                                if not self.static_dt:
+                                if self.keep_time_history:
                                     cb(self.time_vars[comp_name, irhs][i], self.t)
 
                                 cb(self.history_vars[comp_name, irhs][i],
@@ -711,7 +1040,8 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                     cb.switch_phase("primary")
                     cb.restart_step()
 
-            self.emit_small_rk_step(cb, name_prefix, name_gen, current_rhss)
+            self.emit_small_rk_step(cb, name_prefix, name_gen, current_rhss,
+                    rhs_stage_values)
 
         cb(self.bootstrap_step, self.bootstrap_step + 1)
 
@@ -719,6 +1049,27 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
 
     # }}}
 
+    # {{{ multirate bootstrap
+
+    def bootstrap_slow_value(self, nodes, substep_time):
+        """Return an expression for the value of a right-hand side at
+        *substep_time*, in units of substeps since the start of the
+        bootstrap step, by Lagrange extrapolation from its values *nodes*
+        at the starts of the first substeps.
+        """
+        terms = []
+        for i, value in enumerate(nodes):
+            weight = 1
+            for j in range(len(nodes)):
+                if j != i:
+                    weight *= (substep_time - j) / (i - j)
+
+            terms.append(weight * value)
+
+        return sum(terms)
+
+    # }}}
+
     class StateContribExplanation(Record):
         pass
 
@@ -728,7 +1079,7 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
         from pytools import UniqueNameGenerator
         name_gen = UniqueNameGenerator()
 
-        array = var("<builtin>array")
+        from fractions import Fraction
 
         # {{{ make temporary copies of time/hist_vars
 
@@ -745,14 +1096,22 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                     temp_hist_substeps[key] = list(range(
                         -rhs.interval*(rhs.history_length-1), 1, rhs.interval))
 
+                    ring = self.history_rings.get(key)
+
                     if self.static_dt:
                         temp_time_vars[key] = list(
-                                rhs.interval*i/self.nsubsteps
+                                Fraction(rhs.interval*i, self.nsubsteps)
                                 for i in range(-rhs.history_length+1, 0+1))
+                    elif ring is not None:
+                        temp_time_vars[key] = ring.emit_logical_times(
+                                cb, name_gen)
                     else:
                         temp_time_vars[key] = self.time_vars[key][:]
 
-                    temp_hist_vars[key] = self.history_vars[key][:]
+                    if ring is not None:
+                        temp_hist_vars[key] = ring.entries[:]
+                    else:
+                        temp_hist_vars[key] = self.history_vars[key][:]
 
         fill_temp_hist_vars()
 
@@ -770,16 +1129,34 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
 
         log_hist_state()
 
-        # A mapping from component_name to a list of tuples
-        # (substep_level, state_var). This mapping is ordered
-        # by substep_level.
+        # A mapping from component_name to the computed states of the
+        # component, by substep level.
         computed_states = dict(
-                (comp_name, [
-                    (0, state_var)
-                    ])
+                (comp_name, _ComputedStates(0, state_var))
                 for comp_name, state_var in zip(
                     self.component_names, self.state_vars))
 
+        comp_name_to_rhss = dict(zip(self.component_names, self.rhss))
+        comp_name_to_min_interval = dict(
+                (comp_name, min(rhs.interval for rhs in component_rhss))
+                for comp_name, component_rhss in six.iteritems(
+                    comp_name_to_rhss))
+
+        # A mapping from component_name to the names of the components
+        # with a right-hand side that takes it as an argument
+        comp_name_to_dependents = dict(
+                (comp_name, []) for comp_name in self.component_names)
+        for comp_name, component_rhss in zip(self.component_names, self.rhss):
+            for arg_comp_name in set(
+                    arg_comp_name
+                    for rhs in component_rhss
+                    for arg_comp_name in rhs.arguments):
+                comp_name_to_dependents[arg_comp_name].append(comp_name)
+
+        # A mapping from ODE component_name to the state at the end of the
+        # step obtained with orders reduced by one, for error estimation
+        low_order_end_states = {}
+
         # {{{ get_state
 
         def get_state(comp_name, isubstep):
@@ -787,18 +1164,18 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
 
             # {{{ see if we've got that state ready to go
 
-            for istate_substep, state_var in states:
-                if istate_substep == isubstep:
-                    return state_var
+            state_var = states.get(isubstep)
+            if state_var is not None:
+                return state_var
 
             # }}}
 
-            latest_state_substep, latest_state = states[-1]
+            latest_state_substep, latest_state = states.latest()
 
-            comp_index = self.component_names.index(comp_name)
-            rhss = self.rhss[comp_index]
+            rhss = comp_name_to_rhss[comp_name]
 
             contribs = []
+            low_order_contribs = []
             contrib_explanations = []
 
             for irhs, rhs in enumerate(rhss):
@@ -808,19 +1185,17 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                 relv_time_hist = temp_time_vars[comp_name, irhs][-hist_len:]
                 relv_hist_vars = temp_hist_vars[comp_name, irhs][-hist_len:]
 
-                t_start = latest_state_substep / self.nsubsteps
-                t_end = isubstep / self.nsubsteps
+                # Keeping the static times rational makes them exact keys
+                # of the coefficient cache.
+                t_start = Fraction(latest_state_substep, self.nsubsteps)
+                t_end = Fraction(isubstep, self.nsubsteps)
 
                 if not self.static_dt:
-                    time_hist_var = var(name_gen("time_hist"))
-                    cb(time_hist_var, array(hist_len))
-
-                    for ii in range(hist_len):
-                        cb(time_hist_var[ii], relv_time_hist[ii] - self.t)
-
-                    time_hist = time_hist_var
-                    t_start *= self.dt
-                    t_end *= self.dt
+                    time_hist = [
+                            relv_time_hist[ii] - self.t
+                            for ii in range(hist_len)]
+                    t_start = float(t_start) * self.dt
+                    t_end = float(t_end) * self.dt
                     dt_factor = 1
 
                 else:
@@ -832,19 +1207,39 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                         emit_adams_integration,
                         emit_adams_extrapolation)
 
+                ring_buffers = ()
+                if self.ring_buffer_history:
+                    ring_buffers = (self.history_rings[comp_name, irhs],)
+
                 if self.is_ode_component[comp_name]:
                     contrib = dt_factor*emit_adams_integration(
                                 cb, name_gen,
                                 AdamsMonomialIntegrationFunctionFamily(rhs.order),
                                 time_hist, relv_hist_vars,
-                                t_start, t_end)
+                                t_start, t_end,
+                                ring_buffers=ring_buffers,
+                                exact=self.exact_coefficients)
+
+                    if self.adaptive and isubstep == self.nsubsteps:
+                        low_order = rhs.order - 1
+                        low_order_contribs.append(
+                                dt_factor*emit_adams_integration(
+                                    cb, name_gen,
+                                    AdamsMonomialIntegrationFunctionFamily(
+                                        low_order),
+                                    time_hist[-low_order:],
+                                    relv_hist_vars[-low_order:],
+                                    t_start, t_end,
+                                    ring_buffers=ring_buffers))
 
                 else:
                     contrib = emit_adams_extrapolation(
                                 cb, name_gen,
                                 AdamsMonomialIntegrationFunctionFamily(rhs.order),
                                 time_hist, relv_hist_vars,
-                                t_end)
+                                t_end,
+                                ring_buffers=ring_buffers,
+                                exact=self.exact_coefficients)
 
                 contribs.append(contrib)
                 contrib_explanations.append(
@@ -867,6 +1262,17 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                 state_expr = self.state_filters[comp_name](state_expr)
             cb(state_var, state_expr)
 
+            if low_order_contribs:
+                low_order_state_expr = latest_state + sum(low_order_contribs)
+                if comp_name in self.state_filters:
+                    low_order_state_expr = self.state_filters[comp_name](
+                            low_order_state_expr)
+
+                low_order_state_var = var(
+                        name_gen("low_order_state_%s" % comp_name))
+                cb(low_order_state_var, low_order_state_expr)
+                low_order_end_states[comp_name] = low_order_state_var
+
             # Only keep temporary state if integrates exactly
             # one interval ahead for the fastest right-hand side,
             # which is the expected rate.
@@ -880,10 +1286,10 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
             #   same extrapolation can be recomputed.
 
             keep_temp_state = (
-                    isubstep - latest_state_substep == min(
-                        rhs.interval for rhs in rhss))
+                    isubstep - latest_state_substep
+                    == comp_name_to_min_interval[comp_name])
             if keep_temp_state:
-                states.append((isubstep, state_var))
+                states.append(isubstep, state_var)
 
             if self.is_ode_component[comp_name]:
                 explainer.integrate_to(comp_name, state_var.name,
@@ -938,7 +1344,8 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                 temp_time_vars[comp_name, irhs].append(t_var)
 
             else:
-                temp_time_vars[comp_name, irhs].append(progress_frac)
+                temp_time_vars[comp_name, irhs].append(
+                        Fraction(isubstep, self.nsubsteps))
 
             temp_hist_vars[comp_name, irhs].append(rhs_var)
 
@@ -948,24 +1355,9 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
             # {{{ invalidate computed states, if requested
 
             if rhs.invalidate_computed_state:
-                for other_comp_name, other_component_rhss in zip(
-                        self.component_names, self.rhss):
-                    do_invalidate = False
-                    for other_rhs in enumerate(other_component_rhss):
-                        if comp_name in rhs.arguments:
-                            do_invalidate = True
-                            break
-
-                    if do_invalidate:
-                        computed_states[other_comp_name][:] = [
-                                (istate_substep, state)
-
-                                for istate_substep, state in
-                                computed_states[other_comp_name]
-
-                                # Only earlier states live.
-                                if istate_substep < isubstep
-                                ]
+                for other_comp_name in comp_name_to_dependents[comp_name]:
+                    # Only earlier states live.
+                    computed_states[other_comp_name].remove_from(isubstep)
 
             # }}}
 
@@ -974,12 +1366,37 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
         def norm(expr):
             return var('<builtin>norm_2')(expr)
 
+        def check_state_checksums():
+            # The history was computed from the state with the stored
+            # checksums. Recomputing them from an unchanged state gives the
+            # same values, so the comparison is strict to let identically
+            # zero states pass.
+            for comp_name, state_var in zip(
+                    self.component_names, self.state_vars):
+                if not self.is_ode_component[comp_name]:
+                    continue
+
+                for checksum, expr in self.get_hist_checksums(
+                        comp_name, state_var):
+                    with cb.if_((expr - checksum)**2, ">",
+                            self.hist_consistency_threshold**2 * checksum**2):
+                        cb.raise_(InconsistentHistoryError,
+                                "MRAdams: state of component '%s' changed "
+                                "since its history was computed" % comp_name)
+
         def check_history_consistency():
             # At the start of a macrostep, ensure that the last computed
             # RHS history corresponds to the current state
+            if self.hist_consistency_check == "checksum":
+                check_state_checksums()
+
             for comp_idx, (comp_name, component_rhss) in enumerate(
                     zip(self.component_names, self.rhss)):
                 for irhs, rhs in enumerate(component_rhss):
+                    if (self.hist_consistency_check == "checksum"
+                            and rhs.rhs_policy != rhs_policy.early):
+                        continue
+
                     t_expr = self.t
                     kwargs = dict(
                             (self.comp_name_to_kwarg_name[arg_comp_name],
@@ -994,13 +1411,22 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                     # Compare this computed RHS with the 0th history point using
                     # built-in norm.
 
-                    zeroth_hist = temp_hist_vars[comp_name, irhs][-1]
-                    rel_rhs_error = (
-                            norm(test_rhs_var - zeroth_hist)
-                            /  # noqa: W504
-                            norm(test_rhs_var))
+                    def rel_rhs_error(zeroth_hist):
+                        return (
+                                norm(test_rhs_var - zeroth_hist)
+                                /  # noqa: W504
+                                norm(test_rhs_var))
 
-                    cb("rel_rhs_error", rel_rhs_error)
+                    zeroth_hist = temp_hist_vars[comp_name, irhs][-1]
+                    ring = self.history_rings.get((comp_name, irhs))
+                    if ring is not None:
+                        ilogical = ring.logical_index(zeroth_hist)
+                        assert ilogical is not None
+                        ring.emit_for_each_head(cb,
+                                lambda ihead: cb("rel_rhs_error", rel_rhs_error(
+                                    ring.slots[ring.slot_index(ihead, ilogical)])))
+                    else:
+                        cb("rel_rhs_error", rel_rhs_error(zeroth_hist))
 
                     # cb((), "<builtin>print(rel_rhs_error)")
 
@@ -1032,7 +1458,19 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
 
         def run_substep_loop():
             # Check last history value from previous macrostep
-            if self.hist_consistency_threshold is not None:
+            if not self.checks_history_consistency:
+                pass
+
+            elif self.hist_consistency_interval > 1:
+                step = var("<p>hist_consistency_step")
+                with cb.if_(step, "==", 0):
+                    check_history_consistency()
+
+                cb(step, step + 1)
+                with cb.if_(step, "==", self.hist_consistency_interval):
+                    cb(step, 0)
+
+            else:
                 check_history_consistency()
 
             for isubstep in range(self.nsubsteps+1):
@@ -1083,6 +1521,17 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                 for irhs, rhs in enumerate(component_rhss):
                     key = comp_name, irhs
 
+                    ring = self.history_rings.get(key)
+                    if ring is not None:
+                        nentries = len(ring.entries)
+                        assert temp_hist_vars[key][:nentries] == ring.entries
+
+                        ring.emit_push(cb, name_gen,
+                                temp_hist_vars[key][nentries:],
+                                None if self.static_dt
+                                else temp_time_vars[key][nentries:])
+                        continue
+
                     if not self.static_dt:
                         for time_var, time_expr in zip(
                                 self.time_vars[key],
@@ -1095,20 +1544,278 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                             temp_hist_vars[comp_name, irhs][-rhs.history_length:]):
                         cb(hist_var, hist_expr)
 
-        commit_temp_hist_vars()
+        # }}}
+
+        def finish_step():
+            commit_temp_hist_vars()
+
+            # TODO: Figure out more spots to yield intermediate state
+            for component_name, state in zip(self.component_names, end_states):
+                if self.is_ode_component[component_name]:
+                    cb.yield_state(
+                            state,
+                            component_name, self.t + self.dt, "final")
+
+                cb(var("<state>"+component_name), state)
+                self.emit_hist_checksum(cb, component_name, state)
+
+            cb(self.t, self.t + self.dt)
+
+        if self.adaptive:
+            self.emit_step_size_control(cb,
+                    end_states, low_order_end_states, finish_step)
+        else:
+            finish_step()
+
+    def emit_step_size_control(self, cb, end_states, low_order_end_states,
+            finish_step):
+        """Accept the step by calling *finish_step* or reject it, and choose
+        the next step size from the difference between *end_states* and
+        *low_order_end_states*. Nothing may have been committed to the
+        history before.
+        """
+        from pymbolic.primitives import Comparison, LogicalOr, Max, Min
+        from dagrt.expression import IfThenElse
+        from leap import TimeStepUnderflow
+
+        def norm(expr):
+            return var('<builtin>norm_2')(expr)
+
+        isnan = var('<builtin>isnan')
+
+        rel_errors = []
+        dt_ratios = []
+        for comp_name, component_rhss, state_var, end_state in zip(
+                self.component_names, self.rhss, self.state_vars, end_states):
+            if not self.is_ode_component[comp_name]:
+                continue
+
+            rel_error_raw = var('rel_error_raw_' + comp_name)
+            rel_error = var('rel_error_' + comp_name)
+
+            cb(rel_error_raw,
+                    norm(end_state - low_order_end_states[comp_name])
+                    / (var('<builtin>len')(state_var) ** 0.5
+                        * (
+                            self.atol + self.rtol
+                            * Max((norm(state_var), norm(end_state)))
+                            )))
+
+            cb(rel_error, IfThenElse(Comparison(rel_error_raw, "==", 0),
+                                     1.0e-14, rel_error_raw))
+
+            # The estimate is that of the local error of the reduced orders.
+            order = min(rhs.order for rhs in component_rhss)
+            rel_errors.append(rel_error)
+            dt_ratios.append(0.9 * rel_error ** (-1 / order))
+
+        dt_ratio = var('dt_ratio')
+        if len(dt_ratios) == 1:
+            cb(dt_ratio, dt_ratios[0])
+        else:
+            cb(dt_ratio, Min(tuple(dt_ratios)))
+
+        any_nan = LogicalOr(tuple(isnan(err) for err in rel_errors))
+
+        with cb.if_(LogicalOr(
+                tuple(Comparison(err, ">", 1) for err in rel_errors)
+                + (any_nan,))):
+
+            with cb.if_(any_nan):
+                cb(self.dt, self.min_dt_shrinkage * self.dt)
+            with cb.else_():
+                cb(self.dt, Max((dt_ratio * self.dt,
+                    self.min_dt_shrinkage * self.dt)))
+
+            with cb.if_(self.t + self.dt, '==', self.t):
+                cb.raise_(TimeStepUnderflow)
+            with cb.else_():
+                cb.fail_step()
+
+        with cb.else_():
+            # This updates <t>: <dt> should not be set before this is called.
+            finish_step()
+
+            cb(self.dt, Min((dt_ratio * self.dt,
+                self.max_dt_growth * self.dt)))
+
+    # }}}
+
+    # {{{ rolled substep generation
+
+    def emit_rolled_rk_bootstrap(self, cb):
+        """Emit a single substep of the RK bootstrap. The bootstrap step
+        counter counts substeps.
+        """
+        from pytools import UniqueNameGenerator
+        name_gen = UniqueNameGenerator()
+
+        final_substep = (self.max_hist_length - 1) * self.nsubsteps
+
+        current_rhss = {}
+        for comp_name, component_rhss in zip(self.component_names, self.rhss):
+            for irhs, rhs in enumerate(component_rhss):
+                rhs_var = var(name_gen(
+                    "substep_start_%s_rhs%d" % (comp_name, irhs)))
+
+                kwargs = dict(
+                        (self.comp_name_to_kwarg_name[arg_comp_name],
+                            var("<state>" + arg_comp_name))
+                        for arg_comp_name in rhs.arguments)
+
+                cb(rhs_var, var(rhs.func_name)(t=self.t, **kwargs))
+
+                current_rhss[comp_name, irhs] = rhs_var
+
+                # Slot i is filled (hist_length-1-i) intervals before the
+                # end of the bootstrap.
+                for i in range(rhs.history_length):
+                    with cb.if_(self.bootstrap_step, "==", final_substep
+                            - (rhs.history_length - 1 - i) * rhs.interval):
+                        cb(self.time_vars[comp_name, irhs][i], self.t)
+                        cb(self.history_vars[comp_name, irhs][i], rhs_var)
+
+        with cb.if_(self.bootstrap_step, "==", final_substep):
+            cb.switch_phase("primary")
+            cb.restart_step()
+
+        self.emit_small_rk_step(cb, "substep", name_gen, current_rhss)
+
+        cb(self.bootstrap_step, self.bootstrap_step + 1)
+
+    def emit_rolled_adams_method(self, cb):
+        """Emit a single substep of the method, which is executed
+        :attr:`nsubsteps` times per step. Only systems of ODE components
+        whose right-hand sides all use :attr:`rhs_policy.late` are supported.
+
+        At each substep, the state of each component is integrated from its
+        most recent *anchor* state, which is updated at the multiples of
+        the smallest interval among the right-hand sides of the component.
+        All states at a substep are computed before the right-hand sides
+        due at that substep are evaluated. For the usual systems, in which
+        each component is needed at each multiple of its smallest interval,
+        this agrees with the unrolled method.
+        """
+        from pytools import UniqueNameGenerator
+        name_gen = UniqueNameGenerator()
+
+        from leap.multistep import (
+                AdamsMonomialIntegrationFunctionFamily,
+                emit_adams_integration)
+
+        substep = var("<p>substep")
+        intervals = sorted(set(
+                rhs.interval
+                for component_rhss in self.rhss
+                for rhs in component_rhss))
+
+        def substep_phase(interval):
+            # substep modulo interval
+            return var("<p>substep_phase_%d" % interval)
+
+        anchors = dict(
+                (comp_name, var("<p>substep_anchor_%s" % comp_name))
+                for comp_name in self.component_names)
+        anchor_times = dict(
+                (comp_name, var("<p>substep_anchor_t_%s" % comp_name))
+                for comp_name in self.component_names)
+
+        # {{{ start a new step
+
+        with cb.if_(substep, "==", 0):
+            for comp_name, state_var in zip(
+                    self.component_names, self.state_vars):
+                cb(anchors[comp_name], state_var)
+                cb(anchor_times[comp_name], self.t)
+
+            for interval in intervals:
+                cb(substep_phase(interval), 0)
 
         # }}}
 
-        # TODO: Figure out more spots to yield intermediate state
-        for component_name, state in zip(self.component_names, end_states):
-            if self.is_ode_component[component_name]:
-                cb.yield_state(
-                        state,
-                        component_name, self.t + self.dt, "final")
+        cb(substep, substep + 1)
 
-            cb(var("<state>"+component_name), state)
+        for interval in intervals:
+            cb(substep_phase(interval), substep_phase(interval) + 1)
+            with cb.if_(substep_phase(interval), "==", interval):
+                cb(substep_phase(interval), 0)
+
+        t_substep = var(name_gen("t_substep"))
+        cb(t_substep, self.t + self.dt * substep / self.nsubsteps)
+
+        # {{{ integrate all components to the substep
+
+        states = {}
+        for comp_name, component_rhss in zip(self.component_names, self.rhss):
+            anchor_t = anchor_times[comp_name]
 
-        cb(self.t, self.t + self.dt)
+            contribs = []
+            for irhs, rhs in enumerate(component_rhss):
+                key = comp_name, irhs
+                contribs.append(emit_adams_integration(
+                    cb, name_gen,
+                    AdamsMonomialIntegrationFunctionFamily(rhs.order),
+                    [t_hist - anchor_t for t_hist in self.time_vars[key]],
+                    self.history_vars[key],
+                    0, t_substep - anchor_t))
+
+            state_expr = anchors[comp_name] + sum(contribs)
+            if comp_name in self.state_filters:
+                state_expr = self.state_filters[comp_name](state_expr)
+
+            state_var = var(name_gen("state_%s_substep" % comp_name))
+            cb(state_var, state_expr)
+            states[comp_name] = state_var
+
+        # }}}
+
+        # {{{ update the history of the right-hand sides that are due
+
+        for comp_name, component_rhss in zip(self.component_names, self.rhss):
+            for irhs, rhs in enumerate(component_rhss):
+                key = comp_name, irhs
+                hist_vars = self.history_vars[key]
+                time_vars = self.time_vars[key]
+
+                with cb.if_(substep_phase(rhs.interval), "==", 0):
+                    rhs_var = var(name_gen(
+                        "rhs_%s_rhs%d_substep" % (comp_name, irhs)))
+
+                    kwargs = dict(
+                            (self.comp_name_to_kwarg_name[arg_comp_name],
+                                states[arg_comp_name])
+                            for arg_comp_name in rhs.arguments)
+
+                    cb(rhs_var, var(rhs.func_name)(t=t_substep, **kwargs))
+
+                    for i in range(len(hist_vars) - 1):
+                        cb(hist_vars[i], hist_vars[i + 1])
+                        cb(time_vars[i], time_vars[i + 1])
+
+                    cb(hist_vars[-1], rhs_var)
+                    cb(time_vars[-1], t_substep)
+
+        # }}}
+
+        for comp_name, component_rhss in zip(self.component_names, self.rhss):
+            min_interval = min(rhs.interval for rhs in component_rhss)
+            with cb.if_(substep_phase(min_interval), "==", 0):
+                cb(anchors[comp_name], states[comp_name])
+                cb(anchor_times[comp_name], t_substep)
+
+        # {{{ finish the step
+
+        with cb.if_(substep, "==", self.nsubsteps):
+            for comp_name, state_var in zip(
+                    self.component_names, self.state_vars):
+                cb.yield_state(states[comp_name],
+                        comp_name, self.t + self.dt, "final")
+                cb(state_var, states[comp_name])
+
+            cb(self.t, self.t + self.dt)
+            cb(substep, 0)
+
+        # }}}
 
     # }}}
 
@@ -1120,6 +1827,10 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
             :class:`TextualSchemeExplainer`, or *None*.
         :returns: :class:`dagrt.language.DAGCode`
         """
+        if self.rolled_substeps and explainer is not None:
+            raise ValueError("scheme explainers are not supported "
+                    "with rolled_substeps")
+
         if explainer is None:
             explainer = SchemeExplainerBase()
 
@@ -1129,12 +1840,18 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
             self.emit_initialization(cb_init)
 
         with CodeBuilder(name="primary") as cb_primary:
-            self.emit_adams_method(cb_primary, explainer)
+            if self.rolled_substeps:
+                self.emit_rolled_adams_method(cb_primary)
+            else:
+                self.emit_adams_method(cb_primary, explainer)
 
         with CodeBuilder(name="bootstrap") as cb_bootstrap:
-            self.emit_rk_bootstrap(cb_bootstrap)
+            if self.rolled_substeps:
+                self.emit_rolled_rk_bootstrap(cb_bootstrap)
+            else:
+                self.emit_rk_bootstrap(cb_bootstrap)
 
-        return DAGCode(
+        code = DAGCode(
                 phases={
                     "initialization": cb_init.as_execution_phase("bootstrap"),
                     "bootstrap": cb_bootstrap.as_execution_phase("bootstrap"),
@@ -1142,6 +1859,15 @@ class MultiRateMultiStepMethodBuilder(MethodBuilder):
                     },
                 initial_phase="initialization")
 
+        if self.parallel_rhs_calls:
+            from leap.transform import annotate_parallel_calls
+            code = annotate_parallel_calls(code, set(
+                    rhs.func_name
+                    for component_rhss in self.rhss
+                    for rhs in component_rhss))
+
+        return code
+
         # }}}
 
 # }}}
@@ -0,0 +1,130 @@
+"""Concurrent evaluation of independent function calls."""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from dagrt.exec_numpy import NumpyInterpreter
+
+
+__doc__ = """
+Function calls marked with a *parallel_group* attribute by
+:func:`leap.transform.annotate_parallel_calls` do not depend on one another
+within their group. :class:`ThreadedNumpyInterpreter` carries out the calls
+of a group concurrently in a thread pool, which reduces the wall time of a
+step if the functions release the global interpreter lock, e.g. in compiled
+kernels. The functions must be safe to call from several threads at once.
+The code generators ignore the annotation.
+
+.. autoclass:: ThreadedNumpyInterpreter
+"""
+
+
+class ThreadedNumpyInterpreter(NumpyInterpreter):
+    """A :class:`dagrt.exec_numpy.NumpyInterpreter` that evaluates the
+    function calls of a parallel group concurrently.
+
+    Once the first call of a group is due, the other calls of the group whose
+    dependencies have been carried out are submitted to the thread pool as
+    well. Each call waits for its result when it is due itself, so that the
+    order of the remaining statements is unchanged.
+
+    .. automethod:: __init__
+    .. automethod:: shutdown
+    """
+
+    def __init__(self, code, function_map, max_workers=None):
+        """
+        :arg max_workers: The number of threads, passed to
+            :class:`concurrent.futures.ThreadPoolExecutor`.
+        """
+        super(ThreadedNumpyInterpreter, self).__init__(code, function_map)
+
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        self.phase = None
+        # statement id -> future of calls submitted ahead of time
+        self.pending_calls = {}
+
+    def shutdown(self):
+        """Shut down the thread pool."""
+        self.executor.shutdown()
+
+    def run_single_step(self):
+        self.phase = self.code.phases[self.next_phase]
+        try:
+            for evt in super(ThreadedNumpyInterpreter, self).run_single_step():
+                yield evt
+        finally:
+            self.pending_calls.clear()
+
+    def submit_call(self, stmt):
+        parameters = [
+                self.eval_mapper(expr)
+                for expr in stmt.parameters]
+        kw_parameters = dict(
+                (name, self.eval_mapper(expr))
+                for name, expr in stmt.kw_parameters.items())
+
+        func = self.eval_mapper.functions[stmt.function_id]
+        return self.executor.submit(func, *parameters, **kw_parameters)
+
+    def submit_ready_group_calls(self, group):
+        executed_ids = self.exec_controller.executed_ids
+        id_to_stmt = self.phase.id_to_stmt
+
+        for stmt_id in self.exec_controller.plan:
+            stmt = id_to_stmt[stmt_id]
+            if (getattr(stmt, "parallel_group", None) == group
+                    and stmt_id not in self.pending_calls
+                    and all(dep_id in executed_ids
+                        for dep_id in stmt.depends_on)
+                    and self.evaluate_condition(stmt)):
+                self.pending_calls[stmt_id] = self.submit_call(stmt)
+
+    def exec_AssignFunctionCall(self, stmt):
+        group = getattr(stmt, "parallel_group", None)
+        if group is None:
+            return super(ThreadedNumpyInterpreter, self).exec_AssignFunctionCall(
+                    stmt)
+
+        future = self.pending_calls.pop(stmt.id, None)
+        if future is None:
+            future = self.submit_call(stmt)
+            self.submit_ready_group_calls(group)
+
+        results = future.result()
+
+        if len(stmt.assignees) == 0:
+            return
+
+        if len(stmt.assignees) == 1:
+            results = (results,)
+
+        assert len(results) == len(stmt.assignees)
+
+        for assignee, res in zip(stmt.assignees, results):
+            self.context[assignee] = res
+
+# vim: foldmethod=marker
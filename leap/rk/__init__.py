@@ -99,6 +99,24 @@ def _is_last_stage_same_as_output(c, coeff_sets, output_stage_coefficients):
                 _truncate_final_zeros(output_stage_coefficients)
                 for coeff_set in six.itervalues(coeff_sets)))
 
+
+def _infer_recycled_last_stage_coeff_set_names(c, stage_coeff_set_names,
+        stage_coeff_sets, output_stage_coefficients):
+    """Return the names of the coefficient sets whose last-stage right-hand
+    side is the same as the first-stage right-hand side of the following step
+    ("first same as last", FSAL).
+    """
+    used_coeff_sets = dict(
+            (name, stage_coeff_sets[name]) for name in stage_coeff_set_names)
+
+    if not _is_last_stage_same_as_output(
+            c, used_coeff_sets, output_stage_coefficients):
+        return ()
+
+    return tuple(
+            name for name in stage_coeff_set_names
+            if _is_first_stage_same_as_last_stage(c, stage_coeff_sets[name]))
+
 # }}}
 
 
@@ -119,9 +137,17 @@ class ButcherTableauMethodBuilder(MethodBuilder):
     def output_coeffs(self):
         raise NotImplementedError
 
-    @property
-    def recycle_last_stage_coeff_set_names(self):
-        raise NotImplementedError
+    #: A tuple of names of stage coefficient sets for which the last-stage
+    #: right-hand side is reused as the first-stage right-hand side of the
+    #: next step. If *None*, this is inferred from the tableau.
+    recycle_last_stage_coeff_set_names = None
+
+    #: Whether a step may be rejected (and retried from the same state).
+    adaptive = False
+
+    #: Whether the state carries a leading axis of ensemble members with
+    #: individual time steps. See :mod:`leap.ensemble`.
+    ensemble = False
 
     def __init__(self, component_id, state_filter_name=None):
 
@@ -169,16 +195,47 @@ class ButcherTableauMethodBuilder(MethodBuilder):
 
         # }}}
 
+        # {{{ determine reusable first-stage right-hand sides
+
+        recycle_names = self.recycle_last_stage_coeff_set_names
+        if recycle_names is None:
+            recycle_names = _infer_recycled_last_stage_coeff_set_names(
+                    self.c, stage_coeff_set_names, stage_coeff_sets,
+                    estimate_coeff_sets[estimate_coeff_set_names[0]])
+
+        # Names of sets for which the last-stage right-hand side is reused.
+        fsal_names = set(
+                name for name in stage_coeff_set_names
+                if name in recycle_names
+                and _is_first_stage_same_as_last_stage(
+                    self.c, stage_coeff_sets[name]))
+
+        # For the remaining sets with an explicit first stage, a rejected step
+        # would recompute the first-stage right-hand side from an unchanged
+        # state. If steps can be rejected, evaluate it once after each
+        # accepted step instead.
+        if self.adaptive:
+            precomputed_names = set(
+                    name for name in stage_coeff_set_names
+                    if name not in fsal_names
+                    and self.c
+                    and self.c[0] == 0
+                    and not _truncate_final_zeros(stage_coeff_sets[name][0]))
+        else:
+            precomputed_names = set()
+
+        # }}}
+
         # {{{ initialization
 
         last_rhss = {}
 
         with CodeBuilder(name="initialization") as cb:
+            if self.ensemble:
+                self.emit_ensemble_initialization(cb)
+
             for name in stage_coeff_set_names:
-                if (
-                        name in self.recycle_last_stage_coeff_set_names
-                        and _is_first_stage_same_as_last_stage(
-                        self.c, stage_coeff_sets[name])):
+                if name in fsal_names or name in precomputed_names:
                     last_rhss[name] = var("<p>last_rhs_" + name)
                     cb(last_rhss[name], rhs_funcs[name](t=t, **{comp: state}))
 
@@ -205,6 +262,9 @@ class ButcherTableauMethodBuilder(MethodBuilder):
         last_state_est_var_valid = False
 
         with CodeBuilder(name="primary") as cb:
+            if self.ensemble:
+                self.emit_ensemble_step_size(cb)
+
             equations = []
             unknowns = set()
 
@@ -217,11 +277,7 @@ class ButcherTableauMethodBuilder(MethodBuilder):
                     c = self.c[istage]
                     my_rhs = stage_rhs_vars[name][istage]
 
-                    if (
-                            name in self.recycle_last_stage_coeff_set_names
-                            and istage == 0
-                            and _is_first_stage_same_as_last_stage(
-                                self.c, stage_coeff_sets[name])):
+                    if istage == 0 and name in last_rhss:
                         cb(my_rhs, last_rhss[name])
                         make_known(my_rhs)
 
@@ -343,11 +399,15 @@ class ButcherTableauMethodBuilder(MethodBuilder):
             # These updates have to happen *after* finish because before we
             # don't yet know whether finish will accept the new state.
             for name in stage_coeff_set_names:
-                if (
-                        name in self.recycle_last_stage_coeff_set_names
-                        and _is_first_stage_same_as_last_stage(
-                            self.c, stage_coeff_sets[name])):
-                    cb(last_rhss[name], stage_rhs_vars[name][-1])
+                if name in fsal_names:
+                    new_last_rhs = stage_rhs_vars[name][-1]
+                    if self.ensemble:
+                        new_last_rhs = self.ensemble_select(
+                                new_last_rhs, last_rhss[name])
+
+                    cb(last_rhss[name], new_last_rhs)
+                elif name in precomputed_names:
+                    cb(last_rhss[name], rhs_funcs[name](t=t, **{comp: state}))
 
         cb_primary = cb
 
@@ -409,8 +469,6 @@ class ForwardEulerMethodBuilder(SimpleButcherTableauMethodBuilder):
 
     output_coeffs = (1,)
 
-    recycle_last_stage_coeff_set_names = ()
-
 
 class BackwardEulerMethodBuilder(SimpleButcherTableauMethodBuilder):
     """
@@ -425,8 +483,6 @@ class BackwardEulerMethodBuilder(SimpleButcherTableauMethodBuilder):
 
     output_coeffs = (1,)
 
-    recycle_last_stage_coeff_set_names = ()
-
 
 class MidpointMethodBuilder(SimpleButcherTableauMethodBuilder):
     """
@@ -442,8 +498,6 @@ class MidpointMethodBuilder(SimpleButcherTableauMethodBuilder):
 
     output_coeffs = (0, 1)
 
-    recycle_last_stage_coeff_set_names = ()
-
 
 class HeunsMethodBuilder(SimpleButcherTableauMethodBuilder):
     """
@@ -459,8 +513,6 @@ class HeunsMethodBuilder(SimpleButcherTableauMethodBuilder):
 
     output_coeffs = (1/2, 1/2)
 
-    recycle_last_stage_coeff_set_names = ()
-
 
 class RK3MethodBuilder(SimpleButcherTableauMethodBuilder):
     """
@@ -480,7 +532,6 @@ class RK3MethodBuilder(SimpleButcherTableauMethodBuilder):
         )
 
     output_coeffs = (1/4, 0, 3/4)
-    recycle_last_stage_coeff_set_names = ()
 
 
 class RK4MethodBuilder(SimpleButcherTableauMethodBuilder):
@@ -499,8 +550,6 @@ class RK4MethodBuilder(SimpleButcherTableauMethodBuilder):
 
     output_coeffs = (1/6, 1/3, 1/3, 1/6)
 
-    recycle_last_stage_coeff_set_names = ()
-
 
 class RK5MethodBuilder(SimpleButcherTableauMethodBuilder):
     """
@@ -521,8 +570,6 @@ class RK5MethodBuilder(SimpleButcherTableauMethodBuilder):
 
     output_coeffs = (7/90, 0, 32/90, 12/90, 32/90, 7/90)
 
-    recycle_last_stage_coeff_set_names = ()
-
 
 ORDER_TO_RK_METHOD_BUILDER = {
         1: ForwardEulerMethodBuilder,
@@ -554,7 +601,15 @@ class EmbeddedButcherTableauMethodBuilder(
         raise NotImplementedError
 
     def __init__(self, component_id, use_high_order=True, state_filter_name=None,
-            atol=0, rtol=0, max_dt_growth=None, min_dt_shrinkage=None):
+            atol=0, rtol=0, max_dt_growth=None, min_dt_shrinkage=None,
+            ensemble=False):
+        """
+        :arg ensemble: If *True*, the state has a leading axis of
+            independent ensemble members, each of which is advanced with
+            its own adaptively chosen time step. In this mode, *<dt>* is
+            the interval at which all members are synchronized. Requires
+            *atol* or *rtol*. See :mod:`leap.ensemble`.
+        """
         ButcherTableauMethodBuilder.__init__(
                 self,
                 component_id=component_id,
@@ -565,7 +620,12 @@ class EmbeddedButcherTableauMethodBuilder(
                 atol=atol,
                 rtol=rtol,
                 max_dt_growth=max_dt_growth,
-                min_dt_shrinkage=min_dt_shrinkage)
+                min_dt_shrinkage=min_dt_shrinkage,
+                ensemble=ensemble)
+
+        if self.ensemble:
+            self.t = self.ensemble_t
+            self.dt = self.ensemble_step
 
         self.use_high_order = use_high_order
 
@@ -598,7 +658,11 @@ class EmbeddedButcherTableauMethodBuilder(
                     estimate_coeff_set_names.index("high_order")]
             low_est = estimate_vars[
                     estimate_coeff_set_names.index("low_order")]
-            self.finish_adaptive(cb, high_est, low_est)
+
+            if self.ensemble:
+                self.finish_adaptive_ensemble(cb, high_est, low_est)
+            else:
+                self.finish_adaptive(cb, high_est, low_est)
 
     def finish_nonadaptive(self, cb, high_order_estimate, low_order_estimate):
         if self.use_high_order:
@@ -642,8 +706,6 @@ class ODE23MethodBuilder(EmbeddedButcherTableauMethodBuilder):
     high_order = 3
     high_order_coeffs = [2/9, 1/3, 4/9, 0]
 
-    recycle_last_stage_coeff_set_names = ("explicit",)
-
 # }}}
 
 
@@ -679,8 +741,6 @@ class ODE45MethodBuilder(EmbeddedButcherTableauMethodBuilder):
     high_order = 5
     high_order_coeffs = [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0]
 
-    recycle_last_stage_coeff_set_names = ("explicit",)
-
 # }}}
 
 
@@ -0,0 +1,380 @@
+"""Extrapolation ODE methods."""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from pymbolic import var
+from pymbolic.primitives import Comparison, LogicalAnd, Max, Min
+
+from dagrt.language import CodeBuilder, DAGCode
+from leap import MethodBuilder
+
+
+__doc__ = """
+Extrapolation Methods
+---------------------
+
+.. autoclass:: ExtrapolationMethodBuilder
+.. autoclass:: EulerExtrapolationMethodBuilder
+.. autoclass:: GraggBulirschStoerMethodBuilder
+"""
+
+
+class ExtrapolationMethodBuilder(MethodBuilder):
+    """Extrapolation of a simple base method, taking *n_j* substeps for
+    row *j* of the Aitken-Neville tableau.
+
+    Without tolerances, *nrows* rows are always computed. With *atol* or
+    *rtol*, between two and *nrows* rows are computed, and both the step
+    size and the number of rows are chosen adaptively, following
+    E. Hairer, S.P. Norsett, G. Wanner, Solving Ordinary Differential
+    Equations I, 2nd ed., Section II.9.
+
+    User-supplied context:
+        <state> + component_id: The value that is integrated
+        <func> + component_id: The right hand side function
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    @property
+    def expansion_power(self):
+        """The error of the base method expands in powers of
+        ``h**expansion_power``.
+        """
+        raise NotImplementedError
+
+    def default_step_sequence(self, nrows):
+        raise NotImplementedError
+
+    def emit_base_method(self, cb, rhs_start, nsubsteps):
+        """Emit *nsubsteps* substeps of the base method across the step,
+        given the right-hand side *rhs_start* at the start of the step.
+
+        :returns: a variable holding the result.
+        """
+        raise NotImplementedError
+
+    def __init__(self, component_id, nrows=4, step_sequence=None,
+            rhs_func_name=None, atol=0, rtol=0,
+            max_dt_growth=None, min_dt_shrinkage=None):
+        """
+        :arg nrows: The number of rows of the extrapolation tableau,
+            or the maximum number if the method is adaptive.
+        :arg step_sequence: A list of numbers of substeps for each row.
+            If not given, :meth:`default_step_sequence` is used.
+        """
+        if nrows < 1:
+            raise ValueError("need at least one row")
+
+        if step_sequence is None:
+            step_sequence = self.default_step_sequence(nrows)
+
+        step_sequence = tuple(step_sequence)
+        if len(step_sequence) < nrows:
+            raise ValueError("step sequence must have at least %d entries"
+                    % nrows)
+
+        self.component_id = component_id
+        self.nrows = nrows
+        self.step_sequence = step_sequence[:nrows]
+
+        if rhs_func_name is None:
+            rhs_func_name = "<func>" + component_id
+        self.rhs_func_name = rhs_func_name
+
+        self.adaptive = bool(atol or rtol)
+        self.atol = atol
+        self.rtol = rtol
+
+        if self.adaptive and nrows < 2:
+            raise ValueError("adaptivity requires at least two rows")
+
+        if max_dt_growth is None:
+            max_dt_growth = 5
+
+        if min_dt_shrinkage is None:
+            min_dt_shrinkage = 0.1
+
+        self.max_dt_growth = max_dt_growth
+        self.min_dt_shrinkage = min_dt_shrinkage
+
+        self.dt = var("<dt>")
+        self.t = var("<t>")
+        self.state = var("<state>" + component_id)
+        self.target_row = var("<p>extrap_target_row")
+
+    @property
+    def order(self):
+        """The order of the (non-adaptive) method."""
+        return self.expansion_power * self.nrows
+
+    def eval_rhs(self, t, y):
+        return var(self.rhs_func_name)(t=t, **{self.component_id: y})
+
+    def _work(self, nrows):
+        """The number of right-hand side evaluations needed to compute
+        *nrows* rows, sharing the evaluation at the start of the step.
+        """
+        return 1 + sum(n - 1 for n in self.step_sequence[:nrows])
+
+    def emit_row(self, cb, rhs_start, rows, j):
+        """Compute row *j* (zero-based) of the extrapolation tableau
+        and append it to *rows*.
+        """
+        n = self.step_sequence
+        p = self.expansion_power
+
+        row = [cb.fresh_var("extrap_T%d_0" % j)]
+        cb(row[0], self.emit_base_method(cb, rhs_start, n[j]))
+
+        for k in range(1, j+1):
+            # Aitken-Neville
+            factor = 1/((n[j]/n[j-k])**p - 1)
+            entry = cb.fresh_var("extrap_T%d_%d" % (j, k))
+            cb(entry, row[k-1] + factor*(row[k-1] - rows[j-1][k-1]))
+            row.append(entry)
+
+        rows.append(row)
+
+    def generate(self):
+        """
+        :returns: :class:`dagrt.language.DAGCode`
+        """
+        with CodeBuilder(name="initialization") as cb_init:
+            if self.adaptive:
+                cb_init(self.target_row, self.nrows)
+
+        with CodeBuilder(name="primary") as cb:
+            rhs_start = cb.fresh_var("rhs_start")
+            cb(rhs_start, self.eval_rhs(self.t, self.state))
+
+            rows = []
+            if not self.adaptive:
+                for j in range(self.nrows):
+                    self.emit_row(cb, rhs_start, rows, j)
+
+                cb(self.state, rows[-1][-1])
+                cb.yield_state(self.state, self.component_id,
+                        self.t + self.dt, 'final')
+                cb(self.t, self.t + self.dt)
+
+            else:
+                self.emit_adaptive_step(cb, rhs_start, rows)
+
+        return DAGCode(
+                phases={
+                    "initial": cb_init.as_execution_phase(next_phase="primary"),
+                    "primary": cb.as_execution_phase(next_phase="primary")
+                    },
+                initial_phase="initial")
+
+    def emit_adaptive_step(self, cb, rhs_start, rows):
+        from leap import TimeStepUnderflow
+
+        done = var("extrap_done")
+        result = var("extrap_result")
+        new_dt = var("extrap_new_dt")
+        new_target_row = var("extrap_new_target_row")
+        norm_start_state = var("norm_start_state")
+
+        cb(done, 0)
+        cb(norm_start_state, var("<builtin>norm_2")(self.state))
+
+        # step sizes and work per unit step suggested by each row
+        dts = []
+        works = []
+
+        for j in range(self.nrows):
+            if j < 2:
+                self.emit_row(cb, rhs_start, rows, j)
+                if j > 0:
+                    self.emit_row_control(cb, rows, dts, works,
+                            done, result, new_dt, new_target_row,
+                            norm_start_state)
+            else:
+                with cb.if_(done, "==", 0):
+                    self.emit_row(cb, rhs_start, rows, j)
+                    self.emit_row_control(cb, rows, dts, works,
+                            done, result, new_dt, new_target_row,
+                            norm_start_state)
+
+            # {{{ reject: left the order window or ran out of rows
+
+            row_number = j + 1
+            if row_number < 2:
+                continue
+
+            if row_number == self.nrows:
+                reject = Comparison(done, "==", 0)
+            else:
+                reject = LogicalAnd((
+                    Comparison(done, "==", 0),
+                    Comparison(self.target_row, "<", row_number)))
+
+            with cb.if_(reject):
+                cb(self.dt, dts[-1])
+                cb(self.target_row, Min((self.target_row, row_number)))
+
+                with cb.if_(self.t + self.dt, "==", self.t):
+                    cb.raise_(TimeStepUnderflow)
+                with cb.else_():
+                    cb.fail_step()
+
+            # }}}
+
+        cb(self.state, result)
+        cb.yield_state(self.state, self.component_id, self.t + self.dt, "final")
+        cb(self.t, self.t + self.dt)
+        cb(self.dt, new_dt)
+        cb(self.target_row, new_target_row)
+
+    def emit_row_control(self, cb, rows, dts, works,
+            done, result, new_dt, new_target_row, norm_start_state):
+        """Estimate the error of the last row in *rows* and accept the step
+        if the row is within the order window. On acceptance, the number of
+        rows and the step size for the next step are chosen to minimize the
+        work per unit step.
+        """
+        norm = var("<builtin>norm_2")
+
+        j = len(rows) - 1
+        row_number = j + 1
+
+        rel_error = cb.fresh_var("rel_error_row%d" % row_number)
+        cb(rel_error, norm(rows[j][-1] - rows[j][-2])
+                / (var("<builtin>len")(self.state) ** 0.5
+                    * (self.atol + self.rtol * Max((
+                        norm_start_state, norm(rows[j][-1]))))))
+
+        # The error estimate is of the order of the subdiagonal entry.
+        exponent = 1/(self.expansion_power * j + 1)
+
+        dt_row = cb.fresh_var("dt_row%d" % row_number)
+        cb(dt_row, self.dt * Min((
+            self.max_dt_growth,
+            Max((
+                self.min_dt_shrinkage,
+                0.9 * Max((rel_error, 1e-14)) ** (-exponent)))
+            )))
+        dts.append(dt_row)
+
+        work_row = cb.fresh_var("work_row%d" % row_number)
+        cb(work_row, self._work(row_number) / dt_row)
+        works.append(work_row)
+
+        with cb.if_(LogicalAnd((
+                Comparison(done, "==", 0),
+                Comparison(rel_error, "<=", 1),
+                Comparison(self.target_row, "<=", row_number + 1)))):
+            cb(done, 1)
+            cb(result, rows[j][-1])
+            cb(new_target_row, row_number)
+            cb(new_dt, dt_row)
+
+            if row_number < self.nrows:
+                increase = cb.fresh_var("extrap_increase")
+                cb(increase, self._work(row_number + 1)/self._work(row_number))
+
+                if len(works) > 1:
+                    with cb.if_(work_row, "<", 0.9 * works[-2]):
+                        cb(new_target_row, row_number + 1)
+                        cb(new_dt, dt_row * increase)
+                else:
+                    cb(new_target_row, row_number + 1)
+                    cb(new_dt, dt_row * increase)
+
+            if len(works) > 1:
+                with cb.if_(works[-2], "<", 0.9 * work_row):
+                    cb(new_target_row, row_number - 1)
+                    cb(new_dt, dts[-2])
+
+
+# {{{ concrete methods
+
+class EulerExtrapolationMethodBuilder(ExtrapolationMethodBuilder):
+    """Extrapolated explicit Euler, with the harmonic step sequence
+    1, 2, 3, ... by default. The non-adaptive method is of order *nrows*.
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    expansion_power = 1
+
+    def default_step_sequence(self, nrows):
+        return list(range(1, nrows+1))
+
+    def emit_base_method(self, cb, rhs_start, nsubsteps):
+        h = self.dt / nsubsteps
+
+        z = cb.fresh_var("euler_n%d_z" % nsubsteps)
+        cb(z, self.state + h * rhs_start)
+
+        for m in range(1, nsubsteps):
+            new_z = cb.fresh_var("euler_n%d_z" % nsubsteps)
+            cb(new_z, z + h * self.eval_rhs(self.t + m * h, z))
+            z = new_z
+
+        return z
+
+
+class GraggBulirschStoerMethodBuilder(ExtrapolationMethodBuilder):
+    """Gragg-Bulirsch-Stoer extrapolation of the explicit midpoint rule,
+    with the step sequence 2, 4, 6, ... by default. The non-adaptive method
+    is of order 2 *nrows*.
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    expansion_power = 2
+
+    def default_step_sequence(self, nrows):
+        return list(range(2, 2*nrows+1, 2))
+
+    def __init__(self, *args, **kwargs):
+        super(GraggBulirschStoerMethodBuilder, self).__init__(*args, **kwargs)
+
+        if any(n % 2 for n in self.step_sequence):
+            raise ValueError("step sequence entries must be even")
+
+    def emit_base_method(self, cb, rhs_start, nsubsteps):
+        h = self.dt / nsubsteps
+
+        z_prev = self.state
+        z = cb.fresh_var("gragg_n%d_z" % nsubsteps)
+        cb(z, self.state + h * rhs_start)
+
+        for m in range(1, nsubsteps):
+            new_z = cb.fresh_var("gragg_n%d_z" % nsubsteps)
+            cb(new_z, z_prev + 2 * h * self.eval_rhs(self.t + m * h, z))
+            z_prev, z = z, new_z
+
+        return z
+
+# }}}
+
+# vim: foldmethod=marker
@@ -207,6 +207,9 @@ class KennedyCarpenterIMEXARK4MethodBuilder(
             [82889/524892, 0, 15625/83664, 69875/102672,
                 -2260/8211, gamma]]
 
+    # The explicit last stage does not coincide with the output, so FSAL
+    # would not be inferred. Reusing the (stiffly accurate) implicit last
+    # stage is nonetheless intended by the method.
     recycle_last_stage_coeff_set_names = ("implicit",)
 
     assert (len(a_explicit) == len(a_implicit)
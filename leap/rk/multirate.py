@@ -0,0 +1,596 @@
+"""Multirate infinitesimal Runge-Kutta methods."""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from math import ceil
+
+from pymbolic import var
+
+from dagrt.language import CodeBuilder, DAGCode
+from leap import MethodBuilder
+
+
+__doc__ = """
+Multirate Infinitesimal Methods
+-------------------------------
+
+.. autoclass:: MRIGARKMethodBuilder
+.. autoclass:: MRIGARKERK22aMethodBuilder
+.. autoclass:: MRIGARKERK22bMethodBuilder
+.. autoclass:: MRIGARKERK33aMethodBuilder
+.. autoclass:: MISMethodBuilder
+"""
+
+
+class MRIGARKMethodBuilder(MethodBuilder):
+    """Multirate infinitesimal GARK methods of A. Sandu, A class of
+    multirate infinitesimal GARK methods, SIAM J. Numer. Anal. 57 (2019).
+
+    The right-hand sides of the system are split into fast ones, which have
+    an interval of 1, and slow ones, which have the common interval *N* of
+    all slow right-hand sides. A step of size :math:`H` = *<dt>* evaluates
+    the slow right-hand sides :math:`f^S` once per stage :math:`Y_i`. The
+    next stage is the solution at :math:`\\theta = H` of the fast problem
+
+    .. math::
+
+        v' = \\Delta c_i f^F(t_n + c_i H + \\Delta c_i \\theta, v)
+        + \\sum_{j \\le i} \\gamma_{i,j}(\\theta/H) f^S(Y_j),
+        \\qquad v(0) = Y_i,
+
+    where :math:`\\Delta c_i = c_{i+1} - c_i` and
+    :math:`\\gamma_{i,j}(\\tau) = \\sum_k \\gamma^k_{i,j} \\tau^k`. The fast
+    problem is integrated with :math:`\\lceil N \\Delta c_i \\rceil` steps of
+    an explicit Runge-Kutta method, so that the fast right-hand sides are
+    evaluated about as often as with an interval of 1. The method needs no
+    history, and hence no bootstrap.
+
+    By default, all fast steps are laid out in the ``primary`` phase, which
+    then contains about :math:`N` times the number of fast stages
+    statements per component for the fast problems alone. For large *N*,
+    this makes the generated code, and the time to compile it, large. With
+    *rolled_fast_steps*, each phase carries out a single fast step and is
+    repeated, see :meth:`__init__`.
+
+    The system is described as for
+    :class:`leap.multistep.multirate.MultiRateMultiStepMethodBuilder`, where
+    only ODE components are supported and the orders, policies and history
+    lengths of the :class:`~leap.multistep.multirate.MultiRateHistory`
+    instances are ignored.
+
+    .. attribute:: c
+
+        The abscissae :math:`c_1 = 0, \\dots, c_{s+1} = 1`.
+
+    .. attribute:: gamma
+
+        The tuple of the :math:`s \\times s` lower triangular coefficient
+        matrices :math:`\\Gamma^k`.
+
+    .. attribute:: order
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    def __init__(self, system_description, fast_method=None,
+            state_filter_names=None, component_arg_names=None,
+            rolled_fast_steps=False):
+        """
+        :arg system_description: See
+            :class:`~leap.multistep.multirate.MultiRateMultiStepMethodBuilder`.
+        :arg fast_method: A subclass of
+            :class:`leap.rk.ButcherTableauMethodBuilder` with an explicit
+            tableau, used for the fast problems. By default, the method
+            of :data:`leap.rk.ORDER_TO_RK_METHOD_BUILDER` of the same order.
+        :arg state_filter_names: A dictionary mapping component names to the
+            names of state filter functions, which are applied to the fast
+            stage values.
+        :arg component_arg_names: A tuple of names of the components
+            to be used as keywords for passing arguments to the right
+            hand sides.
+        :arg rolled_fast_steps: If *True*, the generated code has a phase
+            for each stage, which carries out a single fast step and is
+            repeated until the fast problem of the stage is solved, so that
+            the size of the generated code does not depend on *N*. The
+            ``primary`` phase is that of the first stage. Each execution of
+            a phase is a step of the time integrator, so that the
+            :class:`dagrt.exec_numpy.StepCompleted` events and the
+            *max_steps* of :meth:`dagrt.exec_numpy.NumpyInterpreter.run`
+            count fast steps. The states are only yielded, and *<t>* is
+            only advanced, at the end of the step of size *<dt>*. In between,
+            the state variables hold the solution of the current fast
+            problem.
+        """
+        super(MRIGARKMethodBuilder, self).__init__()
+
+        # {{{ process system_description
+
+        if not isinstance(system_description, tuple):
+            raise TypeError("'system_description' must be a tuple")
+
+        component_names = []
+        rhss = []
+        for irow, row in enumerate(system_description):
+            if not isinstance(row, tuple):
+                raise TypeError("row %d (1-based) of 'system_description' "
+                        "must be a tuple" % (irow + 1))
+
+            if len(row) < 4 or row[0] != "dt" or row[2] != "=":
+                raise ValueError("row %d (1-based) of 'system_description' "
+                        "must describe an ODE" % (irow + 1))
+
+            component_names.append(row[1])
+            rhss.append(row[3:])
+
+        self.component_names = component_names
+        self.rhss = rhss
+
+        intervals = set(
+                rhs.interval
+                for component_rhss in rhss
+                for rhs in component_rhss)
+
+        slow_intervals = intervals - set([1])
+        if len(slow_intervals) > 1:
+            raise ValueError("only two rates are supported: found intervals %s"
+                    % sorted(intervals))
+
+        if slow_intervals:
+            self.nsubsteps, = slow_intervals
+        else:
+            self.nsubsteps = 1
+
+        # }}}
+
+        if component_arg_names is None:
+            component_arg_names = component_names
+
+        self.comp_name_to_kwarg_name = dict(
+                zip(component_names, component_arg_names))
+
+        if state_filter_names is None:
+            state_filter_names = {}
+
+        for comp_name in state_filter_names:
+            if comp_name not in component_names:
+                raise ValueError("component name '%s' in 'state_filter_names' "
+                        "not known" % comp_name)
+
+        self.state_filters = dict(
+                (comp_name, var("<func>" + sfname))
+                for comp_name, sfname in state_filter_names.items()
+                if sfname is not None)
+
+        if fast_method is None:
+            from leap.rk import ORDER_TO_RK_METHOD_BUILDER
+            fast_method = ORDER_TO_RK_METHOD_BUILDER[self.order]
+
+        self.fast_method = fast_method
+        self.rolled_fast_steps = rolled_fast_steps
+
+        self.t = var("<t>")
+        self.dt = var("<dt>")
+        self.state_vars = dict(
+                (comp_name, var("<state>" + comp_name))
+                for comp_name in component_names)
+
+    def is_slow(self, rhs):
+        return self.nsubsteps > 1 and rhs.interval == self.nsubsteps
+
+    def eval_rhs(self, rhs, t, states):
+        return var(rhs.func_name)(t=t, **dict(
+            (self.comp_name_to_kwarg_name[arg_comp_name], states[arg_comp_name])
+            for arg_comp_name in rhs.arguments))
+
+    def generate(self):
+        """
+        :returns: :class:`dagrt.language.DAGCode`
+        """
+        if self.rolled_fast_steps:
+            return self.generate_rolled()
+
+        with CodeBuilder(name="primary") as cb:
+            self.emit_step(cb)
+
+        return DAGCode(
+                phases={
+                    "primary": cb.as_execution_phase(next_phase="primary")
+                    },
+                initial_phase="primary")
+
+    def get_nfast_steps(self, delta_c):
+        return max(1, int(ceil(self.nsubsteps * delta_c - 1e-12)))
+
+    def get_forcing_coeffs(self, istage, slow_rhss):
+        """Return the coefficients of :math:`\\tau^k` in the forcing of the
+        fast problem of stage *istage*, in terms of the scaled time
+        :math:`\\tau = \\theta/H`, by component name.
+        """
+        return dict(
+                (comp_name, [
+                    sum(
+                        gamma_k[istage][j] * slow_rhss[j][comp_name]
+                        for j in range(istage + 1)
+                        if comp_name in slow_rhss[j])
+                    for gamma_k in self.gamma])
+                for comp_name in self.component_names
+                if comp_name in slow_rhss[istage])
+
+    def emit_slow_rhss(self, cb, istage, stage_t, states, slow_rhs_name):
+        stage_slow_rhss = {}
+        for comp_name, component_rhss in zip(
+                self.component_names, self.rhss):
+            contribs = [
+                    self.eval_rhs(rhs, stage_t, states)
+                    for rhs in component_rhss
+                    if self.is_slow(rhs)]
+            if not contribs:
+                continue
+
+            slow_rhs = slow_rhs_name(comp_name, istage)
+            cb(slow_rhs, sum(contribs))
+            stage_slow_rhss[comp_name] = slow_rhs
+
+        return stage_slow_rhss
+
+    def emit_step(self, cb):
+        nstages = len(self.c) - 1
+
+        stage_states = dict(self.state_vars)
+
+        # slow_rhss[j][comp_name]: the slow right-hand side of the
+        # component at stage j
+        slow_rhss = []
+
+        for i in range(nstages):
+            stage_t = self.t + self.c[i] * self.dt
+
+            slow_rhss.append(self.emit_slow_rhss(cb, i, stage_t, stage_states,
+                lambda comp_name, istage: cb.fresh_var(
+                    "slow_rhs_%s_st%d" % (comp_name, istage))))
+            forcing_coeffs = self.get_forcing_coeffs(i, slow_rhss)
+
+            stage_states = self.emit_fast_problem(cb, i, stage_t,
+                    self.c[i + 1] - self.c[i], stage_states, forcing_coeffs)
+
+        for comp_name in self.component_names:
+            cb.yield_state(stage_states[comp_name], comp_name,
+                    self.t + self.dt, "final")
+
+        for comp_name in self.component_names:
+            cb(self.state_vars[comp_name], stage_states[comp_name])
+
+        cb(self.t, self.t + self.dt)
+
+    def emit_fast_problem(self, cb, istage, stage_t, delta_c, states,
+            forcing_coeffs):
+        """Integrate the fast problem of stage *istage* starting from
+        *states* and return the states at its end.
+        """
+        if delta_c == 0:
+            return self.emit_slow_update(cb, istage, states, forcing_coeffs)
+
+        nfast_steps = self.get_nfast_steps(delta_c)
+        for istep in range(nfast_steps):
+            states = self.emit_fast_step(cb, istage, istep, nfast_steps,
+                    stage_t, delta_c, states, forcing_coeffs, str(istep))
+
+        return states
+
+    def emit_slow_update(self, cb, istage, states, forcing_coeffs):
+        """Return the states at the end of stage *istage* with
+        :math:`\\Delta c_i = 0`, to which only the slow right-hand sides
+        contribute.
+        """
+        new_states = {}
+        for comp_name in self.component_names:
+            coeffs = forcing_coeffs.get(comp_name)
+            if coeffs is None:
+                new_states[comp_name] = states[comp_name]
+                continue
+
+            new_state = cb.fresh_var("state_%s_st%d" % (comp_name, istage))
+            cb(new_state, self.filter_state(comp_name,
+                states[comp_name] + self.dt * sum(
+                    coeff / (k + 1) for k, coeff in enumerate(coeffs))))
+            new_states[comp_name] = new_state
+
+        return new_states
+
+    def emit_fast_step(self, cb, istage, istep, nfast_steps, stage_t, delta_c,
+            states, forcing_coeffs, step_name):
+        """Take fast step number *istep*, which may be an expression, of the
+        fast problem of stage *istage* from *states* and return the states
+        at its end.
+        """
+        def forcing(comp_name, tau):
+            coeffs = forcing_coeffs.get(comp_name)
+            if coeffs is None:
+                return 0
+            return sum(coeff * tau**k for k, coeff in enumerate(coeffs))
+
+        fast_c = self.fast_method.c
+        fast_a = self.fast_method.a_explicit
+        fast_b = self.fast_method.output_coeffs
+
+        # the fast problem in terms of theta has the step size H/nfast_steps
+        h = self.dt / nfast_steps
+
+        stage_derivs = []
+        for ifast_stage, (c, coeffs) in enumerate(zip(fast_c, fast_a)):
+            if ifast_stage == 0:
+                fast_stage_states = states
+            else:
+                fast_stage_states = {}
+                for comp_name in self.component_names:
+                    stage_state = cb.fresh_var("state_%s_st%d_sub%s_%d"
+                            % (comp_name, istage, step_name, ifast_stage))
+                    cb(stage_state, self.filter_state(comp_name,
+                        states[comp_name] + h * sum(
+                            coeff * derivs[comp_name]
+                            for coeff, derivs in zip(coeffs, stage_derivs)
+                            if coeff)))
+                    fast_stage_states[comp_name] = stage_state
+
+            tau = (istep + c) / nfast_steps
+            fast_t = stage_t + delta_c * tau * self.dt
+
+            derivs = {}
+            for comp_name, component_rhss in zip(
+                    self.component_names, self.rhss):
+                deriv = cb.fresh_var("fast_rhs_%s_st%d_sub%s_%d"
+                        % (comp_name, istage, step_name, ifast_stage))
+                cb(deriv, delta_c * sum(
+                    self.eval_rhs(rhs, fast_t, fast_stage_states)
+                    for rhs in component_rhss
+                    if not self.is_slow(rhs)) + forcing(comp_name, tau))
+                derivs[comp_name] = deriv
+
+            stage_derivs.append(derivs)
+
+        new_states = {}
+        for comp_name in self.component_names:
+            new_state = cb.fresh_var("state_%s_st%d_sub%s"
+                    % (comp_name, istage, step_name))
+            cb(new_state, self.filter_state(comp_name,
+                states[comp_name] + h * sum(
+                    coeff * derivs[comp_name]
+                    for coeff, derivs in zip(fast_b, stage_derivs)
+                    if coeff)))
+            new_states[comp_name] = new_state
+
+        return new_states
+
+    # {{{ rolled fast steps
+
+    def generate_rolled(self):
+        """Generate the code for *rolled_fast_steps*."""
+        nstages = len(self.c) - 1
+
+        def phase_name(istage):
+            if istage == 0:
+                return "primary"
+            return "stage%d" % istage
+
+        with CodeBuilder(name="initialization") as cb_init:
+            cb_init(self.fast_step, 0)
+
+        phases = {
+                "initialization": cb_init.as_execution_phase(
+                    next_phase="primary"),
+                }
+
+        for istage in range(nstages):
+            with CodeBuilder(name=phase_name(istage)) as cb:
+                self.emit_rolled_stage(cb, istage,
+                        phase_name((istage + 1) % nstages))
+
+            phases[phase_name(istage)] = cb.as_execution_phase(
+                    next_phase=phase_name(istage))
+
+        return DAGCode(phases=phases, initial_phase="initialization")
+
+    @property
+    def fast_step(self):
+        return var("<p>fast_step")
+
+    def emit_rolled_stage(self, cb, istage, next_phase):
+        """Emit a single fast step of stage *istage*, which is repeated
+        until the fast problem of the stage is solved. The slow right-hand
+        sides of the stage are evaluated at its first fast step and kept in
+        persistent variables for the later stages.
+        """
+        stage_t = self.t + self.c[istage] * self.dt
+        delta_c = self.c[istage + 1] - self.c[istage]
+
+        def slow_rhs_name(comp_name, istage):
+            return var("<p>slow_rhs_%s_st%d" % (comp_name, istage))
+
+        slow_rhss = [
+                dict(
+                    (comp_name, slow_rhs_name(comp_name, j))
+                    for comp_name, component_rhss in zip(
+                        self.component_names, self.rhss)
+                    if any(self.is_slow(rhs) for rhs in component_rhss))
+                for j in range(istage + 1)]
+        forcing_coeffs = self.get_forcing_coeffs(istage, slow_rhss)
+
+        with cb.if_(self.fast_step, "==", 0):
+            self.emit_slow_rhss(cb, istage, stage_t, self.state_vars,
+                    slow_rhs_name)
+
+        if delta_c == 0:
+            new_states = self.emit_slow_update(cb, istage, self.state_vars,
+                    forcing_coeffs)
+            nfast_steps = 1
+        else:
+            nfast_steps = self.get_nfast_steps(delta_c)
+            new_states = self.emit_fast_step(cb, istage, self.fast_step,
+                    nfast_steps, stage_t, delta_c, self.state_vars,
+                    forcing_coeffs, "roll")
+
+        for comp_name in self.component_names:
+            if new_states[comp_name] != self.state_vars[comp_name]:
+                cb(self.state_vars[comp_name], new_states[comp_name])
+
+        cb(self.fast_step, self.fast_step + 1)
+
+        with cb.if_(self.fast_step, "==", nfast_steps):
+            cb(self.fast_step, 0)
+
+            if istage == len(self.c) - 2:
+                for comp_name in self.component_names:
+                    cb.yield_state(self.state_vars[comp_name], comp_name,
+                            self.t + self.dt, "final")
+
+                cb(self.t, self.t + self.dt)
+
+            cb.switch_phase(next_phase)
+
+    # }}}
+
+    def filter_state(self, comp_name, expr):
+        if comp_name in self.state_filters:
+            return self.state_filters[comp_name](expr)
+        return expr
+
+
+# {{{ concrete methods
+
+class MRIGARKERK22aMethodBuilder(MRIGARKMethodBuilder):
+    """Second-order MRI-GARK method ERK22a of Sandu, based on the explicit
+    midpoint rule.
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    order = 2
+    c = (0, 1/2, 1)
+    gamma = (
+            (
+                (1/2, 0),
+                (-1/2, 1),
+                ),
+            )
+
+
+class MRIGARKERK22bMethodBuilder(MRIGARKMethodBuilder):
+    """Second-order MRI-GARK method ERK22b of Sandu, based on Heun's method.
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    order = 2
+    c = (0, 1, 1)
+    gamma = (
+            (
+                (1, 0),
+                (-1/2, 1/2),
+                ),
+            )
+
+
+class MRIGARKERK33aMethodBuilder(MRIGARKMethodBuilder):
+    """Third-order MRI-GARK method ERK33a of Sandu, with
+    :math:`\\delta = -1/2`.
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    order = 3
+    c = (0, 1/3, 2/3, 1)
+    gamma = (
+            (
+                (1/3, 0, 0),
+                (-1/3, 2/3, 0),
+                (0, -2/3, 1),
+                ),
+            (
+                (0, 0, 0),
+                (0, 0, 0),
+                (1/2, 0, -1/2),
+                ),
+            )
+
+
+class MISMethodBuilder(MRIGARKMethodBuilder):
+    """Multirate infinitesimal step methods of O. Knoth and R. Wolke,
+    Implicit-explicit Runge-Kutta methods for computing atmospheric reactive
+    flows, Appl. Numer. Math. 28 (1998), based on an explicit Runge-Kutta
+    method with nondecreasing abscissae for the slow right-hand sides. The
+    slow forcing of the fast problem is constant in each stage, i.e.
+    :math:`\\gamma_{i,j} = a_{i+1,j} - a_{i,j}`, where :math:`a_{s+1,j}`
+    are the weights of the method. These methods are of second order.
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    order = 2
+
+    def __init__(self, system_description, slow_method=None, fast_method=None,
+            state_filter_names=None, component_arg_names=None,
+            rolled_fast_steps=False):
+        """
+        :arg slow_method: A subclass of
+            :class:`leap.rk.ButcherTableauMethodBuilder` with an explicit
+            tableau of order at least 2, by default
+            :class:`leap.rk.RK3MethodBuilder`.
+        """
+        if slow_method is None:
+            from leap.rk import RK3MethodBuilder
+            slow_method = RK3MethodBuilder
+
+        c = tuple(slow_method.c) + (1,)
+        if any(c_next < c_prev for c_prev, c_next in zip(c, c[1:])):
+            raise ValueError("abscissae of the slow method must be "
+                    "nondecreasing")
+
+        nstages = len(slow_method.c)
+        a = [
+                tuple(row) + (0,) * (nstages - len(row))
+                for row in slow_method.a_explicit]
+        a.append(tuple(slow_method.output_coeffs))
+
+        self.c = c
+        self.gamma = (
+                tuple(
+                    tuple(a[i + 1][j] - a[i][j] for j in range(nstages))
+                    for i in range(nstages)),
+                )
+
+        super(MISMethodBuilder, self).__init__(system_description,
+                fast_method=fast_method,
+                state_filter_names=state_filter_names,
+                component_arg_names=component_arg_names,
+                rolled_fast_steps=rolled_fast_steps)
+
+# }}}
+
+# vim: foldmethod=marker
@@ -0,0 +1,345 @@
+"""Stabilized explicit Runge-Kutta methods."""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from pymbolic import var
+
+from dagrt.language import CodeBuilder, DAGCode
+from leap import MethodBuilder
+
+
+__doc__ = """
+Runge-Kutta-Chebyshev Methods
+-----------------------------
+
+.. autoclass:: RKCMethodBuilder
+.. autoclass:: RKC1MethodBuilder
+.. autoclass:: RKC2MethodBuilder
+.. autoexception:: StageLimitExceeded
+"""
+
+
+class StageLimitExceeded(RuntimeError):
+    """Raised by the generated code if a step needs more than *max_stages*
+    stages to be stable.
+    """
+
+
+class RKCMethodBuilder(MethodBuilder):
+    """Runge-Kutta-Chebyshev methods, whose stability polynomials are
+    shifted and scaled Chebyshev polynomials. The real stability interval
+    grows quadratically with the number of stages *s*, so that mildly stiff,
+    diffusion-dominated problems can be stepped without a linear solve.
+
+    The number of stages is chosen at the start of each step from an
+    estimate of the spectral radius of the Jacobian of the right-hand side,
+    between :attr:`min_stages` and *max_stages*. If more than *max_stages*
+    stages are needed, the step raises :exc:`StageLimitExceeded` instead of
+    being taken unstably. Code is generated for *max_stages* stages, and the
+    stages beyond *s* are skipped. The stages are computed by a three-term
+    recurrence, so that only the two previous stages and the start of the
+    step need to be kept.
+
+    User-supplied context:
+        <state> + component_id: The value that is integrated
+        <func> + component_id: The right hand side function
+        <func>spectral_radius_ + component_id: An upper bound on the
+            spectral radius of the Jacobian of the right hand side, called
+            with the same arguments as the right hand side.
+
+    See B. P. Sommeijer, L. F. Shampine, J. G. Verwer, RKC: An explicit
+    solver for parabolic PDEs, J. Comput. Appl. Math. 88 (1997).
+
+    .. attribute:: min_stages
+    .. attribute:: damping
+
+        The damping parameter :math:`\\epsilon` of the shift
+        :math:`w_0 = 1 + \\epsilon/s^2`.
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    def __init__(self, component_id, max_stages=20, damping=None,
+            rhs_func_name=None, spectral_radius_func_name=None):
+        """
+        :arg max_stages: The largest number of stages that may be used.
+        :arg damping: Overrides :attr:`damping`.
+        """
+        if max_stages < self.min_stages:
+            raise ValueError("max_stages must be at least %d"
+                    % self.min_stages)
+
+        self.component_id = component_id
+        self.max_stages = max_stages
+
+        if damping is not None:
+            self.damping = damping
+
+        if rhs_func_name is None:
+            rhs_func_name = "<func>" + component_id
+        self.rhs_func_name = rhs_func_name
+
+        if spectral_radius_func_name is None:
+            spectral_radius_func_name = "<func>spectral_radius_" + component_id
+        self.spectral_radius_func_name = spectral_radius_func_name
+
+        self.dt = var("<dt>")
+        self.t = var("<t>")
+        self.state = var("<state>" + component_id)
+
+    def eval_rhs(self, t, y):
+        return var(self.rhs_func_name)(t=t, **{self.component_id: y})
+
+    def stage_count_bound(self, dt_times_radius):
+        """Return an expression for the square of the largest stage
+        index beyond :attr:`min_stages` that is still needed for stability.
+        """
+        raise NotImplementedError
+
+    def emit_coefficients(self, cb, nstages, w0, cheb):
+        """Emit the recurrence coefficients, given the Chebyshev polynomials
+        and their first two derivatives *cheb* at *w0*.
+
+        :returns: a tuple of lists *(mu, nu, mu_tilde, gamma_tilde, c)*
+            indexed by stage number, where stage *j* is given by
+
+            .. math::
+
+                Y_j = (1-\\mu_j-\\nu_j) Y_0 + \\mu_j Y_{j-1} + \\nu_j Y_{j-2}
+                + \\tilde\\mu_j h F(Y_{j-1}) + \\tilde\\gamma_j h F(Y_0),
+
+            and *c* holds the relative stage times.
+        """
+        raise NotImplementedError
+
+    def emit_chebyshev(self, cb, w0):
+        """Emit :math:`T_j(w_0)`, :math:`T'_j(w_0)` and :math:`T''_j(w_0)`
+        for all *j* up to *max_stages*.
+        """
+        values = [1, w0]
+        derivs = [0, 1]
+        second_derivs = [0, 0]
+
+        for j in range(2, self.max_stages + 1):
+            value = cb.fresh_var("cheb_T%d" % j)
+            deriv = cb.fresh_var("cheb_dT%d" % j)
+            second_deriv = cb.fresh_var("cheb_ddT%d" % j)
+
+            cb(value, 2*w0*values[-1] - values[-2])
+            cb(deriv, 2*values[-1] + 2*w0*derivs[-1] - derivs[-2])
+            cb(second_deriv,
+                    4*derivs[-1] + 2*w0*second_derivs[-1] - second_derivs[-2])
+
+            values.append(value)
+            derivs.append(deriv)
+            second_derivs.append(second_deriv)
+
+        return values, derivs, second_derivs
+
+    def select_stage_value(self, cb, nstages, values, name):
+        """Emit a variable that holds *values[nstages]*."""
+        result = cb.fresh_var(name)
+        cb(result, values[self.min_stages])
+
+        for j in range(self.min_stages + 1, self.max_stages + 1):
+            with cb.if_(nstages, "==", j):
+                cb(result, values[j])
+
+        return result
+
+    def generate(self):
+        """
+        :returns: :class:`dagrt.language.DAGCode`
+        """
+        with CodeBuilder(name="primary") as cb:
+            self.emit_step(cb)
+
+        return DAGCode(
+                phases={
+                    "primary": cb.as_execution_phase(next_phase="primary")
+                    },
+                initial_phase="primary")
+
+    def emit_step(self, cb):
+        nstages = var("rkc_nstages")
+        radius = var("rkc_spectral_radius")
+
+        # {{{ choose the number of stages
+
+        cb(radius, var(self.spectral_radius_func_name)(
+            t=self.t, **{self.component_id: self.state}))
+
+        bound = cb.fresh_var("rkc_stage_bound")
+        cb(bound, self.stage_count_bound(self.dt * radius))
+
+        with cb.if_(bound, ">", (self.max_stages - 1)**2):
+            cb.raise_(StageLimitExceeded,
+                    "RKC: the step needs more than %d stages to be stable"
+                    % self.max_stages)
+
+        cb(nstages, self.min_stages)
+        for j in range(self.min_stages + 1, self.max_stages + 1):
+            with cb.if_((j - 1)**2, "<=", bound):
+                cb(nstages, j)
+
+        # }}}
+
+        w0 = cb.fresh_var("rkc_w0")
+        cb(w0, 1 + self.damping / nstages**2)
+
+        mu, nu, mu_tilde, gamma_tilde, c = self.emit_coefficients(
+                cb, nstages, w0, self.emit_chebyshev(cb, w0))
+
+        # {{{ stage recurrence
+
+        y_start = self.state
+        rhs_start = var("rkc_rhs_start")
+        y_prev = var("rkc_y_prev")
+        y_prev2 = var("rkc_y_prev2")
+        y_cur = var("rkc_y_cur")
+
+        cb(rhs_start, self.eval_rhs(self.t, y_start))
+        cb(y_cur, y_start + mu_tilde[1] * self.dt * rhs_start)
+
+        def emit_stage(j):
+            cb(y_prev2, y_prev)
+            cb(y_prev, y_cur)
+            cb(y_cur,
+                    (1 - mu[j] - nu[j]) * y_start
+                    + mu[j] * y_prev
+                    + nu[j] * y_prev2
+                    + mu_tilde[j] * self.dt
+                    * self.eval_rhs(self.t + c[j-1] * self.dt, y_prev)
+                    + gamma_tilde[j] * self.dt * rhs_start)
+
+        cb(y_prev, y_start)
+        for j in range(2, self.max_stages + 1):
+            if j <= self.min_stages:
+                emit_stage(j)
+            else:
+                with cb.if_(nstages, ">=", j):
+                    emit_stage(j)
+
+        # }}}
+
+        cb(self.state, y_cur)
+        cb.yield_state(self.state, self.component_id, self.t + self.dt, "final")
+        cb(self.t, self.t + self.dt)
+
+
+# {{{ concrete methods
+
+class RKC1MethodBuilder(RKCMethodBuilder):
+    """First-order damped Runge-Kutta-Chebyshev method, with stability
+    polynomial :math:`T_s(w_0 + w_1 z)/T_s(w_0)`. Its real stability interval
+    is about :math:`2s^2`.
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    min_stages = 1
+    damping = 0.05
+
+    def stage_count_bound(self, dt_times_radius):
+        # The stability interval is about 2 s**2 (1 - 4 damping/3).
+        return dt_times_radius / (1.9 * (1 - 4*self.damping/3))
+
+    def emit_coefficients(self, cb, nstages, w0, cheb):
+        values, derivs, _ = cheb
+
+        w1 = cb.fresh_var("rkc_w1")
+        cb(w1,
+                self.select_stage_value(cb, nstages, values, "rkc_Ts")
+                / self.select_stage_value(cb, nstages, derivs, "rkc_dTs"))
+
+        mu = [None, None]
+        nu = [None, None]
+        mu_tilde = [None, w1/w0]
+        gamma_tilde = [None, None]
+        c = [0]
+
+        for j in range(1, self.max_stages + 1):
+            c.append(w1 * derivs[j] / values[j])
+
+            if j >= 2:
+                # b_j = 1/T_j(w0)
+                mu.append(2 * w0 * values[j-1] / values[j])
+                nu.append(-values[j-2] / values[j])
+                mu_tilde.append(2 * w1 * values[j-1] / values[j])
+                gamma_tilde.append(0)
+
+        return mu, nu, mu_tilde, gamma_tilde, c
+
+
+class RKC2MethodBuilder(RKCMethodBuilder):
+    """Second-order Runge-Kutta-Chebyshev method of Sommeijer, Shampine and
+    Verwer. Its real stability interval is about :math:`0.65 s^2`.
+
+    .. automethod:: __init__
+    .. automethod:: generate
+    """
+
+    min_stages = 2
+    damping = 2/13
+
+    def stage_count_bound(self, dt_times_radius):
+        # from Sommeijer, Shampine, Verwer, Section 4.3
+        return 1 + 1.54 * dt_times_radius
+
+    def emit_coefficients(self, cb, nstages, w0, cheb):
+        values, derivs, second_derivs = cheb
+
+        w1 = cb.fresh_var("rkc_w1")
+        cb(w1,
+                self.select_stage_value(cb, nstages, derivs, "rkc_dTs")
+                / self.select_stage_value(cb, nstages, second_derivs,
+                    "rkc_ddTs"))
+
+        # b_j = T_j''(w0)/T_j'(w0)**2 for j >= 2, b_0 = b_1 = b_2
+        b = [second_derivs[j] / derivs[j]**2
+                for j in range(2, self.max_stages + 1)]
+        b = [b[0], b[0]] + b
+
+        mu = [None, None]
+        nu = [None, None]
+        mu_tilde = [None, b[1] * w1]
+        gamma_tilde = [None, None]
+        c = [0, b[1] * w1]
+
+        for j in range(2, self.max_stages + 1):
+            c.append(w1 * second_derivs[j] / derivs[j])
+
+            mu.append(2 * b[j] * w0 / b[j-1])
+            nu.append(-b[j] / b[j-2])
+            mu_tilde.append(2 * b[j] * w1 / b[j-1])
+            gamma_tilde.append(-(1 - b[j-1] * values[j-1]) * mu_tilde[j])
+
+        return mu, nu, mu_tilde, gamma_tilde, c
+
+# }}}
+
+# vim: foldmethod=marker
@@ -0,0 +1,840 @@
+"""Stability sweeps for two-rate Adams-Bashforth methods."""
+
+from __future__ import division, print_function
+
+__copyright__ = "Copyright (C) 2020 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import numpy as np
+import numpy.linalg as la
+from pytools import Record
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+__doc__ = """
+Tools to find the largest stable time step of
+:class:`leap.multistep.multirate.TwoRateAdamsBashforthMethodBuilder` methods
+applied to two-component linear test problems
+
+.. math::
+
+    \\begin{bmatrix} \\dot f \\\\ \\dot s \\end{bmatrix}
+    = \\begin{bmatrix} a_{ff} & a_{sf} \\\\ a_{fs} & a_{ss} \\end{bmatrix}
+    \\begin{bmatrix} f \\\\ s \\end{bmatrix},
+
+over grids of methods and matrices. The stability of each pair is decided
+from the eigenvalues of the symbolic step matrix found by
+:class:`leap.step_matrix.StepMatrixFinder`.
+
+Matrices
+--------
+
+.. autoclass:: MatrixFactory
+.. autoclass:: DecayMatrixFactory
+.. autoclass:: DecayOscillationMatrixFactory
+.. autoclass:: OscillationDecayMatrixFactory
+.. autoclass:: OscillationMatrixFactory
+
+.. autofunction:: make_matrices
+.. autofunction:: generate_matrix_factories
+.. autofunction:: generate_matrix_factories_hires
+
+Methods
+-------
+
+.. autoclass:: MethodFactory
+
+.. autofunction:: generate_method_factories
+.. autofunction:: generate_method_factories_hires
+
+Sweeps
+------
+
+.. autofunction:: get_step_matrix_evaluator
+.. autofunction:: find_stable_dts
+.. autofunction:: find_stable_dt
+.. autoclass:: ResultStore
+.. autofunction:: run_stability_sweep
+"""
+
+
+# {{{ factories
+
+class FactoryWithParameters(Record):
+    """A :class:`pytools.Record` whose fields describe a point in a
+    parameter sweep.
+
+    .. automethod:: get_parameter_dict
+    """
+
+    def get_parameter_dict(self):
+        return dict(
+                (field, getattr(self, field))
+                for field in self.__class__.fields)
+
+# }}}
+
+
+# {{{ matrices
+
+class MatrixFactory(FactoryWithParameters):
+    """Builds a real or complex :math:`2 \\times 2` matrix from its two
+    eigenvalues :math:`(-1, -\\mu)` and the eigenvectors
+    :math:`(\\cos \\alpha, \\sin \\alpha)` and
+    :math:`(\\cos(\\alpha+\\beta), \\sin(\\alpha+\\beta))`.
+
+    .. attribute:: ratio
+
+        The ratio :math:`\\mu` of the magnitudes of the eigenvalues.
+
+    .. attribute:: angle
+
+        The angle :math:`\\alpha` of the first eigenvector.
+
+    .. attribute:: offset
+
+        The angle :math:`\\beta` between the eigenvectors.
+
+    .. automethod:: get_eigenvalues
+    .. automethod:: make_matrices
+    .. automethod:: __call__
+    """
+
+    def __init__(self, ratio, angle, offset):
+        super(MatrixFactory, self).__init__(
+                ratio=ratio, angle=angle, offset=offset)
+
+    def get_parameter_dict(self):
+        result = super(MatrixFactory, self).get_parameter_dict()
+        result["mat_type"] = type(self).__name__
+        return result
+
+    @staticmethod
+    def get_eigenvalues(ratio):
+        """Return the eigenvalues for an array of ratios, in an array with
+        one more trailing axis of length 2.
+        """
+        ratio = np.asarray(ratio)
+        return np.stack([-np.ones_like(ratio), -ratio], axis=-1)
+
+    @classmethod
+    def make_matrices(cls, ratio, angle, offset):
+        """Return the matrices for arrays *ratio*, *angle* and *offset* that
+        broadcast to a shape *shape*, as an array of shape ``shape + (2, 2)``.
+        """
+        ratio, angle, offset = np.broadcast_arrays(ratio, angle, offset)
+
+        evmat = np.empty(ratio.shape + (2, 2))
+        evmat[..., 0, 0] = np.cos(angle)
+        evmat[..., 0, 1] = np.cos(angle + offset)
+        evmat[..., 1, 0] = np.sin(angle)
+        evmat[..., 1, 1] = np.sin(angle + offset)
+
+        eigvals = cls.get_eigenvalues(ratio)
+        diag = np.zeros(ratio.shape + (2, 2), dtype=eigvals.dtype)
+        diag[..., 0, 0] = eigvals[..., 0]
+        diag[..., 1, 1] = eigvals[..., 1]
+
+        return cls._diagonalize(evmat, diag)
+
+    @staticmethod
+    def _diagonalize(evmat, diag):
+        return la.solve(evmat, diag) @ evmat
+
+    def __call__(self):
+        """Return the matrix as a :class:`numpy.ndarray` of shape ``(2, 2)``.
+        """
+        return self.make_matrices(self.ratio, self.angle, self.offset)
+
+
+class DecayMatrixFactory(MatrixFactory):
+    """Eigenvalues :math:`(-1, -\\mu)`."""
+
+
+class DecayOscillationMatrixFactory(MatrixFactory):
+    """Eigenvalues :math:`(-1, i\\mu)`."""
+
+    @staticmethod
+    def get_eigenvalues(ratio):
+        ratio = np.asarray(ratio)
+        return np.stack([-np.ones_like(ratio), 1j*ratio], axis=-1)
+
+
+class OscillationDecayMatrixFactory(MatrixFactory):
+    """Eigenvalues :math:`(i, -\\mu)`."""
+
+    @staticmethod
+    def get_eigenvalues(ratio):
+        ratio = np.asarray(ratio)
+        return np.stack([1j*np.ones_like(ratio), -ratio], axis=-1)
+
+
+class OscillationMatrixFactory(MatrixFactory):
+    """Eigenvalues :math:`(i, i\\mu)`."""
+
+    @staticmethod
+    def get_eigenvalues(ratio):
+        ratio = np.asarray(ratio)
+        return np.stack([1j*np.ones_like(ratio), 1j*ratio], axis=-1)
+
+    @staticmethod
+    def _diagonalize(evmat, diag):
+        # The original study diagonalized this one with the eigenvectors in
+        # the rows rather than the columns. Kept for comparable tables.
+        return evmat @ la.solve(evmat.swapaxes(-1, -2), diag).swapaxes(-1, -2)
+
+
+MATRIX_FACTORY_CLASSES = (
+        DecayMatrixFactory,
+        OscillationMatrixFactory,
+        OscillationDecayMatrixFactory,
+        DecayOscillationMatrixFactory,
+        )
+
+
+def make_matrices(matrix_facs):
+    """Return the matrices of a sequence of :class:`MatrixFactory` instances
+    as one complex array of shape ``(len(matrix_facs), 2, 2)``. Matrices of
+    the same type are built in one batch by :meth:`MatrixFactory.make_matrices`.
+    """
+    result = np.empty((len(matrix_facs), 2, 2), dtype=np.complex128)
+
+    indices_by_type = {}
+    for i, matrix_fac in enumerate(matrix_facs):
+        indices_by_type.setdefault(type(matrix_fac), []).append(i)
+
+    for cls, indices in indices_by_type.items():
+        result[indices] = cls.make_matrices(*(
+            np.array([getattr(matrix_facs[i], field) for i in indices])
+            for field in ["ratio", "angle", "offset"]))
+
+    return result
+
+
+def generate_matrix_factories(angle_steps=20, offset_steps=20, ratio_steps=10):
+    """Generate :class:`MatrixFactory` instances of each type on a grid of
+    *angle_steps* angles in :math:`[0, \\pi)`, *offset_steps* offsets in
+    :math:`[\\pi/n, \\pi)` and *ratio_steps* ratios in :math:`[0.1, 1]`.
+    """
+    from math import pi
+
+    for angle in np.linspace(0, pi, angle_steps, endpoint=False):
+        for offset in np.linspace(
+                pi/offset_steps, pi, offset_steps, endpoint=False):
+            for ratio in np.linspace(0.1, 1, ratio_steps):
+                for cls in MATRIX_FACTORY_CLASSES:
+                    yield cls(ratio=ratio, angle=angle, offset=offset)
+
+
+def generate_matrix_factories_hires():
+    """Like :func:`generate_matrix_factories`, but for three angles and on a
+    fine grid of :math:`100 \\times 100` offsets and ratios.
+    """
+    from math import pi
+
+    offset_steps = 100
+    for angle in [0, 0.05*pi, 0.1*pi]:
+        for offset in np.linspace(
+                pi/offset_steps, pi, offset_steps, endpoint=False):
+            for ratio in np.linspace(0.1, 1, 100):
+                for cls in MATRIX_FACTORY_CLASSES:
+                    yield cls(ratio=ratio, angle=angle, offset=offset)
+
+# }}}
+
+
+# {{{ methods
+
+class MethodFactory(FactoryWithParameters):
+    """Builds a
+    :class:`~leap.multistep.multirate.TwoRateAdamsBashforthMethodBuilder`
+    with a static time step and component names ``f`` and ``s``.
+
+    .. attribute:: method
+
+        One of :attr:`TwoRateAdamsBashforthMethodBuilder.methods`.
+
+    .. attribute:: substep_count
+
+        The step ratio.
+
+    .. attribute:: meth_order
+
+    .. automethod:: __call__
+    """
+
+    def __init__(self, method, substep_count, meth_order):
+        super(MethodFactory, self).__init__(
+                method=method, substep_count=substep_count,
+                meth_order=meth_order)
+
+    def __call__(self):
+        import warnings
+        from leap.multistep.multirate import TwoRateAdamsBashforthMethodBuilder
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            return TwoRateAdamsBashforthMethodBuilder(
+                    method=self.method,
+                    order=self.meth_order,
+                    step_ratio=self.substep_count,
+                    static_dt=True)
+
+
+def generate_method_factories(orders=(3,), substep_counts=(2, 3, 4)):
+    """Generate a :class:`MethodFactory` for each two-rate method, order and
+    step ratio.
+    """
+    from leap.multistep.multirate import TwoRateAdamsBashforthMethodBuilder
+
+    for method in TwoRateAdamsBashforthMethodBuilder.methods:
+        for order in orders:
+            for substep_count in substep_counts:
+                yield MethodFactory(method=method, meth_order=order,
+                        substep_count=substep_count)
+
+
+def generate_method_factories_hires():
+    for method in ["Fq", "Ssf", "Sr"]:
+        for substep_count in [2, 5, 10]:
+            yield MethodFactory(method=method, meth_order=3,
+                    substep_count=substep_count)
+
+# }}}
+
+
+# {{{ stable time step search
+
+def get_step_matrix_evaluator(method_fac):
+    """Return a function that evaluates the step matrix of the ``primary``
+    phase of the method built by *method_fac* for many coefficients at once.
+
+    The function takes a dictionary with keys ``<dt>``, ``f2f``, ``s2f``,
+    ``f2s`` and ``s2s`` whose values are arrays of shape ``(n,)``, and
+    returns an array of shape ``(n, m, m)``. See
+    :func:`leap.step_matrix.make_multirate_step_matrix_evaluator`.
+    """
+    from leap.step_matrix import make_multirate_step_matrix_evaluator
+
+    return make_multirate_step_matrix_evaluator(method_fac(), couplings={
+        "<func>f2f": ["fast"],
+        "<func>s2f": ["slow"],
+        "<func>f2s": ["fast"],
+        "<func>s2s": ["slow"],
+        })
+
+
+def _get_max_eigenvalue_magnitudes(evaluate_mat, mats, dts):
+    step_matrices = evaluate_mat({
+            "<dt>": dts,
+            "f2f": mats[:, 0, 0],
+            "s2f": mats[:, 0, 1],
+            "f2s": mats[:, 1, 0],
+            "s2s": mats[:, 1, 1],
+            })
+
+    return np.max(np.abs(la.eigvals(step_matrices)), axis=-1)
+
+
+def find_stable_dts(evaluate_mat, mats, prec=1e-8):
+    """Find the largest stable time step for each linear system in *mats*,
+    an array of shape ``(n, 2, 2)``, to within *prec*.
+
+    A time step is stable if the spectral radius of the step matrix is at
+    most one. Starting from :math:`\\Delta t = 0.1`, the search goes up or
+    down in powers of two until the stability changes, and the bracket is
+    then bisected. The search returns early with the first stable time step
+    above :math:`2^8`, or with zero if no time step down to *prec* is
+    stable. All systems are processed in lockstep, so that each iteration
+    evaluates and diagonalizes a single stack of step matrices.
+
+    :arg evaluate_mat: as returned by :func:`get_step_matrix_evaluator`.
+    :returns: an array of shape ``(n,)``.
+    """
+    mats = np.asarray(mats)
+    nmats = len(mats)
+
+    def is_stable(dts, indices):
+        return _get_max_eigenvalue_magnitudes(
+                evaluate_mat, mats[indices], dts) <= 1
+
+    result = np.empty(nmats)
+    done = np.zeros(nmats, dtype=bool)
+
+    dt = np.full(nmats, 0.1)
+    stable = np.zeros(nmats)
+    unstable = np.zeros(nmats)
+
+    initially_stable = is_stable(dt, np.arange(nmats))
+
+    # {{{ grow stable time steps
+
+    stable[initially_stable] = dt[initially_stable]
+    indices = np.flatnonzero(initially_stable)
+
+    while len(indices):
+        dt[indices] *= 2
+        is_dt_stable = is_stable(dt[indices], indices)
+
+        unstable[indices[~is_dt_stable]] = dt[indices[~is_dt_stable]]
+
+        indices = indices[is_dt_stable]
+        stable[indices] = dt[indices]
+
+        too_large = indices[dt[indices] > 2**8]
+        result[too_large] = dt[too_large]
+        done[too_large] = True
+
+        indices = indices[dt[indices] <= 2**8]
+
+    # }}}
+
+    # {{{ shrink unstable time steps
+
+    unstable[~initially_stable] = dt[~initially_stable]
+    indices = np.flatnonzero(~initially_stable)
+
+    while len(indices):
+        dt[indices] /= 2
+        is_dt_stable = is_stable(dt[indices], indices)
+
+        stable[indices[is_dt_stable]] = dt[indices[is_dt_stable]]
+
+        indices = indices[~is_dt_stable]
+        unstable[indices] = dt[indices]
+
+        too_small = indices[dt[indices] < prec]
+        result[too_small] = 0
+        done[too_small] = True
+
+        indices = indices[dt[indices] >= prec]
+
+    # }}}
+
+    # {{{ bisect
+
+    indices = np.flatnonzero(~done)
+
+    while True:
+        indices = indices[np.abs(unstable[indices] - stable[indices]) > prec]
+        if not len(indices):
+            break
+
+        mid = (stable[indices] + unstable[indices])/2
+        is_mid_stable = is_stable(mid, indices)
+
+        stable[indices[is_mid_stable]] = mid[is_mid_stable]
+        unstable[indices[~is_mid_stable]] = mid[~is_mid_stable]
+
+    # }}}
+
+    result[~done] = stable[~done]
+    return result
+
+
+def find_stable_dt(evaluate_mat, mat, prec=1e-8):
+    """Like :func:`find_stable_dts`, for a single matrix *mat*."""
+    return find_stable_dts(evaluate_mat, np.asarray(mat)[np.newaxis], prec)[0]
+
+# }}}
+
+
+# {{{ result storage
+
+KEY_COLUMNS = (
+        "method", "substep_count", "meth_order",
+        "mat_type", "ratio", "angle", "offset")
+
+
+class ResultStore(object):
+    """Stores the stable time steps in the table ``data`` of an SQLite
+    database, with one column for each parameter and a column ``dt``.
+
+    The work of a sweep is kept in the table ``jobs``. Each job covers one
+    method and a chunk of matrices and is in one of the states
+    ``pending``, ``running``, ``done`` or ``failed``. A job's results and its
+    transition to ``done`` are committed together, so a sweep that is killed
+    can be resumed by resetting its ``running`` jobs to ``pending``.
+
+    .. automethod:: get_done_keys
+    .. automethod:: get_queued_keys
+    .. automethod:: add_jobs
+    .. automethod:: get_pending_jobs
+    .. automethod:: mark_jobs_running
+    .. automethod:: finish_job
+    .. automethod:: fail_job
+    .. automethod:: requeue_job
+    .. automethod:: reset_running_jobs
+    .. automethod:: reset_failed_jobs
+    .. automethod:: close
+    """
+
+    def __init__(self, filename):
+        import sqlite3
+        self.connection = sqlite3.connect(filename)
+
+        with self.connection:
+            self.connection.execute(
+                    "create table if not exists data ("
+                    "id integer primary key, "
+                    "method text, substep_count integer, meth_order integer, "
+                    "mat_type text, ratio real, angle real, offset real, "
+                    "dt real)")
+            self.connection.execute(
+                    "create index if not exists data_angle on data (angle)")
+            self.connection.execute(
+                    "create index if not exists data_srch on data "
+                    "(method,angle,mat_type,substep_count)")
+            self.connection.execute(
+                    "create unique index if not exists data_key on data (%s)"
+                    % ",".join(KEY_COLUMNS))
+
+            self.connection.execute(
+                    "create table if not exists jobs ("
+                    "id integer primary key, "
+                    "method text, substep_count integer, meth_order integer, "
+                    "matrices text, cost real, "
+                    "state text default 'pending', "
+                    "attempts integer default 0)")
+            self.connection.execute(
+                    "create index if not exists jobs_state on jobs (state, cost)")
+
+    def get_done_keys(self):
+        """Return a :class:`set` of tuples of the values of the parameter columns
+        for which a result is stored.
+        """
+        return set(self.connection.execute(
+            "select %s from data" % ",".join(KEY_COLUMNS)))
+
+    def get_queued_keys(self):
+        """Return a :class:`set` of tuples of the values of the parameter columns
+        that are covered by jobs that are not ``done``.
+        """
+        import json
+
+        result = set()
+        for row in self.connection.execute(
+                "select method, substep_count, meth_order, matrices from jobs "
+                "where state != 'done'"):
+            for mat_params in json.loads(row[-1]):
+                params = dict(zip(KEY_COLUMNS[:3], row[:3]), **mat_params)
+                result.add(tuple(params[col] for col in KEY_COLUMNS))
+
+        return result
+
+    def add_jobs(self, method_fac, matrix_fac_chunks):
+        """Add a pending job for each list of :class:`MatrixFactory` instances
+        in *matrix_fac_chunks*.
+        """
+        import json
+
+        params = method_fac.get_parameter_dict()
+        with self.connection:
+            self.connection.executemany(
+                    "insert into jobs "
+                    "(method, substep_count, meth_order, matrices, cost) "
+                    "values (?, ?, ?, ?, ?)",
+                    [(params["method"], params["substep_count"],
+                        params["meth_order"],
+                        json.dumps([
+                            matrix_fac.get_parameter_dict()
+                            for matrix_fac in matrix_facs]),
+                        _estimate_job_cost(method_fac, len(matrix_facs)))
+                        for matrix_facs in matrix_fac_chunks])
+
+    def get_pending_jobs(self):
+        """Return a list of tuples ``(job_id, method_fac, matrix_facs)`` for
+        all pending jobs, cheapest first.
+        """
+        import json
+
+        return [
+                (job_id,
+                    MethodFactory(method=method, substep_count=substep_count,
+                        meth_order=meth_order),
+                    [_matrix_factory_from_parameters(mat_params)
+                        for mat_params in json.loads(matrices)])
+                for job_id, method, substep_count, meth_order, matrices
+                in self.connection.execute(
+                    "select id, method, substep_count, meth_order, matrices "
+                    "from jobs where state = 'pending' order by cost, id")]
+
+    def mark_jobs_running(self, job_ids):
+        with self.connection:
+            self.connection.executemany(
+                    "update jobs set state = 'running' where id = ?",
+                    [(job_id,) for job_id in job_ids])
+
+    def finish_job(self, job_id, results):
+        """
+        :arg results: an iterable of parameter dictionaries that also
+            contain ``dt``.
+        """
+        columns = KEY_COLUMNS + ("dt",)
+        with self.connection:
+            self.connection.executemany(
+                    "insert or ignore into data (%s) values (%s)"
+                    % (",".join(columns), ",".join("?" for _ in columns)),
+                    [tuple(result[col] for col in columns)
+                        for result in results])
+            self.connection.execute(
+                    "update jobs set state = 'done' where id = ?", (job_id,))
+
+    def fail_job(self, job_id, max_attempts):
+        """Return the job to ``pending``, or mark it ``failed`` once it has
+        been attempted *max_attempts* times.
+        """
+        with self.connection:
+            self.connection.execute(
+                    "update jobs set attempts = attempts + 1, "
+                    "state = case when attempts + 1 >= ? "
+                    "then 'failed' else 'pending' end "
+                    "where id = ?", (max_attempts, job_id))
+
+    def requeue_job(self, job_id):
+        """Return the job to ``pending`` without counting an attempt."""
+        with self.connection:
+            self.connection.execute(
+                    "update jobs set state = 'pending' where id = ?", (job_id,))
+
+    def reset_running_jobs(self):
+        with self.connection:
+            self.connection.execute(
+                    "update jobs set state = 'pending' where state = 'running'")
+
+    def reset_failed_jobs(self):
+        with self.connection:
+            self.connection.execute(
+                    "update jobs set state = 'pending', attempts = 0 "
+                    "where state = 'failed'")
+
+    def close(self):
+        self.connection.close()
+
+
+def _estimate_job_cost(method_fac, nmatrices):
+    # The number of substeps and the size of the history both grow the step
+    # matrix expressions.
+    return nmatrices * method_fac.substep_count * method_fac.meth_order**2
+
+
+def _matrix_factory_from_parameters(params):
+    params = params.copy()
+    mat_type = params.pop("mat_type")
+
+    for cls in MATRIX_FACTORY_CLASSES:
+        if cls.__name__ == mat_type:
+            return cls(**params)
+
+    raise ValueError("unknown matrix type: '%s'" % mat_type)
+
+# }}}
+
+
+# {{{ sweep driver
+
+_EVALUATOR_CACHE = {}
+
+
+def _get_cached_step_matrix_evaluator(method_fac):
+    key = tuple(sorted(method_fac.get_parameter_dict().items()))
+
+    try:
+        return _EVALUATOR_CACHE[key]
+    except KeyError:
+        result = get_step_matrix_evaluator(method_fac)
+        _EVALUATOR_CACHE[key] = result
+        return result
+
+
+def _find_stable_dts_for_chunk(method_fac, matrix_facs, prec):
+    evaluate_mat = _get_cached_step_matrix_evaluator(method_fac)
+    dts = find_stable_dts(evaluate_mat, make_matrices(matrix_facs), prec)
+
+    results = []
+    for matrix_fac, dt in zip(matrix_facs, dts):
+        result = method_fac.get_parameter_dict()
+        result.update(matrix_fac.get_parameter_dict())
+        result["dt"] = float(dt)
+        results.append(result)
+
+    return results
+
+
+def _get_key(method_fac, matrix_fac):
+    params = method_fac.get_parameter_dict()
+    params.update(matrix_fac.get_parameter_dict())
+    return tuple(params[col] for col in KEY_COLUMNS)
+
+
+def _run_pending_jobs(store, prec, max_workers, max_attempts):
+    nresults = 0
+
+    if max_workers is None:
+        import os
+        max_workers = os.cpu_count() or 1
+
+    # jobs that were in flight when a worker process died
+    suspect_job_ids = set()
+
+    while True:
+        jobs = store.get_pending_jobs()
+        if not jobs:
+            return nresults
+
+        logger.info("stability sweep: %d jobs pending", len(jobs))
+
+        if max_workers == 1:
+            for job_id, method_fac, matrix_facs in jobs:
+                store.mark_jobs_running([job_id])
+                try:
+                    results = _find_stable_dts_for_chunk(
+                            method_fac, matrix_facs, prec)
+                except Exception:
+                    logger.warning("stability sweep: job %d failed", job_id,
+                            exc_info=True)
+                    store.fail_job(job_id, max_attempts)
+                else:
+                    store.finish_job(job_id, results)
+                    nresults += len(results)
+
+            continue
+
+        # Suspects each get a pool of their own, so that a crash can be
+        # attributed to the job that caused it.
+        new_suspect_job_ids = set()
+        for job in jobs:
+            if job[0] in suspect_job_ids:
+                nresults += _run_jobs_in_pool(store, [job], prec, 1,
+                        max_attempts, new_suspect_job_ids)
+
+        nresults += _run_jobs_in_pool(store,
+                [job for job in jobs if job[0] not in suspect_job_ids],
+                prec, max_workers, max_attempts, new_suspect_job_ids)
+
+        suspect_job_ids = new_suspect_job_ids
+
+
+def _run_jobs_in_pool(store, jobs, prec, max_workers, max_attempts,
+        suspect_job_ids):
+    from concurrent.futures import (
+            ProcessPoolExecutor, wait, FIRST_COMPLETED)
+    from concurrent.futures.process import BrokenProcessPool
+
+    nresults = 0
+    jobs = jobs[::-1]
+    broken = False
+
+    # At most *max_workers* jobs are in flight, so a worker that dies and
+    # breaks the pool only implicates those.
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        future_to_job_id = {}
+
+        while future_to_job_id or (jobs and not broken):
+            while jobs and not broken and len(future_to_job_id) < max_workers:
+                job_id, method_fac, matrix_facs = jobs.pop()
+                store.mark_jobs_running([job_id])
+                future_to_job_id[executor.submit(_find_stable_dts_for_chunk,
+                    method_fac, matrix_facs, prec)] = job_id
+
+            done, _ = wait(future_to_job_id, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                job_id = future_to_job_id.pop(future)
+
+                try:
+                    results = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    if max_workers == 1:
+                        logger.warning("stability sweep: job %d crashed "
+                                "its worker", job_id)
+                        store.fail_job(job_id, max_attempts)
+                    else:
+                        store.requeue_job(job_id)
+                        suspect_job_ids.add(job_id)
+                except Exception:
+                    logger.warning("stability sweep: job %d failed", job_id,
+                            exc_info=True)
+                    store.fail_job(job_id, max_attempts)
+                else:
+                    store.finish_job(job_id, results)
+                    nresults += len(results)
+
+    return nresults
+
+
+def run_stability_sweep(filename, method_factories=None, matrix_factories=None,
+        prec=1e-8, max_workers=None, chunk_size=1000, max_attempts=3,
+        retry_failed=False):
+    """Find the stable time step for every pair of method and matrix and store
+    it in the SQLite database *filename* (see :class:`ResultStore`).
+
+    Pairs that have a result or are covered by an unfinished job from a
+    previous, interrupted run are not queued again. Jobs left ``running`` by
+    such a run are resumed, cheapest jobs first.
+
+    :arg method_factories: an iterable of :class:`MethodFactory` instances,
+        defaulting to :func:`generate_method_factories`.
+    :arg matrix_factories: an iterable of :class:`MatrixFactory` instances,
+        defaulting to :func:`generate_matrix_factories`.
+    :arg max_workers: the number of worker processes. If *1*, all work is
+        done in the calling process.
+    :arg chunk_size: the number of matrices handled by a single job.
+    :arg max_attempts: the number of times a job is attempted before it is
+        marked ``failed``.
+    :arg retry_failed: if *True*, jobs marked ``failed`` by a previous run are
+        attempted again.
+    :returns: the number of newly stored results.
+    """
+    if method_factories is None:
+        method_factories = generate_method_factories()
+    if matrix_factories is None:
+        matrix_factories = generate_matrix_factories()
+
+    matrix_factories = list(matrix_factories)
+
+    store = ResultStore(filename)
+    try:
+        store.reset_running_jobs()
+        if retry_failed:
+            store.reset_failed_jobs()
+
+        known_keys = store.get_done_keys() | store.get_queued_keys()
+
+        for method_fac in method_factories:
+            new = [
+                    matrix_fac for matrix_fac in matrix_factories
+                    if _get_key(method_fac, matrix_fac) not in known_keys]
+
+            store.add_jobs(method_fac, [
+                new[i:i+chunk_size] for i in range(0, len(new), chunk_size)])
+
+        return _run_pending_jobs(store, prec, max_workers, max_attempts)
+    finally:
+        store.close()
+
+# }}}
+
+# vim: foldmethod=marker
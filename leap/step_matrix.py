@@ -36,6 +36,13 @@ __doc__ = """
 
 .. autoclass:: StepMatrixFinder
 .. autofunction:: fast_evaluator
+.. autofunction:: vectorized_evaluator
+
+Multi-rate linear test problems
+-------------------------------
+
+.. autofunction:: get_multirate_linear_test_function_map
+.. autofunction:: make_multirate_step_matrix_evaluator
 """
 
 
@@ -335,6 +342,129 @@ def _eval_compiled_matrix(compiled_matrix, var_order, var_assignments):
     else:
         return compiled_matrix(*arguments)
 
+
+def vectorized_evaluator(matrix):
+    """
+    Like :func:`fast_evaluator`, but the generated function accepts arrays
+    of values that broadcast to a common shape *batch_shape* and returns an
+    array of shape ``batch_shape + matrix.shape``.
+
+    :arg matrix: a dense or sparse step matrix from
+        :class:`StepMatrixFinder`.
+    """
+    if not isinstance(matrix, SparseStepMatrix):
+        indices = [
+                idx for idx in np.ndindex(matrix.shape)
+                if not (np.isscalar(matrix[idx]) and matrix[idx] == 0)]
+        matrix = SparseStepMatrix(
+                matrix.shape, indices, [matrix[idx] for idx in indices])
+
+    # Compiling the entries separately lets constant entries be broadcast
+    # into the stacked result.
+    from functools import partial
+    return partial(_eval_vectorized_matrix,
+            matrix.shape, matrix.indices, fast_evaluator(matrix, sparse=True))
+
+
+def _eval_vectorized_matrix(shape, indices, evaluate_sparse_matrix,
+        var_assignments):
+    data = evaluate_sparse_matrix(var_assignments).data
+    batch_shape = np.broadcast_arrays(*var_assignments.values())[0].shape
+
+    result = np.zeros(batch_shape + shape,
+            dtype=np.result_type(np.float64, *data))
+    for (i, j), entry in zip(indices, data):
+        result[..., i, j] = entry
+
+    return result
+
+# }}}
+
+
+# {{{ multi-rate linear test problems
+
+def get_multirate_linear_test_function_map(method, couplings=None):
+    """Build a symbolic *function_map* for :class:`StepMatrixFinder` that
+    replaces each right-hand side of a
+    :class:`~leap.multistep.multirate.MultiRateMultiStepMethodBuilder` by a
+    linear combination of its arguments with symbolic coefficients.
+
+    A function ``<func>name`` that is linear in a single component gets the
+    coefficient ``name``. Otherwise, the coefficient of component ``comp``
+    is ``name_comp``.
+
+    :arg couplings: a mapping from function names to the names of the
+        components that function is linear in. Functions not in the
+        mapping are linear in all of their arguments.
+    :returns: a tuple ``(function_map, coefficient_names)``.
+    """
+    if couplings is None:
+        couplings = {}
+
+    function_map = {}
+    coefficient_names = []
+
+    from functools import partial
+
+    for component_rhss in method.rhss:
+        for rhs in component_rhss:
+            if rhs.func_name in function_map:
+                continue
+
+            coupled_comp_names = couplings.get(rhs.func_name, rhs.arguments)
+            for comp_name in coupled_comp_names:
+                if comp_name not in rhs.arguments:
+                    raise ValueError("'%s' is not an argument of '%s'"
+                            % (comp_name, rhs.func_name))
+
+            name = rhs.func_name
+            if name.startswith("<func>"):
+                name = name[len("<func>"):]
+
+            if len(coupled_comp_names) == 1:
+                comp_coefficient_names = [name]
+            else:
+                comp_coefficient_names = [
+                        "%s_%s" % (name, comp_name)
+                        for comp_name in coupled_comp_names]
+
+            function_map[rhs.func_name] = partial(_linear_test_function, tuple(
+                (method.comp_name_to_kwarg_name[comp_name], coefficient_name)
+                for comp_name, coefficient_name in zip(
+                    coupled_comp_names, comp_coefficient_names)))
+            coefficient_names.extend(comp_coefficient_names)
+
+    return function_map, coefficient_names
+
+
+def _linear_test_function(kwarg_and_coefficient_names, t, **kwargs):
+    from pymbolic import var
+    return sum(
+            var(coefficient_name) * kwargs[kwarg_name]
+            for kwarg_name, coefficient_name in kwarg_and_coefficient_names)
+
+
+def make_multirate_step_matrix_evaluator(method, couplings=None,
+        phase_name="primary"):
+    """Find the step matrix of *phase_name* for the linear test problem of
+    :func:`get_multirate_linear_test_function_map` in a single symbolic pass.
+
+    The method must not branch in *phase_name*, which typically requires
+    *static_dt*.
+
+    :returns: a function as generated by :func:`vectorized_evaluator`, which
+        takes values for ``<dt>`` and each coefficient.
+    """
+    function_map, _ = get_multirate_linear_test_function_map(
+            method, couplings)
+
+    finder = StepMatrixFinder(method.generate(),
+            function_map=function_map,
+            exclude_variables=[method.bootstrap_step.name])
+
+    return vectorized_evaluator(
+            finder.get_phase_step_matrix(phase_name, sparse=True))
+
 # }}}
 
 # vim: foldmethod=marker
@@ -26,6 +26,9 @@ THE SOFTWARE.
 
 __doc__ = """
 .. autofunction:: strang_splitting
+.. autofunction:: annotate_parallel_calls
+.. autofunction:: propagate_copies
+.. autofunction:: eliminate_dead_code
 
 """
 
@@ -161,3 +164,437 @@ def strang_splitting(dag1, dag2, stepping_phase):
         raise ValueError("DAGs don't agree on initial phase")
 
     return DAGCode(new_phases, dag1.initial_phase)
+
+
+def annotate_parallel_calls(dag, function_names):
+    """Mark the statements in *dag* that call one of *function_names*
+    (typically right-hand sides) with a *parallel_group* attribute. Within a
+    phase, no statement depends, directly or indirectly, on a statement in
+    the same group, so that a target may carry out the statements of a group
+    concurrently. Groups are numbered from 0 in an order compatible with the
+    dependencies.
+
+    :arg dag: a :class:`dagrt.language.DAGCode`
+    :arg function_names: a collection of function names, e.g.
+        ``"<func>f"``.
+    :returns: a :class:`dagrt.language.DAGCode`
+    """
+
+    from pymbolic.primitives import Call, CallWithKwargs
+    from dagrt.expression import ExtendedDependencyMapper
+
+    function_names = frozenset(function_names)
+    dep_mapper = ExtendedDependencyMapper(
+            include_calls=True,
+            include_subscripts=False,
+            include_lookups=False)
+
+    def calls_function(stmt):
+        if getattr(stmt, "function_id", None) in function_names:
+            return True
+
+        found = []
+
+        def collect(expr):
+            found.extend(
+                    dep for dep in dep_mapper(expr)
+                    if isinstance(dep, (Call, CallWithKwargs))
+                    and getattr(dep.function, "name", None) in function_names)
+            return expr
+
+        stmt.map_expressions(collect)
+        return bool(found)
+
+    def annotate_phase(phase):
+        id_to_stmt = dict((stmt.id, stmt) for stmt in phase.statements)
+        is_call = dict(
+                (stmt.id, calls_function(stmt)) for stmt in phase.statements)
+
+        # the number of calls on the longest dependency path to a statement,
+        # by iterative depth-first search
+        ncalls_before = {}
+
+        for root_id in id_to_stmt:
+            stack = [(root_id, False)]
+            while stack:
+                stmt_id, deps_done = stack.pop()
+                if stmt_id in ncalls_before:
+                    continue
+
+                depends_on = id_to_stmt[stmt_id].depends_on
+                if deps_done:
+                    ncalls_before[stmt_id] = max(
+                            (ncalls_before[dep_id] + int(is_call[dep_id])
+                                for dep_id in depends_on),
+                            default=0)
+                else:
+                    stack.append((stmt_id, True))
+                    stack.extend(
+                            (dep_id, False) for dep_id in depends_on
+                            if dep_id not in ncalls_before)
+
+        return phase.copy(statements=[
+                stmt.copy(parallel_group=ncalls_before[stmt.id])
+                if is_call[stmt.id] else stmt
+                for stmt in phase.statements])
+
+    from dagrt.language import DAGCode
+    return DAGCode(
+            dict(
+                (phase_name, annotate_phase(phase))
+                for phase_name, phase in dag.phases.items()),
+            dag.initial_phase)
+
+
+def _get_ancestors(phase):
+    """Return a dictionary mapping each statement id in *phase* to the set of
+    ids of the statements on which it depends, directly or indirectly.
+    """
+    id_to_stmt = phase.id_to_stmt
+    ancestors = {}
+
+    for root_id in id_to_stmt:
+        stack = [(root_id, False)]
+        while stack:
+            stmt_id, deps_done = stack.pop()
+            if stmt_id in ancestors:
+                continue
+
+            depends_on = id_to_stmt[stmt_id].depends_on
+            if deps_done:
+                result = set(depends_on)
+                for dep_id in depends_on:
+                    result.update(ancestors[dep_id])
+                ancestors[stmt_id] = frozenset(result)
+            else:
+                stack.append((stmt_id, True))
+                stack.extend(
+                        (dep_id, False) for dep_id in depends_on
+                        if dep_id not in ancestors)
+
+    return ancestors
+
+
+def _remove_statements(phase, removed_ids):
+    """Remove the statements with ids in *removed_ids* from *phase*. Statements
+    depending on a removed statement inherit its dependencies, so that the
+    order of the remaining statements is preserved.
+    """
+    id_to_stmt = phase.id_to_stmt
+    resolved = {}
+
+    def resolve(stmt_id):
+        if stmt_id not in removed_ids:
+            return frozenset([stmt_id])
+
+        if stmt_id not in resolved:
+            result = set()
+            for dep_id in id_to_stmt[stmt_id].depends_on:
+                result.update(resolve(dep_id))
+            resolved[stmt_id] = frozenset(result)
+
+        return resolved[stmt_id]
+
+    new_statements = []
+    for stmt in phase.statements:
+        if stmt.id in removed_ids:
+            continue
+
+        if removed_ids & stmt.depends_on:
+            depends_on = set()
+            for dep_id in stmt.depends_on:
+                depends_on.update(resolve(dep_id))
+            stmt = stmt.copy(depends_on=frozenset(depends_on))
+
+        new_statements.append(stmt)
+
+    return phase.copy(statements=new_statements)
+
+
+def _get_readers_and_writers(phase):
+    readers = {}
+    writers = {}
+    for stmt in phase.statements:
+        for name in stmt.get_read_variables():
+            readers.setdefault(name, set()).add(stmt.id)
+        for name in stmt.get_written_variables():
+            writers.setdefault(name, set()).add(stmt.id)
+
+    return readers, writers
+
+
+def _substitute_variable(stmt, name, replacement):
+    """Return *stmt* with the variable *name* replaced by the expression
+    *replacement*, or *None* if not all occurrences could be replaced.
+    """
+    from pymbolic.mapper.substitutor import make_subst_func, SubstitutionMapper
+    mapper = SubstitutionMapper(make_subst_func({name: replacement}))
+
+    new_stmt = stmt.map_expressions(mapper, include_lhs=False)
+    if new_stmt.condition is not True:
+        new_stmt = new_stmt.copy(condition=mapper(new_stmt.condition))
+
+    if name in new_stmt.get_read_variables():
+        return None
+
+    return new_stmt
+
+
+def _is_plain_assignment(stmt):
+    """Return *True* if *stmt* unconditionally assigns to a single variable,
+    without subscripts or loops.
+    """
+    from dagrt.language import Assign, AssignFunctionCall
+    from pymbolic.primitives import Variable
+
+    if stmt.condition is not True:
+        return False
+
+    if isinstance(stmt, Assign):
+        return isinstance(stmt.lhs, Variable) and not stmt.loops
+    elif isinstance(stmt, AssignFunctionCall):
+        return len(stmt.assignees) == 1
+    else:
+        return False
+
+
+def _propagate_copies_in_phase(phase):
+    from dagrt.language import Assign
+    from dagrt.utils import is_state_variable
+    from pymbolic import var
+    from pymbolic.primitives import Variable
+
+    while True:
+        id_to_stmt = dict(phase.id_to_stmt)
+        ancestors = _get_ancestors(phase)
+        readers, writers = _get_readers_and_writers(phase)
+
+        # Variables whose readers or writers have changed in this sweep, and
+        # whether the dependency graph has changed. Candidates touching these
+        # are left to the next sweep.
+        touched = set()
+        removed_ids = set()
+        graph_changed = False
+
+        for copy_stmt in phase.statements:
+            if graph_changed:
+                break
+
+            if not (isinstance(copy_stmt, Assign)
+                    and _is_plain_assignment(copy_stmt)
+                    and isinstance(copy_stmt.rhs, Variable)):
+                continue
+
+            dest = copy_stmt.lhs.name
+            src = copy_stmt.rhs.name
+
+            if (dest == src
+                    or dest in touched or src in touched
+                    or writers[dest] != set([copy_stmt.id])):
+                continue
+
+            if not is_state_variable(dest):
+                # {{{ replace reads of a local copy by its source
+
+                # The source must not change after the copy is made.
+                if not writers.get(src, set()) <= ancestors[copy_stmt.id]:
+                    continue
+
+                dest_readers = readers.get(dest, set())
+                if not dest_readers or not all(
+                        copy_stmt.id in ancestors[reader_id]
+                        for reader_id in dest_readers):
+                    continue
+
+                new_stmts = dict(
+                        (reader_id, _substitute_variable(
+                            id_to_stmt[reader_id], dest, var(src)))
+                        for reader_id in dest_readers)
+                if None in new_stmts.values():
+                    continue
+
+                id_to_stmt.update(new_stmts)
+                touched.update([dest, src])
+
+                # }}}
+
+            elif not is_state_variable(src):
+                # {{{ compute the source of a copy to state in place
+
+                src_writers = writers.get(src, set())
+                if len(src_writers) != 1:
+                    continue
+
+                src_stmt_id, = src_writers
+                src_stmt = id_to_stmt[src_stmt_id]
+
+                # Function calls are not assumed to allow their results to
+                # alias their arguments.
+                if (not _is_plain_assignment(src_stmt)
+                        or (not isinstance(src_stmt, Assign)
+                            and dest in src_stmt.get_read_variables())):
+                    continue
+
+                src_readers = readers.get(src, set()) - set([copy_stmt.id])
+                if not all(
+                        src_stmt_id in ancestors[reader_id]
+                        for reader_id in src_readers):
+                    continue
+
+                # Statements that read the previous value of the destination
+                # must be carried out before the source is computed.
+                old_dest_readers = set(
+                        reader_id
+                        for reader_id in readers.get(dest, set())
+                        if reader_id not in (copy_stmt.id, src_stmt_id)
+                        and copy_stmt.id not in ancestors[reader_id])
+                new_deps = old_dest_readers - ancestors[src_stmt_id]
+
+                if any(src_stmt_id in ancestors[reader_id]
+                        for reader_id in new_deps):
+                    continue
+
+                if new_deps and hasattr(src_stmt, "parallel_group"):
+                    # Keep the statements of a parallel group independent.
+                    continue
+
+                new_stmts = dict(
+                        (reader_id, _substitute_variable(
+                            id_to_stmt[reader_id], src, var(dest)))
+                        for reader_id in src_readers)
+                if None in new_stmts.values():
+                    continue
+
+                if isinstance(src_stmt, Assign):
+                    src_stmt = src_stmt.copy(lhs=var(dest))
+                else:
+                    src_stmt = src_stmt.copy(assignees=[dest])
+
+                if new_deps:
+                    src_stmt = src_stmt.copy(
+                            depends_on=src_stmt.depends_on | new_deps)
+                    graph_changed = True
+
+                id_to_stmt.update(new_stmts)
+                id_to_stmt[src_stmt_id] = src_stmt
+                removed_ids.add(copy_stmt.id)
+                touched.update([dest, src])
+
+                # }}}
+
+        if not touched:
+            return phase
+
+        phase = _remove_statements(
+                phase.copy(statements=[
+                    id_to_stmt[stmt.id] for stmt in phase.statements]),
+                removed_ids)
+
+
+def propagate_copies(dag):
+    """Eliminate copies between variables in *dag*, which are common in the
+    output of the method builders. Within each phase,
+
+    *   reads of a temporary that is only assigned a copy of another
+        variable are replaced by reads of that variable, if it does not
+        change after the copy is made;
+    *   a temporary whose value is copied to a state variable, such as
+        ``<state>y`` or ``<p>hist``, is computed directly into that state
+        variable, if the previous value of the state variable is not
+        needed afterwards.
+
+    Only unconditional assignments are considered. The copies of the first
+    kind are left in place, to be removed by :func:`eliminate_dead_code`.
+
+    :arg dag: a :class:`dagrt.language.DAGCode`
+    :returns: a :class:`dagrt.language.DAGCode`
+    """
+
+    from dagrt.language import DAGCode
+    return DAGCode(
+            dict(
+                (phase_name, _propagate_copies_in_phase(phase))
+                for phase_name, phase in dag.phases.items()),
+            dag.initial_phase)
+
+
+def eliminate_dead_code(dag, pure_function_names=()):
+    """Remove the assignments to temporaries in *dag* whose values are never
+    read. State variables, such as ``<state>y`` and ``<p>hist``, are always
+    considered live. Assignments that call a function, other than one of
+    *pure_function_names* or a built-in function of :mod:`dagrt`, are kept,
+    since the call may have side effects.
+
+    Applying :func:`propagate_copies` before this pass removes most of the
+    copies generated by the method builders.
+
+    :arg dag: a :class:`dagrt.language.DAGCode`
+    :arg pure_function_names: a collection of function names, e.g.
+        ``"<func>f"``, whose calls have no side effects and may be removed
+        if their results are not used.
+    :returns: a :class:`dagrt.language.DAGCode`
+    """
+
+    from dagrt.language import Assign, AssignFunctionCall
+    from dagrt.utils import is_state_variable
+    from dagrt.expression import ExtendedDependencyMapper
+    from pymbolic.primitives import Call, CallWithKwargs, Variable
+
+    pure_function_names = frozenset(pure_function_names)
+    dep_mapper = ExtendedDependencyMapper(
+            include_calls=True,
+            include_subscripts=False,
+            include_lookups=False)
+
+    def is_pure_function(name):
+        return (name in pure_function_names
+                or (name.startswith("<builtin>") and name != "<builtin>print"))
+
+    def is_removable(stmt, readers):
+        if isinstance(stmt, Assign):
+            if not isinstance(stmt.lhs, Variable):
+                return False
+
+            calls = [
+                    dep for dep in dep_mapper(stmt.rhs)
+                    if isinstance(dep, (Call, CallWithKwargs))]
+            if not all(
+                    is_pure_function(getattr(call.function, "name", None) or "")
+                    for call in calls):
+                return False
+
+        elif isinstance(stmt, AssignFunctionCall):
+            if not is_pure_function(stmt.function_id):
+                return False
+
+        else:
+            return False
+
+        return not any(
+                is_state_variable(name) or readers.get(name)
+                for name in stmt.get_written_variables())
+
+    def eliminate_in_phase(phase):
+        while True:
+            readers, _ = _get_readers_and_writers(phase)
+
+            # A statement may read the variable it writes.
+            for stmt in phase.statements:
+                for name in stmt.get_written_variables():
+                    readers.get(name, set()).discard(stmt.id)
+
+            removed_ids = frozenset(
+                    stmt.id for stmt in phase.statements
+                    if is_removable(stmt, readers))
+
+            if not removed_ids:
+                return phase
+
+            phase = _remove_statements(phase, removed_ids)
+
+    from dagrt.language import DAGCode
+    return DAGCode(
+            dict(
+                (phase_name, eliminate_in_phase(phase))
+                for phase_name, phase in dag.phases.items()),
+            dag.initial_phase)
@@ -29,7 +29,11 @@ THE SOFTWARE.
 
 import sys
 import pytest
-from leap.multistep import AdamsBashforthMethodBuilder
+import numpy as np
+from leap.multistep import (
+        AdamsBashforthMethodBuilder, AdamsMoultonMethodBuilder,
+        VariableOrderAdamsBashforthMethodBuilder,
+        NordsieckAdamsBashforthMethodBuilder)
 
 from utils import (  # noqa
         python_method_impl_interpreter as pmi_int,
@@ -45,6 +49,32 @@ from utils import (  # noqa
         static_dt=static_dt), order)
     for order in [1, 3, 5]
     for static_dt in [True, False]
+    ] + [
+    (AdamsBashforthMethodBuilder("y", order, closed_form_coefficients=False),
+        order)
+    for order in [1, 3, 5]
+    ] + [
+    (AdamsBashforthMethodBuilder("y", order, hist_length=hist_length,
+        static_dt=static_dt, ring_buffer_history=True), order)
+    for order in [1, 3, 5]
+    for hist_length in [order, order+1]
+    for static_dt in [True, False]
+    ] + [
+    (AdamsBashforthMethodBuilder("y", order, static_dt=static_dt,
+        bootstrap_substeps=2), order)
+    for order in [3, 5]
+    for static_dt in [True, False]
+    ] + [
+    (AdamsBashforthMethodBuilder("y", order, hist_length=hist_length,
+        static_dt=static_dt, bootstrap_method="adams"), order)
+    for order in [2, 3, 4, 5]
+    for hist_length in [order, order+1]
+    for static_dt in [True, False]
+    ] + [
+    (NordsieckAdamsBashforthMethodBuilder("y", order, static_dt=static_dt),
+        order)
+    for order in [1, 2, 3, 4, 5]
+    for static_dt in [True, False]
     ])
 def test_ab_accuracy(python_method_impl, method, expected_order,
         show_dag=False, plot_solution=False):
@@ -54,6 +84,237 @@ def test_ab_accuracy(python_method_impl, method, expected_order,
                              plot_solution=plot_solution)
 
 
+@pytest.mark.parametrize("closed_form", [True, False])
+@pytest.mark.parametrize("order", [1, 2, 4])
+def test_variable_dt_adams_integration(python_method_impl, order, closed_form):
+    from pymbolic import var
+    from pytools import UniqueNameGenerator
+    from dagrt.language import CodeBuilder, DAGCode
+    from leap.multistep import (
+            AdamsMonomialIntegrationFunctionFamily, emit_adams_integration)
+    from utils import execute_and_return_single_result
+
+    # a polynomial of degree order-1 is integrated exactly
+    def f(t):
+        return sum((-1)**i * (i+1) * t**i for i in range(order))
+
+    nodes = [-0.7, -0.45, -0.2, 0][-order:]
+
+    with CodeBuilder(name="primary") as cb:
+        # not constants, to use the variable time step code path
+        time_values = [var("<t>") + node for node in nodes]
+
+        result = emit_adams_integration(cb, UniqueNameGenerator(),
+                AdamsMonomialIntegrationFunctionFamily(order),
+                time_values, [f(node) for node in nodes], 0, 0.3,
+                closed_form=closed_form)
+        cb.yield_state(result, "y", 0, "final")
+
+    code = DAGCode.from_phases_list(
+            [cb.as_execution_phase("primary")], "primary")
+
+    assert ("linear_solve" in str(code)) == (not closed_form)
+
+    import numpy as np
+    from numpy.polynomial import Polynomial
+    antideriv = Polynomial([(-1)**i * (i+1) for i in range(order)]).integ()
+
+    result = execute_and_return_single_result(python_method_impl, code)
+    assert np.isclose(result, antideriv(0.3) - antideriv(0), rtol=1e-12)
+
+
+@pytest.mark.parametrize(("bootstrap_method", "bootstrap_substeps",
+        "bootstrap_rhs_evals"), [
+    # The first RK stage reuses the right-hand side saved to the history.
+    ("rk", 1, 3 * 4),
+    ("rk", 2, 3 * 8),
+    # One evaluation per step, where the first step of 1e-2 is divided
+    # into substeps of 2**-10 times its size, that double the time elapsed
+    # since the start: 2**-10 * (1e-2/1)**(-3/2) <= 1 < 2**-9 * ...
+    # At this step size, this is more than the RK bootstrap takes.
+    ("adams", 1, 11 + 2),
+    ])
+def test_ab_bootstrap_cost(python_method_impl, bootstrap_method,
+        bootstrap_substeps, bootstrap_rhs_evals):
+    from utils import DefaultProblem
+    problem = DefaultProblem()
+
+    nevals = [0]
+
+    def rhs(t, y):
+        nevals[0] += 1
+        return problem(t, y)
+
+    method = AdamsBashforthMethodBuilder("y", 4,
+            bootstrap_method=bootstrap_method,
+            bootstrap_substeps=bootstrap_substeps)
+    code = method.generate()
+
+    interp = python_method_impl(code, function_map={"<func>y": rhs})
+    interp.set_up(t_start=problem.t_start, dt_start=1e-2,
+            context={"y": problem.initial()})
+
+    bootstrap_nevals = None
+    for event in interp.run(t_end=problem.t_start + 0.1):
+        if (isinstance(event, interp.StepCompleted)
+                and event.next_phase == "primary"
+                and bootstrap_nevals is None):
+            bootstrap_nevals = nevals[0]
+
+    assert bootstrap_nevals == bootstrap_rhs_evals
+
+
+@pytest.mark.parametrize(("method", "expected_order"), [
+    (AdamsMoultonMethodBuilder("y", order, static_dt=static_dt,
+        evaluate_corrected=evaluate_corrected), order)
+    for order in [1, 2, 4]
+    for static_dt in [True, False]
+    for evaluate_corrected in [True, False]
+    ] + [
+    (AdamsMoultonMethodBuilder("y", order, hist_length=order+1), order)
+    for order in [1, 3]
+    ])
+def test_am_accuracy(python_method_impl, method, expected_order,
+        show_dag=False, plot_solution=False):
+    from utils import check_simple_convergence
+    check_simple_convergence(method=method, method_impl=python_method_impl,
+                             expected_order=expected_order,
+                             dts=2.0**-np.arange(6, 9),
+                             show_dag=show_dag, plot_solution=plot_solution)
+
+
+@pytest.mark.parametrize("evaluate_corrected", [True, False])
+def test_am_adaptive_timestep(python_method_impl, evaluate_corrected):
+    method = AdamsMoultonMethodBuilder("y", 3,
+            evaluate_corrected=evaluate_corrected, rtol=1e-6)
+    code = method.generate()
+
+    from stiff_test_systems import VanDerPolProblem
+    example = VanDerPolProblem()
+
+    interp = python_method_impl(code, function_map={"<func>y": example})
+    interp.set_up(t_start=example.t_start, dt_start=1e-5,
+            context={"y": example.initial()})
+
+    t_end = 20
+
+    times = []
+    nfailed = 0
+    for event in interp.run(t_end=t_end):
+        if isinstance(event, interp.StateComputed):
+            times.append(event.t)
+        elif isinstance(event, interp.StepFailed):
+            nfailed += 1
+
+    step_sizes = np.diff(times)
+    print("steps: %d - failed: %d - largest step: %g"
+            % (len(step_sizes), nfailed, np.max(step_sizes)))
+
+    assert times[-1] >= t_end
+    assert nfailed > 0
+    assert np.max(step_sizes) > 1e-3
+
+
+def test_variable_order_ab(python_method_impl):
+    from utils import DefaultProblem
+    problem = DefaultProblem()
+
+    errors = []
+    nsteps = []
+    for tol in [1e-4, 1e-6, 1e-8]:
+        method = VariableOrderAdamsBashforthMethodBuilder("y",
+                atol=tol, rtol=tol)
+        code = method.generate()
+
+        interp = python_method_impl(code, function_map={"<func>y": problem})
+        interp.set_up(t_start=problem.t_start, dt_start=1e-4,
+                context={"y": problem.initial()})
+
+        times = []
+        values = []
+        for event in interp.run(t_end=problem.t_end):
+            if isinstance(event, interp.StateComputed):
+                times.append(event.t)
+                values.append(event.state_component[0])
+
+        errors.append(abs(values[-1] - problem.exact(times[-1])))
+        nsteps.append(len(times))
+
+    print("errors: %s - steps: %s" % (errors, nsteps))
+
+    # tightening the tolerance decreases the error
+    assert errors[0] > errors[1] > errors[2]
+
+    # the order rises, so that the step count grows slowly
+    assert nsteps[2] < 8 * nsteps[0]
+
+
+@pytest.mark.parametrize("order", [2, 3, 4])
+def test_nordsieck_matches_ab(python_method_impl, order):
+    from utils import DefaultProblem
+    problem = DefaultProblem()
+
+    def run(method):
+        interp = python_method_impl(method.generate(),
+                function_map={"<func>y": problem})
+        interp.set_up(t_start=problem.t_start, dt_start=2**-6,
+                context={"y": problem.initial()})
+
+        return np.array([
+            event.state_component
+            for event in interp.run(t_end=problem.t_end)
+            if isinstance(event, interp.StateComputed)])
+
+    ab_values = run(AdamsBashforthMethodBuilder("y", order, static_dt=True))
+    nordsieck_values = run(NordsieckAdamsBashforthMethodBuilder("y", order))
+
+    assert ab_values.shape == nordsieck_values.shape
+    assert np.max(np.abs(ab_values - nordsieck_values)) < 1e-10
+
+
+@pytest.mark.parametrize("order", [2, 3, 4])
+def test_nordsieck_changing_dt(python_method_impl, order):
+    from utils import DefaultProblem
+    problem = DefaultProblem()
+
+    method = NordsieckAdamsBashforthMethodBuilder("y", order)
+    code = method.generate()
+
+    from pytools.convergence import EOCRecorder
+    eocrec = EOCRecorder()
+
+    for n in range(5, 8):
+        dt = 2**(-n)
+
+        interp = python_method_impl(code, function_map={"<func>y": problem})
+        interp.set_up(t_start=problem.t_start, dt_start=dt,
+                context={"y": problem.initial()})
+
+        t = problem.t_start
+        value = None
+        nsteps = 0
+        for event in interp.run(t_end=problem.t_end):
+            if isinstance(event, interp.StateComputed):
+                t = event.t
+                value = event.state_component[0]
+            elif (isinstance(event, interp.StepCompleted)
+                    and event.next_phase == "primary"):
+                # alternate between two step sizes
+                nsteps += 1
+                new_dt = dt * (1 + 0.2 * (-1)**nsteps)
+                if hasattr(interp, "context"):
+                    interp.context["<dt>"] = new_dt
+                else:
+                    interp.dt = new_dt
+
+        eocrec.add_data_point(dt, abs(value - problem.exact(t)))
+
+    print(eocrec.pretty_print())
+
+    orderest = eocrec.estimate_order_of_convergence()[0, 1]
+    assert orderest > 0.9 * order
+
+
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         exec(sys.argv[1])
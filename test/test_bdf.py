@@ -0,0 +1,181 @@
+#! /usr/bin/env python
+from __future__ import division, with_statement
+
+__copyright__ = "Copyright (C) 2020 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+# avoid spurious: pytest.mark.parametrize is not callable
+# pylint: disable=not-callable
+
+
+import numpy as np
+import pytest
+import sys
+
+from leap.multistep.bdf import BDFMethodBuilder, NDFMethodBuilder
+from stiff_test_systems import KapsProblem
+
+from utils import (  # noqa
+        python_method_impl_interpreter as pmi_int,
+        python_method_impl_codegen as pmi_cg)
+
+
+def solver(f, t, sub_y, coeff, guess):
+    from scipy.optimize import root
+    return root(lambda unk: unk - sub_y - coeff*f(t=t, y=unk), guess).x
+
+
+def make_solver_hook(method):
+    template, _ = method.implicit_expression()
+
+    def solver_hook(solve_expr, solve_var, solver_id, guess):
+        from dagrt.expression import match, substitute
+
+        pieces = match(template, solve_expr, pre_match={"unk": solve_var})
+        pieces["guess"] = guess
+        return substitute("<func>solver(t, sub_y, coeff, guess)", pieces)
+
+    return solver_hook
+
+
+def _check_convergence(python_method_impl, method, expected_order,
+        problem, ns, vary_dt=False):
+    code = method.generate()
+
+    from leap.implicit import replace_AssignImplicit
+    code = replace_AssignImplicit(code, {"solve": make_solver_hook(method)})
+
+    from pytools.convergence import EOCRecorder
+    eocrec = EOCRecorder()
+
+    for n in ns:
+        dt = 2**(-n)
+
+        from functools import partial
+        interp = python_method_impl(code, function_map={
+            "<func>y": problem,
+            "<func>solver": partial(solver, problem),
+        })
+
+        interp.set_up(t_start=problem.t_start, dt_start=dt,
+                context={"y": problem.initial()})
+
+        times = []
+        values = []
+
+        nsteps = 0
+        for event in interp.run(t_end=problem.t_end):
+            if isinstance(event, interp.StateComputed):
+                values.append(event.state_component)
+                times.append(event.t)
+            elif isinstance(event, interp.StepCompleted) and vary_dt:
+                # alternate between two step sizes, also during bootstrap
+                nsteps += 1
+                new_dt = dt * (1 + 0.2 * (-1)**nsteps)
+                if hasattr(interp, "context"):
+                    interp.context["<dt>"] = new_dt
+                else:
+                    interp.dt = new_dt
+
+        if not vary_dt:
+            assert abs(times[-1] - problem.t_end) < 1e-10
+
+        error = np.linalg.norm(values[-1] - problem.exact(times[-1]))
+        eocrec.add_data_point(dt, error)
+
+    print("------------------------------------------------------")
+    print("%s: expected order %d" % (method.__class__.__name__,
+                                     expected_order))
+    print("------------------------------------------------------")
+    print(eocrec.pretty_print())
+
+    orderest = eocrec.estimate_order_of_convergence()[0, 1]
+    assert orderest > 0.9 * expected_order
+
+
+@pytest.mark.parametrize(("method", "expected_order"), [
+    (BDFMethodBuilder("y", order, static_dt=static_dt), order)
+    for order in [1, 2, 3, 4, 5]
+    for static_dt in [True, False]
+    ] + [
+    (NDFMethodBuilder("y", order, static_dt=static_dt), order)
+    for order in [1, 2, 4]
+    for static_dt in [True, False]
+    ])
+def test_convergence(python_method_impl, method, expected_order):
+    pytest.importorskip("scipy")
+
+    _check_convergence(python_method_impl, method, expected_order,
+            KapsProblem(epsilon=0.9), range(5, 9))
+
+
+@pytest.mark.parametrize(("method", "expected_order"), [
+    (BDFMethodBuilder("y", order), order)
+    for order in [2, 3, 5]
+    ] + [
+    (NDFMethodBuilder("y", order), order)
+    for order in [2, 4]
+    ])
+def test_stiff_convergence(python_method_impl, method, expected_order):
+    pytest.importorskip("scipy")
+
+    # The time steps exceed the explicit stability limit, which is of
+    # the order of epsilon, by more than three orders of magnitude. This includes the
+    # steps that start the history.
+    _check_convergence(python_method_impl, method, expected_order,
+            KapsProblem(epsilon=1e-6), range(4, 8))
+
+
+@pytest.mark.parametrize(("method", "expected_order"), [
+    (BDFMethodBuilder("y", order), order)
+    for order in [1, 3, 5]
+    ] + [
+    (NDFMethodBuilder("y", order), order)
+    for order in [2, 4]
+    ])
+def test_changing_dt(python_method_impl, method, expected_order):
+    pytest.importorskip("scipy")
+
+    _check_convergence(python_method_impl, method, expected_order,
+            KapsProblem(epsilon=1e-6), range(4, 8), vary_dt=True)
+
+
+def test_predictor_guess():
+    from dagrt.language import AssignImplicit
+
+    code = BDFMethodBuilder("y", 3).generate()
+
+    implicit_stmts = [
+            stmt for stmt in code.phases["primary"].statements
+            if isinstance(stmt, AssignImplicit)]
+
+    # one solve per step, started from the extrapolated state
+    assert len(implicit_stmts) == 1
+    assert str(implicit_stmts[0].other_params["guess"]) == "bdf_state_pred"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        exec(sys.argv[1])
+    else:
+        from pytest import main
+        main([__file__])
@@ -222,7 +222,7 @@ def test_rk_codegen_fancy():
 
 @pytest.mark.parametrize("min_order", [2, 3, 4, 5])
 @pytest.mark.parametrize("method_name", TwoRateAdamsBashforthMethodBuilder.methods)
-def test_multirate_codegen(min_order, method_name):
+def test_multirate_codegen(min_order, method_name, simplify=False):
     from leap.multistep.multirate import TwoRateAdamsBashforthMethodBuilder
 
     stepper = TwoRateAdamsBashforthMethodBuilder(
@@ -248,6 +248,10 @@ def test_multirate_codegen(min_order, method_name):
 
     code = stepper.generate()
 
+    if simplify:
+        from leap.transform import propagate_copies, eliminate_dead_code
+        code = eliminate_dead_code(propagate_copies(code))
+
     from dagrt.function_registry import (
             base_function_registry, register_ode_rhs,
             UserType, register_function)
@@ -343,6 +347,10 @@ def test_multirate_codegen(min_order, method_name):
         fortran_libraries=["lapack", "blas"])
 
 
+def test_simplified_multirate_codegen():
+    test_multirate_codegen(3, "Fqsr", simplify=True)
+
+
 def test_adaptive_rk_codegen():
     """Test whether Fortran code generation for the Runge-Kutta
     timestepper works.
@@ -418,6 +426,99 @@ def test_adaptive_rk_codegen_error():
         ])
 
 
+@pytest.mark.parametrize("static_dt", [True, False])
+@pytest.mark.parametrize("min_order", [3, 4])
+def test_rolled_multirate_codegen(min_order, static_dt, step_ratio=4):
+    from leap.multistep.multirate import (
+            MultiRateMultiStepMethodBuilder, MultiRateHistory)
+
+    stepper = MultiRateMultiStepMethodBuilder(
+            min_order,
+            (
+                (
+                    "dt", "fast", "=",
+                    MultiRateHistory(1, "<func>f2f", ("fast", "slow")),
+                    MultiRateHistory(step_ratio, "<func>s2f", ("fast", "slow")),
+                    ),
+                (
+                    "dt", "slow", "=",
+                    MultiRateHistory(step_ratio, "<func>f2s", ("fast", "slow")),
+                    MultiRateHistory(step_ratio, "<func>s2s", ("fast", "slow")),
+                    ),
+                ),
+            component_arg_names=("f", "s"),
+            static_dt=static_dt,
+            rolled_substeps=True)
+
+    code = stepper.generate()
+
+    from dagrt.function_registry import (
+            base_function_registry, register_ode_rhs)
+
+    freg = base_function_registry
+    for func_name in [
+            "<func>s2s",
+            "<func>f2s",
+            "<func>s2f",
+            "<func>f2f",
+            ]:
+        component_id = {
+                "s": "slow",
+                "f": "fast",
+                }[func_name[-1]]
+        freg = register_ode_rhs(freg, identifier=func_name,
+                output_type_id=component_id,
+                input_type_ids=("slow", "fast"),
+                input_names=("s", "f"))
+
+    freg = freg.register_codegen("<func>s2f", "fortran",
+        f.CallCode("""
+            ${result} = (sin(2d0*${t}) - 1d0)*${s}
+            """))
+    freg = freg.register_codegen("<func>f2s", "fortran",
+      f.CallCode("""
+          ${result} = (sin(2d0*${t}) + 1d0)*${f}
+          """))
+    freg = freg.register_codegen("<func>f2f", "fortran",
+      f.CallCode("""
+          ${result} = cos(2d0*${t})*${f}
+          """))
+    freg = freg.register_codegen("<func>s2s", "fortran",
+      f.CallCode("""
+          ${result} = -cos(2d0*${t})*${s}
+          """))
+
+    codegen = f.CodeGenerator(
+            "MRAB",
+            user_type_map={
+                "slow": f.ArrayType(
+                    (1,),
+                    f.BuiltinType('real (kind=8)'),
+                    ),
+                "fast": f.ArrayType(
+                    (1,),
+                    f.BuiltinType('real (kind=8)'),
+                    )
+                },
+            function_registry=freg)
+
+    code_str = codegen(code)
+
+    fac = 130
+    num_trips_one = 10*fac
+    num_trips_two = 30*fac
+
+    run_fortran([
+        ("abmethod.f90", code_str),
+        ("test_mrab.f90", (
+            read_file("test_mrab.f90")
+            .replace("MIN_ORDER", str(min_order - 0.3)+"d0")
+            .replace("NUM_TRIPS_ONE", str(num_trips_one))
+            .replace("NUM_TRIPS_TWO", str(num_trips_two)))),
+        ],
+        fortran_libraries=["lapack", "blas"])
+
+
 @pytest.mark.parametrize(("min_order", "hist_length"), [(5, 5), (4, 4), (4, 5),
     (3, 3), (3, 4), (2, 2), ])
 def test_singlerate_squarewave(min_order, hist_length):
@@ -454,8 +555,10 @@ def test_singlerate_squarewave(min_order, hist_length):
             """)
 
     code_str = codegen(code)
-    with open("abmethod_test.f90", "wt") as outf:
-        outf.write(code_str)
+
+    if 0:
+        with open("abmethod_test.f90", "wt") as outf:
+            outf.write(code_str)
 
     run_fortran([
         ("abmethod.f90", code_str),
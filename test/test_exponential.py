@@ -0,0 +1,191 @@
+#! /usr/bin/env python
+from __future__ import division, with_statement
+
+__copyright__ = "Copyright (C) 2020 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+# avoid spurious: pytest.mark.parametrize is not callable
+# pylint: disable=not-callable
+
+
+import numpy as np
+import pytest
+import sys
+
+from leap.exponential import (
+        ExponentialEulerMethodBuilder, LawsonRK4MethodBuilder,
+        ETDRK4MethodBuilder, PhiFunctionEvaluator)
+
+from utils import (  # noqa
+        python_method_impl_interpreter as pmi_int,
+        python_method_impl_codegen as pmi_cg)
+
+
+def run_to_end(python_method_impl, code, function_map, y0, dt, t_end):
+    interp = python_method_impl(code, function_map=function_map)
+    interp.set_up(t_start=0, dt_start=dt, context={"y": y0})
+
+    for event in interp.run(t_end=t_end):
+        if isinstance(event, interp.StateComputed):
+            last_event = event
+
+    assert abs(last_event.t - t_end) < 1e-12
+    return last_event.state_component
+
+
+def get_reference(linear_op, nonlinear_rhs, y0, t_end):
+    from scipy.integrate import solve_ivp
+    return solve_ivp(lambda t, y: linear_op @ y + nonlinear_rhs(t, y),
+            (0, t_end), y0, method="Radau", rtol=1e-13, atol=1e-14).y[:, -1]
+
+
+@pytest.mark.parametrize(("method", "expected_order"), [
+    (ExponentialEulerMethodBuilder("y"), 1),
+    (LawsonRK4MethodBuilder("y"), 4),
+    (ETDRK4MethodBuilder("y"), 4),
+    ])
+def test_exponential_accuracy(python_method_impl, method, expected_order):
+    pytest.importorskip("scipy")
+
+    linear_op = np.array([[-1, 2], [-2, -1]], dtype=np.float64)
+
+    def nonlinear_rhs(t, y):
+        return np.array([np.cos(t)*y[1], -y[0]**2])
+
+    y0 = np.array([1, 0.5])
+    t_end = 2
+    reference = get_reference(linear_op, nonlinear_rhs, y0, t_end)
+
+    code = method.generate()
+
+    from pytools.convergence import EOCRecorder
+    eocrec = EOCRecorder()
+
+    for dt in 2.0**-np.arange(3, 7):
+        y = run_to_end(python_method_impl, code, {
+            "<func>y": nonlinear_rhs,
+            "<func>phi_y": PhiFunctionEvaluator(linear_op),
+            }, y0, dt, t_end)
+        eocrec.add_data_point(dt, np.max(np.abs(y - reference)))
+
+    print(eocrec.pretty_print())
+    assert eocrec.estimate_order_of_convergence()[0, 1] > 0.9 * expected_order
+
+
+def get_diffusion_problem(npoints=39):
+    import scipy.sparse as sp
+
+    h = 1/(npoints + 1)
+    x = np.linspace(h, 1 - h, npoints)
+    linear_op = sp.diags(
+            [np.ones(npoints-1), -2*np.ones(npoints), np.ones(npoints-1)],
+            [-1, 0, 1]) / h**2
+
+    def nonlinear_rhs(t, y):
+        return np.sin(t)*x*(1 - x) - y**3
+
+    return linear_op, nonlinear_rhs, np.sin(np.pi*x)
+
+
+def test_etdrk4_stiff_krylov(python_method_impl):
+    pytest.importorskip("scipy")
+
+    linear_op, nonlinear_rhs, y0 = get_diffusion_problem()
+    t_end = 1
+    reference = get_reference(linear_op.toarray(), nonlinear_rhs, y0, t_end)
+
+    code = ETDRK4MethodBuilder("y").generate()
+
+    # dt is far beyond the explicit stability limit of about 3e-4.
+    dt = 1/8
+    results = []
+    for phi in [
+            PhiFunctionEvaluator(linear_op.toarray()),
+            PhiFunctionEvaluator(linear_op)]:
+        results.append(run_to_end(python_method_impl, code, {
+            "<func>y": nonlinear_rhs,
+            "<func>phi_y": phi,
+            }, y0, dt, t_end))
+
+    dense_result, krylov_result = results
+    assert np.max(np.abs(dense_result - reference)) < 1e-8
+    assert np.max(np.abs(krylov_result - dense_result)) < 1e-10
+
+
+def test_phi_matrix_caching():
+    pytest.importorskip("scipy")
+
+    linear_op, _, y0 = get_diffusion_problem(npoints=10)
+    phi = PhiFunctionEvaluator(linear_op.toarray(), kmax=2)
+
+    for k in range(3):
+        phi(k, 0.1, y0)
+    phi(0, 0.05, y0)
+    assert set(phi._matrix_cache) == {0.1, 0.05}
+
+    from scipy.linalg import expm
+    dense_op = linear_op.toarray()
+    phi_0, phi_1, phi_2 = phi.phi_matrices(0.1)
+    assert np.allclose(phi_0, expm(0.1*dense_op))
+    assert np.allclose(0.1*dense_op @ phi_1, phi_0 - np.eye(10))
+    assert np.allclose(0.1*dense_op @ phi_2, phi_1 - np.eye(10))
+
+
+def test_replace_phi_calls(python_method_impl):
+    pytest.importorskip("scipy")
+
+    from leap.exponential import replace_phi_calls
+    from pymbolic import var
+
+    linear_op = np.array([[-1, 2], [-2, -1]], dtype=np.float64)
+    phi = PhiFunctionEvaluator(linear_op)
+
+    def nonlinear_rhs(t, y):
+        return np.array([np.cos(t)*y[1], -y[0]**2])
+
+    code = ETDRK4MethodBuilder("y").generate()
+    function_map = {"<func>y": nonlinear_rhs, "<func>phi_y": phi}
+    y0 = np.array([1, 0.5])
+    expected = run_to_end(python_method_impl, code, function_map, y0, 1/8, 1)
+
+    # one function per phi_k
+    def phi_hook(k, h, v, func_name):
+        return var("<func>phi%d_y" % k)(h, v)
+
+    code = replace_phi_calls(code, phi_hook)
+    assert "<func>phi_y" not in str(code)
+
+    function_map = {"<func>y": nonlinear_rhs}
+    for k in range(4):
+        function_map["<func>phi%d_y" % k] = (
+                lambda h, v, k=k: phi(k, h, v))
+
+    result = run_to_end(python_method_impl, code, function_map, y0, 1/8, 1)
+    assert np.allclose(result, expected, rtol=1e-14, atol=0)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        exec(sys.argv[1])
+    else:
+        from pytest import main
+        main([__file__])
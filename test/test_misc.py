@@ -92,6 +92,63 @@ def test_strang_splitting(plot_solution=False):
     assert orderest > 2 * 0.9
 
 
+def test_propagate_copies_and_eliminate_dead_code():
+    from dagrt.language import CodeBuilder, DAGCode
+    from pymbolic import var
+
+    y = var("<state>y")
+    with CodeBuilder(name="primary") as cb:
+        cb(var("unused"), 2*y)
+        cb(var("unused_norm"), var("<builtin>norm_2")(y))
+        cb(var("unused_rhs"), var("<func>g")(t=var("<t>"), y=y))
+        cb(var("rhs"), var("<func>f")(t=var("<t>"), y=y))
+        cb(var("rhs_copy"), var("rhs"))
+        cb(var("y_new"), y + var("<dt>")*var("rhs_copy"))
+        cb(y, var("y_new"))
+        cb(var("<t>"), var("<t>") + var("<dt>"))
+        cb.yield_state(y, "y", var("<t>"), "final")
+
+    code = DAGCode(
+            phases={"primary": cb.as_execution_phase(next_phase="primary")},
+            initial_phase="primary")
+
+    from leap.transform import propagate_copies, eliminate_dead_code
+    new_code = eliminate_dead_code(propagate_copies(code))
+
+    written_vars = set(
+            name
+            for stmt in new_code.phases["primary"].statements
+            for name in stmt.get_written_variables())
+
+    # only the call to <func>g may have side effects
+    assert written_vars == set(["<state>y", "<t>", "rhs", "unused_rhs"])
+
+    new_code = eliminate_dead_code(propagate_copies(code),
+            pure_function_names=["<func>g"])
+
+    written_vars = set(
+            name
+            for stmt in new_code.phases["primary"].statements
+            for name in stmt.get_written_variables())
+    assert written_vars == set(["<state>y", "<t>", "rhs"])
+
+    from utils import python_method_impl_codegen
+
+    for dag in [code, new_code]:
+        interp = python_method_impl_codegen(dag, function_map={
+            "<func>f": lambda t, y: -y,
+            "<func>g": lambda t, y: y,
+            })
+        interp.set_up(t_start=0, dt_start=0.5, context={"y": 1})
+
+        values = []
+        for event in interp.run(t_end=2):
+            if isinstance(event, interp.StateComputed):
+                values.append(event.state_component)
+
+        assert values == [0.5**i for i in range(1, 5)]
+
+
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         exec(sys.argv[1])
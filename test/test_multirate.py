@@ -489,6 +489,890 @@ def test_two_rate_intervals(fast_interval, slow_interval, order=3):
     assert orderest > order * 0.7
 
 
+@pytest.mark.parametrize("static_dt", [True, False])
+@pytest.mark.parametrize("slow_policy", [
+    rhs_policy.early, rhs_policy.late, rhs_policy.early_and_late])
+@pytest.mark.parametrize("hist_length", [3, 4])
+def test_ring_buffer_history_identical(python_method_impl, static_dt,
+        slow_policy, hist_length, order=3, step_ratio=3):
+    # f' = f+s
+    # s' = -f+s
+
+    def make_method(ring_buffer_history):
+        return MultiRateMultiStepMethodBuilder(
+                order,
+                (
+                    (
+                        "dt", "fast", "=",
+                        MRHistory(1, "<func>f", ("fast", "slow",),
+                            hist_length=hist_length),
+                        ),
+                    (
+                        "dt", "slow", "=",
+                        MRHistory(step_ratio, "<func>s", ("fast", "slow"),
+                            rhs_policy=slow_policy, hist_length=hist_length)
+                        ),
+                    ),
+                static_dt=static_dt,
+                hist_consistency_threshold=1e-8,
+                early_hist_consistency_threshold="<dt>**%d" % order,
+                ring_buffer_history=ring_buffer_history)
+
+    results = []
+    for ring_buffer_history in [False, True]:
+        code = make_method(ring_buffer_history).generate()
+        if ring_buffer_history:
+            assert "<p>hist_head_fast_rhs0" in str(code)
+
+        stepper = python_method_impl(code, function_map={
+            "<func>f": lambda t, fast, slow: fast + slow,
+            "<func>s": lambda t, fast, slow: -fast + slow,
+            })
+        stepper.set_up(t_start=0, dt_start=0.05,
+                context={"fast": np.sin(0), "slow": np.cos(0)})
+
+        values = []
+        for event in stepper.run(t_end=2):
+            if isinstance(event, stepper.StateComputed):
+                values.append(event.state_component)
+
+        results.append(np.array(values))
+
+    assert len(results[0]) == len(results[1])
+    assert la.norm(results[0] - results[1]) < 1e-12 * la.norm(results[0])
+
+
+def test_static_coefficient_cache(python_method_impl, order=4, step_ratio=5):
+    from leap.multistep import _static_func_family_coefficients
+
+    def make_method(exact_coefficients):
+        return MultiRateMultiStepMethodBuilder(
+                order,
+                (
+                    (
+                        "dt", "fast", "=",
+                        MRHistory(1, "<func>f", ("fast", "slow",)),
+                        ),
+                    (
+                        "dt", "slow", "=",
+                        MRHistory(step_ratio, "<func>s", ("fast", "slow")),
+                        ),
+                    ),
+                static_dt=True,
+                exact_coefficients=exact_coefficients)
+
+    results = []
+    for exact_coefficients in [False, True]:
+        code = make_method(exact_coefficients).generate()
+
+        # regenerating the same method only hits the cache
+        misses = _static_func_family_coefficients.cache_info().misses
+        assert str(make_method(exact_coefficients).generate()) == str(code)
+        assert _static_func_family_coefficients.cache_info().misses == misses
+
+        stepper = python_method_impl(code, function_map={
+            "<func>f": lambda t, fast, slow: fast + slow,
+            "<func>s": lambda t, fast, slow: -fast + slow,
+            })
+        stepper.set_up(t_start=0, dt_start=0.05,
+                context={"fast": np.sin(0), "slow": np.cos(0)})
+
+        values = []
+        for event in stepper.run(t_end=2):
+            if isinstance(event, stepper.StateComputed):
+                values.append(event.state_component)
+
+        results.append(np.array(values))
+
+    assert len(results[0]) == len(results[1])
+    assert la.norm(results[0] - results[1]) < 1e-12 * la.norm(results[0])
+
+
+def test_exact_static_coefficients():
+    from fractions import Fraction
+    from leap.multistep import (
+            AdamsMonomialIntegrationFunctionFamily,
+            _static_func_family_coefficients)
+
+    family = AdamsMonomialIntegrationFunctionFamily(3)
+    rhs_values = tuple(
+            family.antiderivative(i, Fraction(1)) for i in range(len(family)))
+
+    # third-order Adams-Bashforth
+    coeffs = _static_func_family_coefficients(
+            family, (-2, -1, 0), rhs_values, exact=True)
+    assert coeffs == (5/12, -16/12, 23/12)
+
+    # more nodes than functions: minimum-norm coefficients
+    exact_coeffs = _static_func_family_coefficients(
+            family, (-3, -2, -1, 0), rhs_values, exact=True)
+    float_coeffs = _static_func_family_coefficients(
+            family, (-3, -2, -1, 0), rhs_values, exact=False)
+    assert la.norm(np.array(exact_coeffs) - np.array(float_coeffs)) < 1e-13
+
+
+def test_static_coefficients_unhashable_family(order=3):
+    from leap.multistep import (
+            AdamsBashforthMethodBuilder,
+            AdamsMonomialIntegrationFunctionFamily)
+
+    class UnhashableFamily(AdamsMonomialIntegrationFunctionFamily):
+        # defining __eq__ without __hash__ makes instances unhashable
+        def __eq__(self, other):
+            return type(self) is type(other) and self.order == other.order
+
+    with pytest.raises(TypeError):
+        hash(UnhashableFamily(order))
+
+    def generate(function_family):
+        return str(AdamsBashforthMethodBuilder("y",
+            function_family=function_family, static_dt=True).generate())
+
+    # the coefficients are computed without the cache
+    assert (generate(UnhashableFamily(order))
+            == generate(AdamsMonomialIntegrationFunctionFamily(order)))
+
+
+@pytest.mark.parametrize("static_dt", [True, False])
+@pytest.mark.parametrize("step_ratio", [2, 5])
+def test_rolled_substeps_identical(python_method_impl, static_dt, step_ratio,
+        order=3):
+    def make_method(rolled_substeps):
+        return MultiRateMultiStepMethodBuilder(
+                order,
+                (
+                    (
+                        "dt", "fast", "=",
+                        MRHistory(1, "<func>f", ("fast", "slow",)),
+                        MRHistory(step_ratio, "<func>f2", ("fast",),
+                            hist_length=order+1),
+                        ),
+                    (
+                        "dt", "slow", "=",
+                        MRHistory(step_ratio, "<func>s", ("fast", "slow")),
+                        ),
+                    ),
+                static_dt=static_dt,
+                rolled_substeps=rolled_substeps)
+
+    results = []
+    for rolled_substeps in [False, True]:
+        code = make_method(rolled_substeps).generate()
+
+        stepper = python_method_impl(code, function_map={
+            "<func>f": lambda t, fast, slow: slow,
+            "<func>f2": lambda t, fast: fast,
+            "<func>s": lambda t, fast, slow: -fast + slow,
+            })
+        stepper.set_up(t_start=0, dt_start=0.05,
+                context={"fast": np.sin(0), "slow": np.cos(0)})
+
+        values = []
+        for event in stepper.run(t_end=2):
+            if isinstance(event, stepper.StateComputed):
+                values.append(event.state_component)
+
+        results.append(np.array(values))
+
+    assert len(results[0]) == len(results[1])
+    assert la.norm(results[0] - results[1]) < 1e-12 * la.norm(results[0])
+
+
+@pytest.mark.parametrize("static_dt", [True, False])
+def test_rolled_substeps_events(python_method_impl, static_dt, step_ratio=3,
+        order=3, dt=0.1):
+    code = MultiRateMultiStepMethodBuilder(
+            order,
+            (
+                ("dt", "fast", "=", MRHistory(1, "<func>f", ("fast", "slow"))),
+                ("dt", "slow", "=",
+                    MRHistory(step_ratio, "<func>s", ("fast", "slow"))),
+                ),
+            static_dt=static_dt,
+            rolled_substeps=True).generate()
+
+    stepper = python_method_impl(code, function_map={
+        "<func>f": lambda t, fast, slow: slow,
+        "<func>s": lambda t, fast, slow: -fast + slow,
+        })
+    stepper.set_up(t_start=0, dt_start=dt,
+            context={"fast": np.sin(0), "slow": np.cos(0)})
+
+    max_steps = 40
+    events = []
+    for event in stepper.run(max_steps=max_steps):
+        if isinstance(event, stepper.StepCompleted):
+            events.append(("step", event.next_phase, event.t))
+        elif (isinstance(event, stepper.StateComputed)
+                and event.component_id == "fast"):
+            events.append(("state", None, event.t))
+
+    # max_steps counts the executions of each phase
+    assert sum(1 for kind, _, _ in events if kind == "step") == max_steps
+
+    # In the primary phase, each substep is a step, and the state is only
+    # yielded and <t> only advanced at the end of a step of size <dt>.
+    # The last bootstrap step only switches to the primary phase.
+    istart = [next_phase for _, next_phase, _ in events].index("primary") + 1
+    primary_events = events[istart:]
+    t_start = primary_events[0][2]
+
+    expected_events = []
+    for istep in range(len(primary_events) // (step_ratio + 1) + 1):
+        t = t_start + istep * dt
+        expected_events.extend(
+                [("step", "primary", t)] * (step_ratio - 1)
+                + [("state", None, t + dt), ("step", "primary", t + dt)])
+
+    assert len(primary_events) > 2 * (step_ratio + 1)
+    for (kind, next_phase, t), (ref_kind, ref_next_phase, ref_t) in zip(
+            primary_events, expected_events):
+        assert (kind, next_phase) == (ref_kind, ref_next_phase)
+        assert abs(t - ref_t) < 1e-12
+
+
+def test_rolled_substeps_code_size(order=3):
+    def phase_sizes(step_ratio):
+        code = MultiRateMultiStepMethodBuilder(
+                order,
+                (
+                    ("dt", "fast", "=", MRHistory(1, "<func>f", ("fast", "slow"))),
+                    ("dt", "slow", "=",
+                        MRHistory(step_ratio, "<func>s", ("fast", "slow"))),
+                    ),
+                rolled_substeps=True).generate()
+
+        return dict(
+                (name, len(phase.statements))
+                for name, phase in code.phases.items())
+
+    assert phase_sizes(2) == phase_sizes(16)
+
+
+def test_parallel_rhs_groups(step_ratio=3, order=3):
+    code = MultiRateMultiStepMethodBuilder(
+            order,
+            (
+                (
+                    "dt", "fast", "=",
+                    MRHistory(1, "<func>f2f", ("fast", "slow")),
+                    MRHistory(step_ratio, "<func>s2f", ("fast", "slow")),
+                    ),
+                (
+                    "dt", "slow", "=",
+                    MRHistory(step_ratio, "<func>f2s", ("fast", "slow")),
+                    MRHistory(step_ratio, "<func>s2s", ("fast", "slow")),
+                    ),
+                ),
+            parallel_rhs_calls=True).generate()
+
+    primary = code.phases["primary"]
+
+    groups = {}
+    for stmt in primary.statements:
+        if hasattr(stmt, "parallel_group"):
+            groups.setdefault(stmt.parallel_group, set()).add(stmt.function_id)
+
+    # f2f alone at the intermediate substeps, then all four at the last one
+    assert [groups[i] for i in sorted(groups)] == (
+            [{"<func>f2f"}] * (step_ratio - 1)
+            + [{"<func>f2f", "<func>s2f", "<func>f2s", "<func>s2s"}])
+
+    # statements in a group do not depend on each other
+    id_to_stmt = primary.id_to_stmt
+
+    def get_all_deps(stmt_id, result):
+        for dep_id in id_to_stmt[stmt_id].depends_on:
+            if dep_id not in result:
+                result.add(dep_id)
+                get_all_deps(dep_id, result)
+        return result
+
+    for stmt in primary.statements:
+        if hasattr(stmt, "parallel_group"):
+            for dep_id in get_all_deps(stmt.id, set()):
+                assert getattr(id_to_stmt[dep_id], "parallel_group",
+                        None) != stmt.parallel_group
+
+
+def test_parallel_rhs_calls_run_concurrently(step_ratio=3, order=3):
+    import threading
+    from dagrt.exec_numpy import NumpyInterpreter
+    from leap.parallel import ThreadedNumpyInterpreter
+
+    # f' = f+s, s' = -f+s
+    code = MultiRateMultiStepMethodBuilder(
+            order,
+            (
+                (
+                    "dt", "fast", "=",
+                    MRHistory(1, "<func>f2f", ("fast", "slow")),
+                    MRHistory(step_ratio, "<func>s2f", ("fast", "slow")),
+                    ),
+                (
+                    "dt", "slow", "=",
+                    MRHistory(step_ratio, "<func>f2s", ("fast", "slow")),
+                    MRHistory(step_ratio, "<func>s2s", ("fast", "slow")),
+                    ),
+                ),
+            parallel_rhs_calls=True).generate()
+
+    def run(interp, final_t=1):
+        interp.set_up(t_start=0, dt_start=0.05,
+                context={"fast": np.sin(0), "slow": np.cos(0)})
+
+        result = []
+        for event in interp.run(t_end=final_t):
+            if isinstance(event, interp.StateComputed):
+                result.append((event.t, event.component_id, event.state_component))
+
+        return result
+
+    function_map = {
+            "<func>f2f": lambda t, fast, slow: fast,
+            "<func>s2f": lambda t, fast, slow: slow,
+            "<func>f2s": lambda t, fast, slow: -fast,
+            "<func>s2s": lambda t, fast, slow: slow,
+            }
+
+    # The slow right-hand sides are always evaluated in the same group. Each
+    # of them only returns once all three have been called, which does not
+    # happen if they are called one after the other.
+    barrier = threading.Barrier(3, timeout=10)
+
+    def wait_for_group(func):
+        def wrapper(*args, **kwargs):
+            barrier.wait()
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    threaded_function_map = function_map.copy()
+    for name in ["<func>s2f", "<func>f2s", "<func>s2s"]:
+        threaded_function_map[name] = wait_for_group(function_map[name])
+
+    interp = ThreadedNumpyInterpreter(code, threaded_function_map,
+            max_workers=4)
+    try:
+        threaded_result = run(interp)
+    finally:
+        interp.shutdown()
+
+    serial_result = run(NumpyInterpreter(code, function_map))
+
+    assert len(threaded_result) == len(serial_result)
+    for (t, comp, state), (ref_t, ref_comp, ref_state) in zip(
+            threaded_result, serial_result):
+        assert (t, comp) == (ref_t, ref_comp)
+        assert state == ref_state
+
+    t, _, fast = [entry for entry in serial_result if entry[1] == "fast"][-1]
+    assert abs(fast - np.exp(t)*np.sin(t)) < 1e-3
+
+
+def test_topological_sort():
+    from leap.multistep.multirate import _topologically_sort_comp_names_and_rhss
+
+    rhss = [
+            (MRHistory(1, "<func>a", ("b", "fast")),),
+            (MRHistory(1, "<func>b", ("c",)),),
+            (MRHistory(1, "<func>c", ("fast",)),),
+            ]
+
+    names, sorted_rhss = _topologically_sort_comp_names_and_rhss(
+            ["a", "b", "c"], rhss)
+    assert names == ["c", "b", "a"]
+    assert sorted_rhss == rhss[::-1]
+
+    with pytest.raises(ValueError):
+        _topologically_sort_comp_names_and_rhss(["a", "b"], [
+            (MRHistory(1, "<func>a", ("b",)),),
+            (MRHistory(1, "<func>b", ("a",)),),
+            ])
+
+
+def _make_hist_consistency_method(order=3, step_ratio=3, **kwargs):
+    return MultiRateMultiStepMethodBuilder(
+            order,
+            (
+                (
+                    "dt", "fast", "=",
+                    MRHistory(1, "<func>f", ("fast", "slow",)),
+                    ),
+                (
+                    "dt", "slow", "=",
+                    MRHistory(step_ratio, "<func>s", ("fast", "slow"),
+                        rhs_policy=rhs_policy.late),
+                    ),
+                ),
+            hist_consistency_threshold=1e-8,
+            **kwargs)
+
+
+@pytest.mark.parametrize("hist_consistency_check", ["rhs", "checksum", None])
+@pytest.mark.parametrize("hist_consistency_interval", [1, 3])
+def test_hist_consistency_check_modes(python_method_impl,
+        hist_consistency_check, hist_consistency_interval):
+    ncalls = {"f": 0, "s": 0}
+
+    def f(t, fast, slow):
+        ncalls["f"] += 1
+        return slow
+
+    def s(t, fast, slow):
+        ncalls["s"] += 1
+        return -fast
+
+    results = {}
+    for check, interval in [(hist_consistency_check, hist_consistency_interval),
+            (None, 1)]:
+        code = _make_hist_consistency_method(
+                hist_consistency_check=check,
+                hist_consistency_interval=interval).generate()
+
+        if check != "rhs":
+            assert "test_rhs" not in str(code)
+
+        ncalls.update(f=0, s=0)
+        stepper = python_method_impl(code, function_map={
+            "<func>f": f, "<func>s": s})
+        stepper.set_up(t_start=0, dt_start=0.05,
+                context={"fast": np.sin(0), "slow": np.cos(0)})
+
+        values = []
+        # the last bootstrap step also switches to the primary phase
+        nsteps = -1
+        for event in stepper.run(t_end=3):
+            if isinstance(event, stepper.StateComputed):
+                values.append(event.state_component)
+            elif (isinstance(event, stepper.StepCompleted)
+                    and event.next_phase == "primary"):
+                nsteps += 1
+
+        results[check, interval] = (np.array(values), dict(ncalls), nsteps)
+
+    values, ncalls_checked, nsteps = \
+            results[hist_consistency_check, hist_consistency_interval]
+    ref_values, ncalls_unchecked, _ = results[None, 1]
+
+    assert la.norm(values - ref_values) < 1e-12 * la.norm(ref_values)
+
+    if hist_consistency_check == "rhs":
+        nchecks = -(-nsteps // hist_consistency_interval)
+        assert ncalls_checked == {
+                "f": ncalls_unchecked["f"] + nchecks,
+                "s": ncalls_unchecked["s"] + nchecks}
+    else:
+        assert ncalls_checked == ncalls_unchecked
+
+
+@pytest.mark.parametrize("change", ["shift", "sign_flip"])
+def test_hist_consistency_checksum_detects_change(change):
+    from leap.multistep.multirate import InconsistentHistoryError
+    from dagrt.exec_numpy import NumpyInterpreter
+
+    code = _make_hist_consistency_method(
+            hist_consistency_check="checksum").generate()
+
+    interp = NumpyInterpreter(code, function_map={
+        "<func>f": lambda t, fast, slow: slow,
+        "<func>s": lambda t, fast, slow: -fast,
+        })
+    interp.set_up(t_start=0, dt_start=0.05,
+            context={
+                "fast": np.array([0.5, 1.0]),
+                "slow": np.array([1.0, 0.5])})
+
+    with pytest.raises(InconsistentHistoryError):
+        for event in interp.run(t_end=3):
+            if (isinstance(event, interp.StepCompleted)
+                    and event.next_phase == "primary"):
+                if change == "shift":
+                    interp.context["<state>fast"] = \
+                            interp.context["<state>fast"] + 1e-3
+                elif change == "sign_flip":
+                    # preserves the norm of the state
+                    interp.context["<state>fast"] = \
+                            -interp.context["<state>fast"]
+                else:
+                    raise ValueError(change)
+
+    with pytest.raises(ValueError):
+        _make_hist_consistency_method(hist_consistency_check="norm")
+
+
+def test_hist_consistency_checksum_zero_state():
+    # An identically zero component has zero checksum, which must not be
+    # mistaken for a change to the state.
+    from dagrt.exec_numpy import NumpyInterpreter
+
+    code = _make_hist_consistency_method(
+            hist_consistency_check="checksum").generate()
+
+    interp = NumpyInterpreter(code, function_map={
+        "<func>f": lambda t, fast, slow: 0*fast,
+        "<func>s": lambda t, fast, slow: -fast,
+        })
+    interp.set_up(t_start=0, dt_start=0.05,
+            context={"fast": np.zeros(3), "slow": np.ones(3)})
+
+    nsteps = 0
+    for event in interp.run(t_end=1):
+        if isinstance(event, interp.StepCompleted):
+            nsteps += 1
+
+    assert nsteps > 1
+    assert la.norm(interp.context["<state>fast"]) == 0
+
+
+def test_adaptive_multirate(python_method_impl, order=3, step_ratio=3):
+    def make_method(**kwargs):
+        return MultiRateMultiStepMethodBuilder(
+                order,
+                (
+                    (
+                        "dt", "fast", "=",
+                        MRHistory(1, "<func>f", ("fast", "slow",)),
+                        ),
+                    (
+                        "dt", "slow", "=",
+                        MRHistory(step_ratio, "<func>s", ("fast", "slow")),
+                        ),
+                    ),
+                **kwargs)
+
+    errors = []
+    for tol in [1e-5, 1e-7]:
+        code = make_method(atol=tol, rtol=tol).generate()
+
+        stepper = python_method_impl(code, function_map={
+            "<func>f": lambda t, fast, slow: slow,
+            "<func>s": lambda t, fast, slow: -fast,
+            })
+        stepper.set_up(t_start=0, dt_start=1e-3,
+                context={"fast": np.sin(0), "slow": np.cos(0)})
+
+        times = []
+        values = []
+        nfailed = 0
+        for event in stepper.run(t_end=5):
+            if isinstance(event, stepper.StateComputed):
+                if event.component_id == "fast":
+                    times.append(event.t)
+                    values.append(event.state_component)
+            elif isinstance(event, stepper.StepFailed):
+                nfailed += 1
+
+        step_sizes = np.diff(times)
+        print("steps: %d - failed: %d - largest step: %g"
+                % (len(step_sizes), nfailed, np.max(step_sizes)))
+
+        assert times[-1] >= 5
+        assert np.max(step_sizes) > 10 * step_sizes[0]
+
+        errors.append(abs(values[-1] - np.sin(times[-1])))
+
+    # tightening the tolerance decreases the error
+    assert errors[0] > 10 * errors[1]
+
+    with pytest.raises(ValueError):
+        make_method(rtol=1e-6, static_dt=True)
+
+
+@pytest.mark.parametrize("order", [2, 3, 4])
+def test_multirate_bootstrap(python_method_impl, order, step_ratio=5):
+    def make_method(multirate_bootstrap):
+        return MultiRateMultiStepMethodBuilder(
+                order,
+                (
+                    (
+                        "dt", "fast", "=",
+                        MRHistory(1, "<func>f", ("fast", "slow",)),
+                        MRHistory(step_ratio, "<func>s2f", ("slow",)),
+                        ),
+                    (
+                        "dt", "slow", "=",
+                        MRHistory(step_ratio, "<func>s", ("fast", "slow")),
+                        ),
+                    ),
+                hist_consistency_threshold=1e-8,
+                multirate_bootstrap=multirate_bootstrap)
+
+    ncalls = {}
+
+    def counted(name, f):
+        def wrapper(*args, **kwargs):
+            ncalls[name] += 1
+            return f(*args, **kwargs)
+        return wrapper
+
+    function_map = {
+            "<func>f": counted("f", lambda t, fast, slow: slow/2),
+            "<func>s2f": counted("s2f", lambda t, slow: slow/2),
+            "<func>s": counted("s", lambda t, fast, slow: -fast),
+            }
+
+    errors = {}
+    bootstrap_ncalls = {}
+    for multirate_bootstrap in [False, True]:
+        for dt in [2**-4, 2**-5]:
+            code = make_method(multirate_bootstrap).generate()
+
+            ncalls.update(f=0, s2f=0, s=0)
+            stepper = python_method_impl(code, function_map=function_map)
+            stepper.set_up(t_start=0, dt_start=dt,
+                    context={"fast": np.sin(0), "slow": np.cos(0)})
+
+            times = []
+            values = []
+            for event in stepper.run(t_end=1):
+                if isinstance(event, stepper.StateComputed):
+                    if event.component_id == "fast":
+                        times.append(event.t)
+                        values.append(event.state_component)
+                elif (isinstance(event, stepper.StepCompleted)
+                        and event.next_phase == "primary"
+                        and multirate_bootstrap not in bootstrap_ncalls):
+                    bootstrap_ncalls[multirate_bootstrap] = dict(ncalls)
+
+            errors[multirate_bootstrap, dt] = abs(
+                    values[-1] - np.sin(times[-1]))
+
+    from leap.rk import ORDER_TO_RK_METHOD_BUILDER
+    nstages = len(ORDER_TO_RK_METHOD_BUILDER[order].c)
+
+    # Each of the order - 1 bootstrap steps takes step_ratio RK steps, and
+    # the right-hand sides are evaluated once more before switching to the
+    # primary phase. With the multirate bootstrap, the slow right-hand sides
+    # are only evaluated in the first order - 1 substeps, and at the start
+    # of the next one.
+    nsteps = order - 1
+    assert bootstrap_ncalls[False] == {
+            "f": nsteps * step_ratio * nstages + 1,
+            "s2f": nsteps * step_ratio * nstages + 1,
+            "s": nsteps * step_ratio * nstages + 1,
+            }
+    assert bootstrap_ncalls[True] == {
+            "f": nsteps * step_ratio * nstages + 1,
+            "s2f": nsteps * ((order - 1) * nstages + 1) + 1,
+            "s": nsteps * ((order - 1) * nstages + 1) + 1,
+            }
+
+    for multirate_bootstrap in [False, True]:
+        eoc = np.log2(errors[multirate_bootstrap, 2**-4]
+                / errors[multirate_bootstrap, 2**-5])
+        assert eoc > 0.9 * order
+
+    assert errors[True, 2**-5] < 2 * errors[False, 2**-5]
+
+
+@pytest.mark.parametrize(("method_class", "expected_order"), [
+    ("MRIGARKERK22aMethodBuilder", 2),
+    ("MRIGARKERK22bMethodBuilder", 2),
+    ("MRIGARKERK33aMethodBuilder", 3),
+    ("MISMethodBuilder", 2),
+    ])
+def test_mri_accuracy(python_method_impl, method_class, expected_order,
+        step_ratio=4):
+    import leap.rk.multirate as mri
+    from multirate_test_systems import Full
+    ode = Full()
+
+    method = getattr(mri, method_class)((
+        ("dt", "fast", "=",
+            MRHistory(1, "<func>f2f", ("fast",)),
+            MRHistory(step_ratio, "<func>s2f", ("slow",))),
+        ("dt", "slow", "=",
+            MRHistory(step_ratio, "<func>f2s", ("fast",)),
+            MRHistory(step_ratio, "<func>s2s", ("slow",))),
+        ))
+    code = method.generate()
+
+    from pytools.convergence import EOCRecorder
+    eocrec = EOCRecorder()
+
+    nstages = len(method.c) - 1
+
+    for n in range(4, 7):
+        dt = 2**(-n)
+        ncalls = {"f2f": 0, "s2f": 0}
+
+        def counted(name):
+            rhs = getattr(ode, name + "_rhs")
+
+            def wrapper(t, fast=None, slow=None):
+                ncalls[name] += 1
+                return rhs(t, fast, slow)
+
+            return wrapper
+
+        interp = python_method_impl(code, function_map={
+            "<func>f2f": counted("f2f"),
+            "<func>s2f": counted("s2f"),
+            "<func>f2s": lambda t, fast: ode.f2s_rhs(t, fast, None),
+            "<func>s2s": lambda t, slow: ode.s2s_rhs(t, None, slow),
+            })
+        interp.set_up(t_start=ode.t_start, dt_start=dt,
+                context={"fast": ode.initial_values[0],
+                    "slow": ode.initial_values[1]})
+
+        nsteps = 0
+        for event in interp.run(t_end=ode.t_end):
+            if isinstance(event, interp.StateComputed):
+                if event.component_id == "fast":
+                    nsteps += 1
+                    fast = event.state_component
+                else:
+                    slow = event.state_component
+
+        assert abs(event.t - ode.t_end) < 1e-10
+
+        # one slow evaluation per stage, and at least step_ratio fast
+        # steps per macro step
+        assert ncalls["s2f"] == nsteps * nstages
+        assert ncalls["f2f"] >= nsteps * step_ratio
+
+        eocrec.add_data_point(dt, np.hypot(
+            fast - ode.soln_0(event.t), slow - ode.soln_1(event.t)))
+
+    print(eocrec.pretty_print())
+    assert eocrec.estimate_order_of_convergence()[0, 1] > 0.9 * expected_order
+
+
+@pytest.mark.parametrize("method_class", [
+    "MRIGARKERK22aMethodBuilder",
+    "MRIGARKERK22bMethodBuilder",
+    "MRIGARKERK33aMethodBuilder",
+    "MISMethodBuilder",
+    ])
+def test_mri_rolled_fast_steps(python_method_impl, method_class,
+        step_ratio=4):
+    import leap.rk.multirate as mri
+    from multirate_test_systems import Full
+    ode = Full()
+
+    def make_method(step_ratio, rolled_fast_steps):
+        return getattr(mri, method_class)((
+            ("dt", "fast", "=",
+                MRHistory(1, "<func>f2f", ("fast",)),
+                MRHistory(step_ratio, "<func>s2f", ("slow",))),
+            ("dt", "slow", "=",
+                MRHistory(step_ratio, "<func>f2s", ("fast",)),
+                MRHistory(step_ratio, "<func>s2s", ("slow",))),
+            ), rolled_fast_steps=rolled_fast_steps)
+
+    def count_statements(code):
+        return sum(len(phase.statements) for phase in code.phases.values())
+
+    # The size of the rolled code does not depend on the step ratio.
+    assert (count_statements(make_method(4, True).generate())
+            == count_statements(make_method(40, True).generate()))
+    assert (count_statements(make_method(40, False).generate())
+            > 5 * count_statements(make_method(4, False).generate()))
+
+    method = make_method(step_ratio, True)
+
+    # one fast step per execution of a phase
+    nfast_steps = sum(
+            method.get_nfast_steps(delta_c) if delta_c else 1
+            for delta_c in np.diff(method.c))
+
+    results = {}
+    for rolled_fast_steps in [False, True]:
+        code = make_method(step_ratio, rolled_fast_steps).generate()
+        interp = python_method_impl(code, function_map={
+            "<func>f2f": lambda t, fast: ode.f2f_rhs(t, fast, None),
+            "<func>s2f": lambda t, slow: ode.s2f_rhs(t, None, slow),
+            "<func>f2s": lambda t, fast: ode.f2s_rhs(t, fast, None),
+            "<func>s2s": lambda t, slow: ode.s2s_rhs(t, None, slow),
+            })
+        interp.set_up(t_start=ode.t_start, dt_start=2**-4,
+                context={"fast": ode.initial_values[0],
+                    "slow": ode.initial_values[1]})
+
+        states = []
+        for event in interp.run(max_steps=3*nfast_steps + 1):
+            if isinstance(event, interp.StateComputed):
+                states.append(
+                        (event.t, event.component_id, event.state_component))
+
+        results[rolled_fast_steps] = states
+
+    # With rolled fast steps, max_steps counts the initialization phase and
+    # the fast steps, and states are only yielded at the end of each step of
+    # size <dt>.
+    assert len(results[True]) == 2 * 3
+    assert len(results[False]) == 2 * (3*nfast_steps + 1)
+
+    for (t, comp, state), (ref_t, ref_comp, ref_state) in zip(
+            results[True], results[False]):
+        assert (comp, abs(t - ref_t)) == (ref_comp, 0)
+        assert abs(state - ref_state) < 1e-12 * abs(ref_state)
+
+
+@pytest.mark.parametrize("builder_kwargs", [
+    {},
+    {"static_dt": True},
+    {"atol": 1e-5},
+    {"multirate_bootstrap": True},
+    ])
+@pytest.mark.parametrize("slow_policy", [rhs_policy.late, rhs_policy.early])
+def test_simplified_code_identical(python_method_impl, builder_kwargs,
+        slow_policy, order=3, step_ratio=4):
+    code = MultiRateMultiStepMethodBuilder(
+            order,
+            (
+                (
+                    "dt", "fast", "=",
+                    MRHistory(1, "<func>f2f", ("fast", "slow")),
+                    MRHistory(step_ratio, "<func>s2f", ("fast", "slow"),
+                        rhs_policy=slow_policy),
+                    ),
+                (
+                    "dt", "slow", "=",
+                    MRHistory(step_ratio, "<func>f2s", ("fast", "slow"),
+                        rhs_policy=slow_policy),
+                    MRHistory(step_ratio, "<func>s2s", ("fast", "slow"),
+                        rhs_policy=slow_policy),
+                    ),
+                ),
+            **builder_kwargs).generate()
+
+    from leap.transform import propagate_copies, eliminate_dead_code
+    simplified_code = eliminate_dead_code(propagate_copies(code))
+
+    def get_nvars(dag):
+        return len(set(
+            name
+            for phase in dag.phases.values()
+            for stmt in phase.statements
+            for name in stmt.get_written_variables()))
+
+    assert get_nvars(simplified_code) < get_nvars(code)
+
+    from multirate_test_systems import Full
+    ode = Full()
+
+    results = []
+    for dag in [code, simplified_code]:
+        interp = python_method_impl(dag, function_map={
+            "<func>f2f": lambda t, fast, slow: ode.f2f_rhs(t, fast, slow),
+            "<func>s2f": lambda t, fast, slow: ode.s2f_rhs(t, fast, slow),
+            "<func>f2s": lambda t, fast, slow: ode.f2s_rhs(t, fast, slow),
+            "<func>s2s": lambda t, fast, slow: ode.s2s_rhs(t, fast, slow),
+            })
+        interp.set_up(t_start=ode.t_start, dt_start=2**-5,
+                context={"fast": ode.initial_values[0],
+                    "slow": ode.initial_values[1]})
+
+        results.append([
+            (event.t, event.component_id, event.state_component)
+            for event in interp.run(t_end=ode.t_end)
+            if isinstance(event, interp.StateComputed)])
+
+    assert results[0] == results[1]
+
+
 def test_dependent_state(order=3, step_ratio=3):
     # Solve
     # f' = f+s
@@ -584,6 +1468,92 @@ def test_dependent_state(order=3, step_ratio=3):
     assert orderest > 3*0.95
 
 
+@pytest.mark.parametrize(("invalidating_func", "recomputed_comps"), [
+    (None, set()),
+    # two_fast and slow take fast as an argument
+    ("<func>f", {"two_fast", "slow"}),
+    # fast and slow take slow as an argument, but fast is not needed again
+    # at the end of the step, and two_fast does not take slow
+    ("<func>s", {"slow"}),
+    ])
+def test_invalidate_computed_state(python_method_impl, invalidating_func,
+        recomputed_comps, order=3, step_ratio=3):
+    # f' = f+s
+    # s' = -f+s
+
+    def make_code(invalidating_func):
+        def make_history(interval, func_name, arguments):
+            return MRHistory(interval, func_name, arguments,
+                    invalidate_computed_state=func_name == invalidating_func)
+
+        return MultiRateMultiStepMethodBuilder(
+                    order,
+                    (
+                        (
+                            "dt", "fast", "=",
+                            make_history(1, "<func>f", ("two_fast", "slow",)),
+                            ),
+                        (
+                            "dt", "slow", "=",
+                            make_history(step_ratio, "<func>s", ("fast", "slow"))
+                            ),
+                        (
+                            "two_fast", "=",
+                            make_history(step_ratio, "<func>twice", ("fast",)),
+                            ),
+                        ),
+                    static_dt=True).generate()
+
+    def count_states_at_step_end(code):
+        from collections import Counter
+        counts = Counter()
+        for stmt in code.phases["primary"].statements:
+            for name in stmt.get_written_variables():
+                for comp_name in ["fast", "slow", "two_fast"]:
+                    if name.startswith(
+                            "state_%s_sub%d" % (comp_name, step_ratio)):
+                        counts[comp_name] += 1
+        return counts
+
+    code = make_code(invalidating_func)
+    ref_code = make_code(None)
+
+    # Evaluating the right-hand side at the end of the step forces the
+    # components that take its component as an argument to be recomputed
+    # when they are needed again.
+    counts = count_states_at_step_end(code)
+    ref_counts = count_states_at_step_end(ref_code)
+    assert set(
+            comp_name
+            for comp_name in ref_counts
+            if counts[comp_name] > ref_counts[comp_name]) == recomputed_comps
+
+    # The recomputed states are as accurate as the original ones.
+    true_states = {
+            "fast": lambda t: np.exp(t)*np.sin(t),
+            "slow": lambda t: np.exp(t)*np.cos(t),
+            }
+
+    errors = []
+    for dag in [code, ref_code]:
+        interp = python_method_impl(dag, function_map={
+            "<func>f": lambda t, two_fast, slow: 0.5*two_fast + slow,
+            "<func>s": lambda t, fast, slow: -fast + slow,
+            "<func>twice": lambda t, fast: 2*fast,
+            })
+        interp.set_up(t_start=0, dt_start=2**-4,
+                context={"fast": true_states["fast"](0),
+                    "slow": true_states["slow"](0)})
+
+        errors.append(max(
+            abs(event.state_component - true_states[event.component_id](event.t))
+            for event in interp.run(t_end=1)
+            if isinstance(event, interp.StateComputed)))
+
+    assert errors[0] < 1e-3
+    assert errors[0] < 2*errors[1]
+
+
 if __name__ == "__main__":
     import sys
     if len(sys.argv) > 1:
@@ -36,6 +36,9 @@ from leap.rk import (
         RK3MethodBuilder, RK4MethodBuilder, RK5MethodBuilder,
         LSRK4MethodBuilder,)
 from leap.rk.imex import KennedyCarpenterIMEXARK4MethodBuilder
+from leap.rk.extrapolation import (
+        EulerExtrapolationMethodBuilder, GraggBulirschStoerMethodBuilder)
+from leap.rk.stabilized import RKC1MethodBuilder, RKC2MethodBuilder
 import numpy as np
 
 import logging
@@ -66,6 +69,8 @@ logger = logging.getLogger(__name__)
     (LSRK4MethodBuilder("y"), 4),
     (KennedyCarpenterIMEXARK4MethodBuilder("y", use_implicit=False,
         explicit_rhs_name="y"), 4),
+    (EulerExtrapolationMethodBuilder("y", nrows=3), 3),
+    (GraggBulirschStoerMethodBuilder("y", nrows=2), 4),
     ])
 def test_rk_accuracy(python_method_impl, method, expected_order,
                      show_dag=False, plot_solution=False):
@@ -77,6 +82,77 @@ def test_rk_accuracy(python_method_impl, method, expected_order,
 # }}}
 
 
+# {{{ FSAL inference test
+
+def test_rk_fsal_inference(python_method_impl):
+    from leap.rk import SimpleButcherTableauMethodBuilder
+
+    class BogackiShampine3MethodBuilder(SimpleButcherTableauMethodBuilder):
+        c = ODE23MethodBuilder.c
+        a_explicit = ODE23MethodBuilder.a_explicit
+        output_coeffs = ODE23MethodBuilder.high_order_coeffs
+
+    code = BogackiShampine3MethodBuilder("y").generate()
+    assert "<p>last_rhs_explicit" in code.existing_var_names()
+
+    nrhs_evals = [0]
+
+    def rhs(t, y):
+        nrhs_evals[0] += 1
+        return -y
+
+    nsteps = 10
+    interp = python_method_impl(code, function_map={"<func>y": rhs})
+    interp.set_up(t_start=0, dt_start=0.1, context={"y": 1.})
+
+    for event in interp.run(max_steps=nsteps+1):
+        pass
+
+    # one evaluation for the initial phase, three for every step
+    assert nrhs_evals[0] == 1 + 3*nsteps
+
+    # not FSAL: the last stage is not evaluated at the output state
+    code = RK4MethodBuilder("y").generate()
+    assert "<p>last_rhs_explicit" not in code.existing_var_names()
+
+
+@pytest.mark.parametrize("method", [
+    ODE23MethodBuilder("y", rtol=1e-6, use_high_order=False),
+    ODE45MethodBuilder("y", rtol=1e-6, use_high_order=False),
+    ])
+def test_adaptive_first_stage_reuse(python_method_impl, method):
+    code = method.generate()
+    assert "<p>last_rhs_explicit" in code.existing_var_names()
+
+    nrhs_evals = [0]
+
+    def rhs(t, y):
+        nrhs_evals[0] += 1
+        return -y
+
+    interp = python_method_impl(code, function_map={"<func>y": rhs})
+    interp.set_up(t_start=0, dt_start=10, context={"y": 1.})
+
+    naccepted = 0
+    nrejected = 0
+    for event in interp.run(t_end=1):
+        if isinstance(event, interp.StepCompleted):
+            naccepted += 1
+        elif isinstance(event, interp.StepFailed):
+            nrejected += 1
+
+    assert nrejected > 0
+
+    # The initial phase counts as a completed step. It evaluates one RHS,
+    # accepted steps evaluate all stages, and rejected steps all stages but
+    # the first.
+    nstages = len(method.c)
+    assert nrhs_evals[0] == (
+            1 + (naccepted-1)*nstages + nrejected*(nstages-1))
+
+# }}}
+
+
 # {{{ adaptive test
 
 @pytest.mark.parametrize("method", [
@@ -84,6 +160,7 @@ def test_rk_accuracy(python_method_impl, method, expected_order,
     ODE45MethodBuilder("y", rtol=1e-6),
     KennedyCarpenterIMEXARK4MethodBuilder("y", rtol=1e-6, use_implicit=False,
         explicit_rhs_name="y"),
+    GraggBulirschStoerMethodBuilder("y", nrows=6, rtol=1e-6),
     ])
 def test_adaptive_timestep(python_method_impl, method, show_dag=False,
                            plot=False):
@@ -162,6 +239,180 @@ def test_adaptive_timestep(python_method_impl, method, show_dag=False,
 # }}}
 
 
+# {{{ extrapolation work test
+
+def test_extrapolation_work(python_method_impl, rtol=1e-12):
+    from utils import DefaultProblem
+    problem = DefaultProblem()
+
+    def run(method):
+        nevals = [0]
+
+        def rhs(t, y):
+            nevals[0] += 1
+            return problem(t, y)
+
+        interp = python_method_impl(method.generate(),
+                function_map={"<func>y": rhs})
+        interp.set_up(t_start=problem.t_start, dt_start=1e-3,
+                context={"y": problem.initial()})
+
+        for event in interp.run(t_end=problem.t_end):
+            if isinstance(event, interp.StateComputed):
+                last_event = event
+
+        assert last_event.t >= problem.t_end
+        error = abs(last_event.state_component[0] - problem.exact(last_event.t))
+        return nevals[0], error
+
+    ode45_nevals, ode45_error = run(ODE45MethodBuilder("y", rtol=rtol))
+    gbs_nevals, gbs_error = run(
+            GraggBulirschStoerMethodBuilder("y", nrows=8, rtol=rtol))
+    low_order_nevals, _ = run(
+            GraggBulirschStoerMethodBuilder("y", nrows=3, rtol=rtol))
+
+    print(ode45_nevals, gbs_nevals, low_order_nevals)
+
+    # At a tight tolerance on a smooth problem, choosing the number of rows
+    # adaptively reaches a smaller error with fewer right-hand side
+    # evaluations than a fixed tableau, and than with few rows.
+    assert gbs_error < ode45_error
+    assert gbs_nevals < 0.6 * ode45_nevals
+    assert 2 * gbs_nevals < low_order_nevals
+
+# }}}
+
+
+# {{{ ensemble test
+
+@pytest.mark.parametrize("method", [
+    ODE23MethodBuilder("y", rtol=1e-8, ensemble=True),
+    ODE45MethodBuilder("y", rtol=1e-8, ensemble=True),
+    ])
+def test_ensemble_adaptive_timestep(python_method_impl, method):
+    from leap.ensemble import make_ensemble_function_map
+
+    decay_rates = np.array([1, 10, 100], dtype=np.float64)
+
+    def rhs(t, y):
+        assert t.shape == (len(decay_rates), 1)
+        return -decay_rates.reshape(-1, 1)*y
+
+    function_map = make_ensemble_function_map()
+    function_map["<func>y"] = rhs
+
+    code = method.generate()
+    interp = python_method_impl(code, function_map=function_map)
+    interp.set_up(t_start=0, dt_start=0.25,
+            context={"y": np.ones((len(decay_rates), 2))})
+
+    sync_times = []
+    for event in interp.run(t_end=1):
+        if (isinstance(event, interp.StateComputed)
+                and event.time_id == "ensemble_sync"):
+            sync_times.append(event.t)
+            t = event.t
+            y = event.state_component
+
+            exact = np.exp(-decay_rates*t).reshape(-1, 1)
+            assert np.max(np.abs(y - exact)) < 1e-7
+
+    assert np.allclose(sync_times, [0.25, 0.5, 0.75, 1])
+
+# }}}
+
+
+# {{{ stabilized methods test
+
+@pytest.mark.parametrize(("method_class", "expected_order"), [
+    (RKC1MethodBuilder, 1),
+    (RKC2MethodBuilder, 2),
+    ])
+def test_rkc_diffusion(python_method_impl, method_class, expected_order):
+    pytest.importorskip("scipy")
+
+    # 1D heat equation with Dirichlet boundaries and a forcing term
+    npoints = 49
+    h = 1/(npoints + 1)
+    x = np.linspace(h, 1 - h, npoints)
+    spectral_radius = 4/h**2
+
+    def rhs(t, y):
+        padded = np.concatenate([[0], y, [0]])
+        return (
+                (padded[2:] - 2*padded[1:-1] + padded[:-2])/h**2
+                + np.sin(t)*x)
+
+    from scipy.integrate import solve_ivp
+    t_end = 0.5
+    reference = solve_ivp(rhs, (0, t_end), np.sin(np.pi*x), method="BDF",
+            rtol=1e-12, atol=1e-14).y[:, -1]
+
+    code = method_class("y").generate()
+
+    from pytools.convergence import EOCRecorder
+    eocrec = EOCRecorder()
+
+    # far beyond the forward Euler limit dt <= 2/spectral_radius
+    for dt in [0.02, 0.01, 0.005]:
+        interp = python_method_impl(code, function_map={
+            "<func>y": rhs,
+            "<func>spectral_radius_y": lambda t, y: spectral_radius,
+            })
+        interp.set_up(t_start=0, dt_start=dt, context={"y": np.sin(np.pi*x)})
+
+        for event in interp.run(t_end=t_end):
+            if isinstance(event, interp.StateComputed):
+                last_event = event
+
+        assert abs(last_event.t - t_end) < 1e-12
+        eocrec.add_data_point(dt,
+                np.max(np.abs(last_event.state_component - reference)))
+
+    print(eocrec.pretty_print())
+    assert eocrec.estimate_order_of_convergence()[0, 1] > 0.9 * expected_order
+
+
+@pytest.mark.parametrize("method_class", [RKC1MethodBuilder, RKC2MethodBuilder])
+def test_rkc_stage_limit(python_method_impl, method_class, max_stages=5):
+    from leap.rk.stabilized import StageLimitExceeded
+
+    method = method_class("y", max_stages=max_stages)
+    code = method.generate()
+
+    # y' = -radius*y, with the largest radius that max_stages can stabilize
+    from pymbolic import evaluate
+    max_radius = 1
+    while evaluate(method.stage_count_bound(2*max_radius)) <= (max_stages-1)**2:
+        max_radius *= 2
+
+    def make_interp(radius):
+        interp = python_method_impl(code, function_map={
+            "<func>y": lambda t, y: -radius*y,
+            "<func>spectral_radius_y": lambda t, y: radius,
+            })
+        interp.set_up(t_start=0, dt_start=1, context={"y": 1.})
+        return interp
+
+    interp = make_interp(max_radius)
+    for event in interp.run(t_end=5):
+        if isinstance(event, interp.StateComputed):
+            last_event = event
+
+    assert abs(last_event.t - 5) < 1e-12
+    assert abs(last_event.state_component) < 1
+
+    interp = make_interp(4*max_radius)
+
+    # generated code reports errors as a StepError
+    with pytest.raises(getattr(interp, "StepError", StageLimitExceeded),
+            match="more than %d stages" % max_stages):
+        for event in interp.run(t_end=5):
+            pass
+
+# }}}
+
+
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         exec(sys.argv[1])
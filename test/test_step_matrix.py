@@ -212,6 +212,267 @@ def test_step_matrix_sparse():
     assert eval_result.data == [-2, -1, 0]
 
 
+def test_multirate_step_matrix_evaluator():
+    from leap.multistep.multirate import (
+            MultiRateMultiStepMethodBuilder, MultiRateHistory as MRHistory)
+    from leap.step_matrix import (
+            StepMatrixFinder, fast_evaluator,
+            get_multirate_linear_test_function_map,
+            make_multirate_step_matrix_evaluator)
+    from pymbolic import var
+
+    method = MultiRateMultiStepMethodBuilder(3, (
+        ("dt", "fast", "=",
+            MRHistory(1, "<func>f", ("fast", "slow"))),
+        ("dt", "slow", "=",
+            MRHistory(2, "<func>s2s", ("slow",)),
+            MRHistory(2, "<func>f2s", ("fast", "slow"))),
+        ), component_arg_names=("f", "s"), static_dt=True)
+
+    _, coefficient_names = get_multirate_linear_test_function_map(
+            method, couplings={"<func>f2s": ["fast"]})
+    assert coefficient_names == ["f_fast", "f_slow", "s2s", "f2s"]
+
+    evaluate_mat = make_multirate_step_matrix_evaluator(
+            method, couplings={"<func>f2s": ["fast"]})
+
+    # compare to a hand-written linear test problem
+    finder = StepMatrixFinder(method.generate(),
+            function_map={
+                "<func>f": lambda t, f, s: var("f_fast")*f + var("f_slow")*s,
+                "<func>s2s": lambda t, s: var("s2s") * s,
+                "<func>f2s": lambda t, f, s: var("f2s") * f,
+                },
+            exclude_variables=["<p>bootstrap_step"])
+    evaluate_ref_mat = fast_evaluator(finder.get_phase_step_matrix("primary"))
+
+    rng = np.random.RandomState(seed=15)
+    coefficients = dict(
+            (name, rng.normal(size=5) + 1j*rng.normal(size=5))
+            for name in ["<dt>"] + coefficient_names)
+
+    mats = evaluate_mat(coefficients)
+    for i, mat in enumerate(mats):
+        ref_mat = evaluate_ref_mat(dict(
+            (name, value[i]) for name, value in coefficients.items()))
+        assert np.allclose(mat, np.array(ref_mat, dtype=np.complex128))
+
+
+def test_multirate_stability_sweep(tmpdir):
+    from leap.stability.multirate import (
+            MethodFactory, DecayMatrixFactory, OscillationMatrixFactory,
+            run_stability_sweep)
+
+    method_factories = [
+            MethodFactory(method="Fq", substep_count=2, meth_order=3),
+            MethodFactory(method="Srsf", substep_count=3, meth_order=3),
+            ]
+    matrix_factories = [
+            cls(ratio=ratio, angle=0.05*np.pi, offset=0.5*np.pi)
+            for cls in [DecayMatrixFactory, OscillationMatrixFactory]
+            for ratio in [0.1, 1]]
+
+    filename = str(tmpdir.join("stability.sqlite"))
+    nresults = run_stability_sweep(filename,
+            method_factories, matrix_factories[:3], max_workers=1, chunk_size=2)
+    assert nresults == 6
+
+    # resuming only computes the missing results
+    nresults = run_stability_sweep(filename,
+            method_factories, matrix_factories, max_workers=1, chunk_size=2)
+    assert nresults == 2
+
+    import sqlite3
+    connection = sqlite3.connect(filename)
+    assert connection.execute("select count(*) from data").fetchone() == (8,)
+
+    # with equal eigenvalues, the methods reduce to single-rate AB3
+    dts = connection.execute(
+            "select dt from data where mat_type='DecayMatrixFactory' "
+            "and ratio=1").fetchall()
+    assert len(dts) == 2
+    for dt, in dts:
+        assert abs(dt - 6/11) < 1e-7
+
+
+def test_multirate_stability_matrix_batches():
+    import leap.stability.multirate as mr
+
+    ratio, angle, offset = np.meshgrid(
+            np.linspace(0.1, 1, 4),
+            np.linspace(0, np.pi, 3, endpoint=False),
+            np.linspace(np.pi/5, np.pi, 5, endpoint=False),
+            indexing="ij")
+
+    for cls in mr.MATRIX_FACTORY_CLASSES:
+        mats = cls.make_matrices(ratio, angle, offset)
+        assert mats.shape == ratio.shape + (2, 2)
+
+        eigvals = la.eigvals(mats)
+        true_eigvals = cls.get_eigenvalues(ratio)
+        for part in [np.real, np.imag]:
+            assert np.allclose(
+                    np.sort(part(eigvals)), np.sort(part(true_eigvals)))
+
+        matrix_facs = [
+                cls(ratio=r, angle=a, offset=o)
+                for r, a, o in zip(ratio.flat, angle.flat, offset.flat)]
+        assert np.allclose(mr.make_matrices(matrix_facs), mats.reshape(-1, 2, 2))
+        assert np.allclose(matrix_facs[7](), mats.reshape(-1, 2, 2)[7])
+
+    # stable time steps found in lockstep match those found one at a time
+    method_fac = mr.MethodFactory(method="Fqsr", substep_count=2, meth_order=3)
+    evaluate_mat = mr.get_step_matrix_evaluator(method_fac)
+    mats = mr.DecayMatrixFactory.make_matrices(
+            ratio, angle, offset).reshape(-1, 2, 2)[::7]
+
+    dts = mr.find_stable_dts(evaluate_mat, mats, prec=1e-8)
+    for mat, dt in zip(mats, dts):
+        assert abs(dt - _find_stable_dt_reference(method_fac(), mat, 1e-8)) < 1e-7
+
+    # the search only returns time steps that were found to be stable
+    def evaluate_threshold_mat(coeffs):
+        # one-by-one step matrices, stable up to the time step in s2s
+        return (coeffs["<dt>"]/coeffs["s2s"])[:, np.newaxis, np.newaxis]
+
+    max_dts = np.array([300, 1000, 1e-3, 1e-10])
+    mats = np.zeros((len(max_dts), 2, 2))
+    mats[:, 1, 1] = max_dts
+
+    dts = mr.find_stable_dts(evaluate_threshold_mat, mats, prec=1e-8)
+    assert abs(dts[0] - 300) < 1e-6
+    # above the cap, with 0.1 * 2**12 stable
+    assert dts[1] == 0.1 * 2**12
+    assert abs(dts[2] - 1e-3) < 1e-8
+    # not stable down to prec
+    assert dts[3] == 0
+    assert (dts <= max_dts).all()
+
+
+def _find_stable_dt_reference(method, mat, prec):
+    # one matrix at a time, with the matrix entries plugged into the
+    # symbolic step, as in the original stability study
+    from leap.step_matrix import StepMatrixFinder, fast_evaluator
+
+    finder = StepMatrixFinder(method.generate(),
+            function_map={
+                "<func>f2f": lambda t, f, s: mat[0, 0] * f,
+                "<func>s2f": lambda t, f, s: mat[0, 1] * s,
+                "<func>f2s": lambda t, f, s: mat[1, 0] * f,
+                "<func>s2s": lambda t, f, s: mat[1, 1] * s,
+                },
+            exclude_variables=["<p>bootstrap_step"])
+    evaluate_mat = fast_evaluator(finder.get_phase_step_matrix("primary"))
+
+    def is_stable(dt):
+        step_mat = np.array(evaluate_mat({"<dt>": dt}), dtype=np.complex128)
+        return np.max(np.abs(la.eigvals(step_mat))) <= 1
+
+    dt = 0.1
+    if is_stable(dt):
+        while is_stable(2*dt):
+            dt *= 2
+        stable, unstable = dt, 2*dt
+    else:
+        while not is_stable(dt/2):
+            dt /= 2
+        stable, unstable = dt/2, dt
+
+    while unstable - stable > prec:
+        mid = (stable + unstable)/2
+        if is_stable(mid):
+            stable = mid
+        else:
+            unstable = mid
+
+    return stable
+
+
+def test_multirate_stability_sweep_resume(tmpdir, monkeypatch):
+    import leap.stability.multirate as mr
+
+    method_factories = [
+            mr.MethodFactory(method="Fq", substep_count=3, meth_order=3),
+            mr.MethodFactory(method="Fq", substep_count=2, meth_order=2),
+            ]
+    matrix_factories = [
+            mr.DecayOscillationMatrixFactory(ratio=ratio, angle=0, offset=1)
+            for ratio in [0.2, 0.4, 0.6, 0.8]]
+
+    filename = str(tmpdir.join("stability.sqlite"))
+
+    # simulate a run that was killed after queueing its jobs
+    store = mr.ResultStore(filename)
+    for method_fac in method_factories:
+        store.add_jobs(method_fac, [matrix_factories[:2], matrix_factories[2:]])
+    store.mark_jobs_running([job_id for job_id, _, _ in store.get_pending_jobs()])
+    store.close()
+
+    find_stable_dts_for_chunk = mr._find_stable_dts_for_chunk
+    calls = []
+
+    def flaky_find_stable_dts_for_chunk(method_fac, matrix_facs, prec):
+        calls.append(method_fac.substep_count)
+        if len(calls) == 1:
+            raise RuntimeError("worker crashed")
+        return find_stable_dts_for_chunk(method_fac, matrix_facs, prec)
+
+    monkeypatch.setattr(mr, "_find_stable_dts_for_chunk",
+            flaky_find_stable_dts_for_chunk)
+
+    nresults = mr.run_stability_sweep(filename,
+            method_factories, matrix_factories, max_workers=1)
+    assert nresults == 8
+
+    # cheap jobs go first, the failed one is retried at the end
+    assert calls == [2, 2, 3, 3, 2]
+
+    import sqlite3
+    connection = sqlite3.connect(filename)
+    assert sorted(connection.execute("select state, attempts from jobs")) == [
+            ("done", 0), ("done", 0), ("done", 0), ("done", 1)]
+    assert connection.execute("select count(*) from data").fetchone() == (8,)
+
+
+def _crashing_find_stable_dts_for_chunk(method_fac, matrix_facs, prec):
+    if matrix_facs[0].ratio == 0.4:
+        import os
+        os._exit(1)
+
+    import leap.stability.multirate as mr
+    return mr._find_stable_dts_for_chunk.__wrapped__(
+            method_fac, matrix_facs, prec)
+
+
+def test_multirate_stability_sweep_worker_crash(tmpdir, monkeypatch):
+    import multiprocessing
+    if multiprocessing.get_start_method() != "fork":
+        pytest.skip("patching the workers requires the 'fork' start method")
+
+    import leap.stability.multirate as mr
+
+    _crashing_find_stable_dts_for_chunk.__wrapped__ = \
+            mr._find_stable_dts_for_chunk
+    monkeypatch.setattr(mr, "_find_stable_dts_for_chunk",
+            _crashing_find_stable_dts_for_chunk)
+
+    matrix_factories = [
+            mr.DecayMatrixFactory(ratio=ratio, angle=0, offset=1)
+            for ratio in [0.2, 0.4, 0.6, 0.8, 1]]
+
+    filename = str(tmpdir.join("stability.sqlite"))
+    nresults = mr.run_stability_sweep(filename,
+            [mr.MethodFactory(method="Fq", substep_count=2, meth_order=2)],
+            matrix_factories, max_workers=2, chunk_size=1, max_attempts=2)
+    assert nresults == 4
+
+    # only the job that kills its worker is charged for it
+    import sqlite3
+    connection = sqlite3.connect(filename)
+    assert sorted(connection.execute("select state, attempts from jobs")) == [
+            ("done", 0), ("done", 0), ("done", 0), ("done", 0), ("failed", 2)]
+
+
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         exec(sys.argv[1])